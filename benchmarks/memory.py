@@ -0,0 +1,89 @@
+'''
+description: memory of the controller per case for very large suites
+    builds the discovery records, the stand-in cases indexed by CaseManage
+    and one ResultLog per case of a generated suite, and reports the bytes
+    per case of every part measured with tracemalloc
+    usage:
+        python benchmarks/memory.py [--cases 50000] [--tags 3] [--max-bytes-per-case N]
+'''
+import argparse
+import datetime
+import gc
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dbtests.case import CaseManage
+from dbtests.dataclass import CaseInfo, ResultLog
+from dbtests.discovery import DiscoveredCase
+
+
+def measure(build):
+    '''
+    return (result of build, bytes allocated by it and still alive)
+    '''
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    return result, tracemalloc.get_traced_memory()[0] - before
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="controller memory per case")
+    parser.add_argument("--cases", type=int, default=50000, help="number of generated cases")
+    parser.add_argument("--tags", type=int, default=3, help="tag paths per case")
+    parser.add_argument("--max-bytes-per-case", type=int, default=None, help="fail above this total")
+    opts = parser.parse_args()
+
+    random.seed(1)
+    # 10 areas, 100 components, 1000 features, the shape of a large suite
+    paths = [f"area{i % 10}/component{i % 100}/feature{i}" for i in range(1000)]
+    now = datetime.datetime.now()
+    tracemalloc.start()
+
+    infos, info_bytes = measure(lambda: [
+        CaseInfo(
+            f"suite/dir{i % 200}/case_{i}.py", f"Case{i}",
+            # decoded from json, every case has its own strings
+            ["".join(path) for path in random.sample(paths, opts.tags)], f"case {i}",
+        )
+        for i in range(opts.cases)
+    ])
+
+    def index():
+        manage = CaseManage(3)
+        cases = [DiscoveredCase(info) for info in infos]
+        for case in cases:
+            manage.add_case(case)
+            for path in case.case_tags:
+                manage.set_case_tag(case, manage.tag_path(path))
+        return manage, cases
+    (manage, cases), index_bytes = measure(index)
+
+    results, result_bytes = measure(lambda: [
+        ResultLog(
+            case_group="suite", case_path=case.case_id, tags=list(case.case_tags),
+            start_time=now, stop_time=now, elapse=1.0, success=True,
+        )
+        for case in cases
+    ])
+    tracemalloc.stop()
+
+    total = (info_bytes + index_bytes + result_bytes) / opts.cases
+    print(f"{opts.cases} cases, {opts.tags} tags each, {len(manage._tags)} tags")
+    print(f"  discovery records  {info_bytes / opts.cases:8.0f} bytes/case")
+    print(f"  indexed stand-ins  {index_bytes / opts.cases:8.0f} bytes/case")
+    print(f"  results            {result_bytes / opts.cases:8.0f} bytes/case")
+    print(f"  total              {total:8.0f} bytes/case, {total * opts.cases / (1 << 20):.1f}MB")
+    if opts.max_bytes_per_case and total > opts.max_bytes_per_case:
+        print(f"FAIL more than {opts.max_bytes_per_case} bytes/case")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
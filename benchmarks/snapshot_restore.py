@@ -0,0 +1,98 @@
+'''
+description: container snapshot round trip of --containers --reset-between
+    starts one server container, writes a row, takes a docker commit
+    snapshot, changes the table and restores the snapshot; fails unless the
+    row written before the snapshot is back, the change after it is gone and
+    no anonymous volume is left behind; reports the time of the snapshot and
+    the restore. needs docker and the client driver of the service
+    usage:
+        python benchmarks/snapshot_restore.py [--service mysql|pgsql] [--password dbtest]
+'''
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dbtests.dataclass import TService
+from dbtests.logger import get_basic_logger
+from dbtests.service import new_service
+from dbtests.service.container import ContainerBackend
+from dbtests.service.snapshot import Snapshotter
+
+
+def volumes() -> set:
+    return set(subprocess.run(
+        ["docker", "volume", "ls", "-q"], stdout=subprocess.PIPE, universal_newlines=True, check=True,
+    ).stdout.split())
+
+
+def rows(service, table: str) -> list:
+    client = service.new_client()
+    try:
+        return [row[0] for row in client.query(f"SELECT v FROM {table} ORDER BY v")]
+    finally:
+        client.close()
+
+
+def execute(service, *sqls) -> None:
+    client = service.new_client()
+    try:
+        for sql in sqls:
+            client.query(sql)
+    finally:
+        client.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="container snapshot round trip")
+    parser.add_argument("--service", choices=["mysql", "pgsql"], default="pgsql")
+    parser.add_argument("--password", default="dbtest")
+    opts = parser.parse_args()
+
+    service = new_service(TService[opts.service.upper()])
+    service.user = "root" if opts.service == "mysql" else "postgres"
+    service.password = opts.password
+    logger = get_basic_logger()
+    before = volumes()
+    # no tmpfs, like --containers --reset-between without databases
+    backend = ContainerBackend(service, logger, workers=1, tmpfs_size=None, name_prefix=f"dbtest-snapcheck-{os.getpid()}")
+    snapshotter = Snapshotter(service, logger)
+    # every statement may get another pooled connection, no USE
+    table = "dbtest.dbtest_snapshot" if opts.service == "mysql" else "dbtest_snapshot"
+    images = []
+    ok = False
+    try:
+        service.endpoints = backend.start()
+        service.host, service.port = service.endpoints[0]
+        if opts.service == "mysql":
+            execute(service, "CREATE DATABASE IF NOT EXISTS dbtest")
+        execute(service, f"CREATE TABLE {table} (v INT)", f"INSERT INTO {table} VALUES (1)")
+
+        start = time.monotonic()
+        snap_id = snapshotter.snapshot(containers=backend.snapshot_args())
+        snapshot_elapse = time.monotonic() - start
+        images = [f"dbtest-snapshot:{name}-{snap_id}" for name in backend.containers]
+        execute(service, f"INSERT INTO {table} VALUES (2)")
+
+        start = time.monotonic()
+        snapshotter.restore(snap_id, containers=backend.snapshot_args())
+        restore_elapse = time.monotonic() - start
+        found = rows(service, table)
+        ok = found == [1]
+        print(f"{'ok  ' if ok else 'FAIL'} {opts.service}: rows after restore {found}, expected [1]")
+        print(f"     snapshot {snapshot_elapse:.3f}s, restore {restore_elapse:.3f}s")
+    finally:
+        backend.stop()
+        if images:
+            subprocess.run(["docker", "image", "rm", "-f", *images], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    leaked = volumes() - before
+    if leaked:
+        print(f"FAIL {len(leaked)} anonymous volumes left: {sorted(leaked)}")
+    return 0 if ok and not leaked else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+'''
+description: startup time budget of the dbtest command line
+    runs the light commands (-v, wrong options) under python -X importtime
+    and fails when their imports take longer than the budget on top of a
+    bare interpreter or pull in a module only the frame needs; the fastest
+    of the runs is checked to keep noise out. the commands run once with
+    TEST_ROOT exported and once with TEST_ROOT only in ~/.dbtest/.env
+    usage:
+        python benchmarks/startup.py [--budget-ms 40] [--runs 5]
+'''
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from typing import Dict, List, Tuple
+
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = [
+    ["-v"],
+    ["--no-such-option"],
+    ["--concurrency", "-1", "--use", "env.yaml"],
+]
+
+# handled before TEST_ROOT is looked up
+ENV_FILE_COMMANDS = [
+    ["-v"],
+    ["--no-such-option"],
+]
+
+# modules the light commands must not import
+HEAVY = [
+    "dbtests.frame",
+    "dbtests.service",
+    "dbtests.scheduler",
+    "multiprocessing",
+    "asyncio",
+    "paramiko",
+    "dotenv",
+    "colorama",
+    "yaml",
+]
+
+
+def import_times(stderr: str) -> Dict[str, int]:
+    '''
+    description: parse "import time: self [us] | cumulative | imported package"
+    return {module: self microseconds}
+    '''
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(self_us)
+    return times
+
+
+def run(args: List[str], env: Dict[str, str], code: str = "from dbtests.main import run_program; run_program()") -> Tuple[float, Dict[str, int]]:
+    start = time.perf_counter()
+    # the way a console script entry point starts dbtest
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code, *args],
+        cwd=REPO, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+    )
+    if "Traceback" in proc.stderr:
+        raise RuntimeError(f"dbtest {' '.join(args)} failed:\n{proc.stderr[proc.stderr.index('Traceback'):]}")
+    return time.perf_counter() - start, import_times(proc.stderr)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="dbtest startup time budget")
+    parser.add_argument("--budget-ms", type=float, default=40.0, help="budget of the imports of one command")
+    parser.add_argument("--runs", type=int, default=5, help="runs per command, the fastest is checked")
+    opts = parser.parse_args()
+
+    env = dict(os.environ, TEST_ROOT=tempfile.mkdtemp(prefix="dbtest-startup-"))
+    bare_wall = min(run([], env, "pass")[0] for _ in range(opts.runs))
+    bare = min(sum(run([], env, "pass")[1].values()) for _ in range(opts.runs)) / 1000
+    print(f"bare interpreter: imports {bare:.1f}ms, wall {bare_wall * 1000:.1f}ms")
+    # TEST_ROOT unset and a .env to load, the light commands must not read it
+    home = tempfile.mkdtemp(prefix="dbtest-startup-home-")
+    os.makedirs(os.path.join(home, ".dbtest"))
+    with open(os.path.join(home, ".dbtest", ".env"), "w") as f:
+        f.write(f"TEST_ROOT={env['TEST_ROOT']}\n")
+    env_file = {k: v for k, v in env.items() if k != "TEST_ROOT"}
+    env_file["HOME"] = home
+    failed = False
+    for args, cmd_env, label in [(args, env, "") for args in COMMANDS] + [(args, env_file, " (.env)") for args in ENV_FILE_COMMANDS]:
+        walls, totals, modules = [], [], {}
+        for _ in range(opts.runs):
+            wall, times = run(args, cmd_env)
+            walls.append(wall)
+            totals.append(sum(times.values()) / 1000)
+            modules = times
+        total = min(totals) - bare
+        heavy = [h for h in HEAVY if any(name == h or name.startswith(h + ".") for name in modules)]
+        ok = total <= opts.budget_ms and not heavy
+        failed |= not ok
+        print(
+            f"{'ok  ' if ok else 'FAIL'} dbtest {' '.join(args)}{label}: imports {total:.1f}ms "
+            f"(budget {opts.budget_ms:.0f}ms), wall {min(walls) * 1000:.1f}ms, {len(modules)} modules"
+        )
+        for name in heavy:
+            print(f"     imports {name}")
+        if total > opts.budget_ms:
+            slowest = sorted(modules.items(), key=lambda item: -item[1])[:5]
+            print("     slowest: " + ", ".join(f"{name} {us / 1000:.1f}ms" for name, us in slowest))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
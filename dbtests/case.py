@@ -1,20 +1,34 @@
+import fnmatch
+import sys
+
 from abc import ABCMeta, abstractmethod
-from typing import Any, Set
+from typing import Any, Dict, Iterable, Iterator, List, Sequence, Set, Tuple
 
 from .logger import  Logger
 from .dataclass import Singleton
+from .client.client import Client
 
 class Case(metaclass=ABCMeta):
+    # subclasses without __slots__ still get a __dict__, the slots keep
+    # stand-ins of very large suites small
+    __slots__ = ("logger", "client", "case_id", "tags", "__weakref__")
+    # tag paths of the case like "storage/compaction", one name per level
+    # from the top, used by --select
+    case_tags: Sequence[str] = ()
+
     def __init__(self, case_id):
         self.logger: Logger = None
+        # connection of the worker running the case, shared by its cases
+        self.client: Client = None
         self.case_id = case_id
-        self.tags: Set[Tag]= set()
+        # a case has a few tags, a tuple is a fraction of an empty set
+        self.tags: Tuple[Tag, ...] = ()
 
     @abstractmethod
     def run(self) -> bool:...
 
     @abstractmethod
-    def desc(self, desc) -> str:
+    def desc(self) -> str:
         '''
         description: describe the case
         return {*}
@@ -31,15 +45,39 @@ class Case(metaclass=ABCMeta):
         ...
 
     def add_tag(self, tag):
-        self.tags.add(tag)
+        if tag not in self.tags:
+            self.tags += (tag,)
+
+    def remove_tag(self, tag):
+        self.tags = tuple(t for t in self.tags if t is not tag)
+
+def iter_bits(bits: int) -> Iterator[int]:
+    '''
+        indexes of the set bits of bits, lowest first
+    '''
+    # scanning the binary string is much faster than shifting a big int
+    digits = bin(bits)[:1:-1]
+    index = digits.find("1")
+    while index >= 0:
+        yield index
+        index = digits.find("1", index + 1)
+
 
 class Tag:
+    __slots__ = ("tag_name", "level", "child_tags", "parent_tags", "_cases", "tag_id", "_manage", "__weakref__")
+
     def __init__(self, tag_name: Any, level: int=None, parent_tag: 'Tag'=None):
-        self.tag_name = tag_name
+        # the same names repeat across many tags and cases
+        self.tag_name = sys.intern(tag_name) if isinstance(tag_name, str) else tag_name
         self.level = level
         self.child_tags = set()
         self.parent_tags = set()
-        self.cases = set()
+        # cases of a tag out of CaseManage, a CaseManage keeps them as a
+        # bitset of case ids instead
+        self._cases: Set[Case] = set()
+        # id and index of the CaseManage the tag is set to
+        self.tag_id: int = None
+        self._manage: 'CaseManage' = None
 
         if parent_tag:
             self.add_parent_tag(parent_tag)
@@ -52,32 +90,199 @@ class Tag:
         return self.__str__()
 
     def add_child_tag(self, child: 'Tag'):
-        self.child_tags.add(child)
-        child.parent_tags.add(self)
+        child.add_parent_tag(self)
 
     def add_parent_tag(self, parent_tag: 'Tag'):
+        if parent_tag in self.parent_tags:
+            return
         self.parent_tags.add(parent_tag)
         parent_tag.child_tags.add(self)
+        manage = self._manage or parent_tag._manage
+        if manage:
+            manage._edge_added(parent_tag, self)
 
     def delete_child_tag(self, child_tag: 'Tag'):
-        self.child_tags.discard(child_tag)
-        child_tag.parent_tags.discard(self)
+        child_tag.delete_parent_tag(self)
 
     def delete_parent_tag(self, parent_tag: 'Tag'):
+        if parent_tag not in self.parent_tags:
+            return
         self.parent_tags.discard(parent_tag)
         parent_tag.child_tags.discard(self)
+        manage = self._manage or parent_tag._manage
+        if manage:
+            manage._edge_removed(parent_tag, self)
+
+    @property
+    def cases(self) -> Set[Case]:
+        if self._manage:
+            return set(self._manage.cases_of(self._manage.tag_cases_bits(self, descendants=False)))
+        return self._cases
 
     def add_case(self, case: Case):
-        self.cases.add(case)
         case.add_tag(self)
+        if self._manage:
+            self._manage._case_added(self, case)
+        else:
+            self._cases.add(case)
+
+    def remove_case(self, case: Case):
+        case.remove_tag(self)
+        if self._manage:
+            self._manage._case_removed(self, case)
+        else:
+            self._cases.discard(case)
 
     def get_parents(self):
         return self.parent_tags
 
-class CaseManage(Singleton):
+class CaseManage(metaclass=Singleton):
+    '''
+        tags of at most `levels` levels and the cases tagged by them;
+        every tag and case gets an integer id, the transitive closure of
+        the tag graph is kept as bitsets of tag ids (python ints) and
+        updated on every edge change, and the cases of a tag as a bitset of
+        case ids, so ancestors, descendants and "cases under X and not
+        under Y" are a few big int operations instead of a graph walk
+        example:
+            manage = CaseManage(3)
+            manage.set_tag_level(storage, 0)
+            manage.set_tag_level(slow, 1, storage)
+            manage.set_case_tag(case, slow)
+            manage.cases_of(manage.select([storage], [slow]))
+    '''
     def __init__(self, levels: int):
         self.levels = levels
         self.root_tags = [set() for _ in range(levels)]
+        # tag id -> Tag, ancestors and descendants bitsets
+        self._tags: List[Tag] = []
+        self._ancestors: List[int] = []
+        self._descendants: List[int] = []
+        # tag id -> bitset of cases tagged directly
+        self._tag_cases: List[int] = []
+        self._cases: List[Case] = []
+        self._case_ids: Dict[Case, int] = {}
+        # tag id -> bitset of cases tagged by the tag or a descendant,
+        # cleared whenever the graph or a membership changes
+        self._subtree_cases: Dict[int, int] = {}
+        # bumped on every change, results computed for an older version are stale
+        self.version = 0
+        # (parent tag id or None, name) -> Tag, for tag paths
+        self._named: Dict[Tuple[int, str], Tag] = {}
+
+    def _register(self, tag: Tag) -> int:
+        if tag._manage is self:
+            return tag.tag_id
+        tag.tag_id = len(self._tags)
+        tag._manage = self
+        self._tags.append(tag)
+        self._ancestors.append(0)
+        self._descendants.append(0)
+        self._tag_cases.append(0)
+        for case in tag._cases:
+            self._case_added(tag, case)
+        tag._cases = None
+        self._changed()
+        return tag.tag_id
+
+    def ensure_levels(self, levels: int) -> None:
+        '''
+            grow the number of levels, CaseManage is a singleton created once
+        '''
+        while self.levels < levels:
+            self.root_tags.append(set())
+            self.levels += 1
+
+    def tag_path(self, path: str) -> Tag:
+        '''
+            the tag of a path like "storage/compaction", tags on the way are
+            created as needed, the n-th name is a tag of level n
+        '''
+        names = [name for name in path.split("/") if name]
+        if not names or len(names) > self.levels:
+            raise ValueError(f"tag path {path} must have 1 to {self.levels} names")
+        parent = None
+        for level, name in enumerate(names):
+            key = (parent.tag_id if parent else None, name)
+            tag = self._named.get(key)
+            if tag is None:
+                tag = Tag(name)
+                self.set_tag_level(tag, level, parent)
+                self._named[key] = tag
+            parent = tag
+        return parent
+
+    def find_tags(self, pattern: str, level: int = None) -> List[Tag]:
+        '''
+            tags whose name matches the shell pattern, of the level if given
+        '''
+        return [
+            tag for tag in self._tags
+            if (level is None or tag.level == level) and fnmatch.fnmatchcase(str(tag.tag_name), pattern)
+        ]
+
+    def _changed(self) -> None:
+        self.version += 1
+        self._subtree_cases.clear()
+
+    def _edge_added(self, parent: Tag, child: Tag) -> None:
+        parent_id, child_id = self._register(parent), self._register(child)
+        above = self._ancestors[parent_id] | (1 << parent_id)
+        below = self._descendants[child_id] | (1 << child_id)
+        for tag_id in iter_bits(above):
+            self._descendants[tag_id] |= below
+        for tag_id in iter_bits(below):
+            self._ancestors[tag_id] |= above
+        self._changed()
+
+    def _edge_removed(self, parent: Tag, child: Tag) -> None:
+        # only ancestors of the child's subtree and descendants of the
+        # parent's ancestors change, recompute them parents first and
+        # children first respectively; other paths may still connect them
+        below = self._descendants[child.tag_id] | (1 << child.tag_id)
+        above = self._ancestors[parent.tag_id] | (1 << parent.tag_id)
+        for tag in self._topological(below):
+            bits = 0
+            for p_tag in tag.parent_tags:
+                bits |= self._ancestors[p_tag.tag_id] | (1 << p_tag.tag_id)
+            self._ancestors[tag.tag_id] = bits
+        for tag in reversed(self._topological(above)):
+            bits = 0
+            for c_tag in tag.child_tags:
+                bits |= self._descendants[c_tag.tag_id] | (1 << c_tag.tag_id)
+            self._descendants[tag.tag_id] = bits
+        self._changed()
+
+    def _topological(self, bits: int) -> List[Tag]:
+        # a tag has more ancestors than any of its parents
+        return sorted((self._tags[tag_id] for tag_id in iter_bits(bits)),
+                      key=lambda tag: bin(self._ancestors[tag.tag_id]).count("1"))
+
+    def _case_id(self, case: Case) -> int:
+        case_id = self._case_ids.get(case)
+        if case_id is None:
+            case_id = self._case_ids[case] = len(self._cases)
+            self._cases.append(case)
+        return case_id
+
+    def _case_added(self, tag: Tag, case: Case) -> None:
+        self._tag_cases[tag.tag_id] |= 1 << self._case_id(case)
+        self._changed()
+
+    def _case_removed(self, tag: Tag, case: Case) -> None:
+        case_id = self._case_ids.get(case)
+        if case_id is not None:
+            self._tag_cases[tag.tag_id] &= ~(1 << case_id)
+            self._changed()
+
+    def add_case(self, case: Case) -> int:
+        '''
+            add a case without tags, so that selections excluding tags see it
+            return the case id
+        '''
+        case_id = self._case_id(case)
+        self._changed()
+        return case_id
 
     def set_tag_level(self, tag: Tag, level: int=0, parent_tag: Tag=None):
         '''
@@ -86,20 +291,22 @@ class CaseManage(Singleton):
         if level > self.levels - 1 or level < 0:
             raise ValueError(f"tag level must be in set [0, {self.levels}]")
 
-        tag.parent_tags = set()
-        tag.child_tags = set()
-        tag.level = level
-
-        if level == 0:
-            self.root_tags[level].add(tag)
-            return
-
-        if not parent_tag or parent_tag not in self.root_tags[level-1]:
+        if level > 0 and (not parent_tag or parent_tag not in self.root_tags[level-1]):
             raise ValueError(f"parent_tag must in root_tags[{level-1}]")
 
-        tag.add_parent_tag(parent_tag)
+        for p_tag in list(tag.parent_tags):
+            tag.delete_parent_tag(p_tag)
+        for c_tag in list(tag.child_tags):
+            c_tag.delete_parent_tag(tag)
+        self._register(tag)
+        if tag.level is not None and tag.level < self.levels:
+            self.root_tags[tag.level].discard(tag)
+        tag.level = level
         self.root_tags[level].add(tag)
 
+        if level > 0:
+            tag.add_parent_tag(parent_tag)
+
     def reset_tag_level(self, tag: Tag, level: int = 0, parent_tag: Tag = None) -> None:
         '''
             reset a Tag(in CaseManage) in the CaseManage
@@ -107,10 +314,8 @@ class CaseManage(Singleton):
         if level > self.levels - 1 or level < 0:
             raise ValueError(f"tag level must be in set [0, {self.levels}]")
 
-        [p_tag.delete_child_tag(tag) for p_tag in tag.parent_tags]
-        [c_tag.delete_parent_tag(tag) for c_tag in tag.child_tags]
-        tag.parent_tags = set()
-        tag.child_tags = set()
+        [tag.delete_parent_tag(p_tag) for p_tag in list(tag.parent_tags)]
+        [c_tag.delete_parent_tag(tag) for c_tag in list(tag.child_tags)]
 
         if level == 0:
             self._set_tag_new_level(tag, level)
@@ -132,14 +337,13 @@ class CaseManage(Singleton):
         tag.level = level
 
     def set_case_tag(self, case: Case, tag: Tag):
-        case.add_tag(tag)
+        self._register(tag)
         tag.add_case(case)
 
     def set_case_level(self, case: Case, level: int):
         for tag in case.tags:
             if tag.level == level:
-                tag.cases.remove(case)
-                case.tags.remove(tag)
+                tag.remove_case(case)
                 break
 
         self.set_case_tag(case, self.root_tags[level-1])
@@ -147,8 +351,7 @@ class CaseManage(Singleton):
     def set_case_parent_tag(self, case: Case, parent_tag):
         for tag in case.tags:
             if tag.parent_tag == parent_tag:
-                tag.cases.remove(case)
-                case.tags.remove(tag)
+                tag.remove_case(case)
                 break
 
         self.set_case_tag(case, parent_tag)
@@ -163,24 +366,64 @@ class CaseManage(Singleton):
         '''
             return all child-tag of tag, include child-tag of child_tag
         '''
-        tags = set()
-        for c_tag in tag.child_tags:
-            tags.add(c_tag)
-            tags.update(self.get_descendants(c_tag))
-        return tags
+        if tag._manage is not self:
+            return set()
+        return {self._tags[tag_id] for tag_id in iter_bits(self._descendants[tag.tag_id])}
 
     def get_ancestors(self, tag: Tag):
         '''
             return all parent-tag of tag, include parent-tag of parent_tag
         '''
-        tags = set()
-        for c_tag in tag.parent_tags:
-            tags.add(c_tag)
-            tags.update(self.get_ancestors(c_tag))
-        return tags
+        if tag._manage is not self:
+            return set()
+        return {self._tags[tag_id] for tag_id in iter_bits(self._ancestors[tag.tag_id])}
+
+    def is_ancestor(self, ancestor: Tag, tag: Tag) -> bool:
+        # a tag of another manage, or one never registered, has no tag_id here
+        if tag._manage is not self or ancestor._manage is not self:
+            return False
+        return bool(self._ancestors[tag.tag_id] >> ancestor.tag_id & 1)
 
     def get_cases_in_tag(self, tag: Tag):
         return tag.cases
 
     def get_case_tags(self, case: Case):
-        return case.tags
\ No newline at end of file
+        return case.tags
+
+    def all_cases_bits(self) -> int:
+        return (1 << len(self._cases)) - 1
+
+    def tag_cases_bits(self, tag: Tag, descendants: bool = True) -> int:
+        '''
+            bitset of the cases tagged by tag, and by its descendants if asked
+        '''
+        if tag._manage is not self:
+            return 0
+        tag_id = tag.tag_id
+        if not descendants:
+            return self._tag_cases[tag_id]
+        bits = self._subtree_cases.get(tag_id)
+        if bits is None:
+            bits = self._tag_cases[tag_id]
+            for d_id in iter_bits(self._descendants[tag_id]):
+                bits |= self._tag_cases[d_id]
+            self._subtree_cases[tag_id] = bits
+        return bits
+
+    def select(self, include: Iterable[Tag] = None, exclude: Iterable[Tag] = None) -> int:
+        '''
+            bitset of the cases under any tag of include (all cases if None)
+            and under no tag of exclude
+        '''
+        if include is None:
+            bits = self.all_cases_bits()
+        else:
+            bits = 0
+            for tag in include:
+                bits |= self.tag_cases_bits(tag)
+        for tag in exclude or ():
+            bits &= ~self.tag_cases_bits(tag)
+        return bits
+
+    def cases_of(self, bits: int) -> List[Case]:
+        return [self._cases[case_id] for case_id in iter_bits(bits)]
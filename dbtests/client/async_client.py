@@ -0,0 +1,62 @@
+import asyncio
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Iterable, List
+
+from .client import Client
+
+
+class AsyncClient:
+    '''
+    description: asyncio api of a connected Client
+        statements run on the pooled connections of the client in a private
+        thread pool, so one process keeps up to max_in_flight statements
+        running without a thread per case; connect the client with
+        max_size >= max_in_flight or statements wait for a connection
+        example:
+            client = MysqlClient()
+            client.connect(host, port, user, password, max_size=200)
+            async with AsyncClient(client, max_in_flight=200) as aclient:
+                rows = await aclient.query("select 1")
+                await aclient.gather(*(aclient.query(sql) for sql in sqls), limit=50)
+    '''
+    def __init__(self, client: Client, max_in_flight: int = 100) -> None:
+        self._client = client
+        self._max_in_flight = max_in_flight
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix=f"{client.name}-async")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    async def _run(self, func, *args) -> Any:
+        return await asyncio.get_event_loop().run_in_executor(self._executor, func, *args)
+
+    async def query(self, sql: str, time_out: int = 5) -> Any:
+        return await self._run(self._client.query, sql, time_out)
+
+    async def execute_many(self, sql: str, rows: Iterable, time_out: int = 5) -> int:
+        return await self._run(self._client.execute_many, sql, list(rows), time_out)
+
+    async def gather(self, *aws: Awaitable, limit: int = None, return_exceptions: bool = False) -> List[Any]:
+        '''
+        description: like asyncio.gather, but at most limit (default max_in_flight)
+            of aws are awaited at the same time; coroutines not started yet
+            do not hold a thread or a connection
+        return results in the order of aws
+        '''
+        semaphore = asyncio.Semaphore(limit or self._max_in_flight)
+
+        async def _limited(aw):
+            async with semaphore:
+                return await aw
+
+        return await asyncio.gather(*(_limited(aw) for aw in aws), return_exceptions=return_exceptions)
+
+    def close(self) -> None:
+        '''
+            stop the thread pool, the wrapped client is left open
+        '''
+        self._executor.shutdown(wait=True)
@@ -1,11 +1,49 @@
+import contextlib
+import itertools
+import time
+
 from abc import ABCMeta, abstractmethod
+from typing import Iterable, List, Sequence
+
+from .pool import ConnectionPool
+from .recorder import SqlRecorder
+from ..dataclass import BulkLoadStats
+
+
+def copy_text(rows: List[Sequence]) -> str:
+    '''
+        encode rows as tab separated text understood by both
+        mysql LOAD DATA and postgresql COPY, None is written as \\N
+    '''
+    lines = []
+    for row in rows:
+        fields = []
+        for value in row:
+            if value is None:
+                fields.append("\\N")
+            else:
+                fields.append(
+                    str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+                )
+        lines.append("\t".join(fields))
+    lines.append("")
+    return "\n".join(lines)
+
+
+def _error_text(e: Exception) -> str:
+    return f"{type(e).__name__}: {e}"
+
 
 class Client(metaclass=ABCMeta):
+    # parameter marker of the db driver
+    placeholder = "%s"
+    # bulk_insert methods, "native" is LOAD DATA/COPY of the concrete client
+    bulk_methods = ("values", "executemany")
+
     def __init__(self, name):
         self.name = name
-        self._connect = None
-        self._record = False
-        self._run_log_dir = None
+        self._connect: ConnectionPool = None
+        self._recorder: SqlRecorder = None
         self._configu: str = None
 
     @abstractmethod
@@ -15,11 +53,18 @@ class Client(metaclass=ABCMeta):
         user: str = None,
         password: str = None,
         config: str = None,  # connect with client config
+        **pool_options,
     ):
         '''
-            return a connector to the db-servecice
+            return a connector to the db-servecice,
+            concrete clients open a ConnectionPool by _open_pool
         '''
 
+    def _open_pool(self, factory, ping=None, **pool_options) -> ConnectionPool:
+        self.close()
+        self._connect = ConnectionPool(factory, ping, **pool_options)
+        return self._connect
+
     @abstractmethod
     def install(self,
         pkg: str = None,
@@ -43,13 +88,150 @@ class Client(metaclass=ABCMeta):
             uninstall client
         '''
 
-    def records(self, sql):
-        if self._record:
-            with open(self._run_log_dir, "a") as f:
-                f.write(f"{sql.strip()};\n")
+    def close(self):
+        if self._connect:
+            self._connect.close()
+            self._connect = None
+        if self._recorder:
+            self._recorder.close()
 
+    def start_recording(self, path: str, session: str = None, compress: bool = False) -> SqlRecorder:
+        '''
+            record every following statement to path, see SqlRecorder
+        '''
+        if self._recorder:
+            self._recorder.close()
+        self._recorder = SqlRecorder(path, session, compress=compress)
+        return self._recorder
+
+    @property
+    def max_connections(self) -> int:
+        '''
+            connections the client opens at most, sessions held at the same time
+        '''
+        return self._connect.max_size
+
+    def records(self, sql: str, start: float, elapse: float, rows: int = None, kind: str = "query", error: str = None):
+        if self._recorder:
+            self._recorder.record(sql, start, elapse, rows, kind, error)
 
-    @abstractmethod
     def query(self, sql: str, time_out: int = 5):
-        cursor = self._connect.cursor()
-        cursor.execute(sql)
\ No newline at end of file
+        '''
+            execute sql on a pooled connection, waiting at most time_out
+            seconds for a free one,
+            return rows of a result set, else the affected row count
+        '''
+        with self._connect.connection(time_out) as conn:
+            cursor = conn.cursor()
+            start, begin = time.time(), time.perf_counter()
+            rows, error = None, None
+            try:
+                cursor.execute(sql)
+                result = cursor.fetchall() if cursor.description else cursor.rowcount
+                rows = len(result) if cursor.description else result
+                return result
+            except Exception as e:
+                error = _error_text(e)
+                raise
+            finally:
+                # failed statements are part of the workload too
+                self.records(sql, start, time.perf_counter() - begin, rows, error=error)
+                cursor.close()
+
+    @contextlib.contextmanager
+    def session(self, time_out: int = 5):
+        '''
+            a cursor of one pooled connection for statements depending on
+            session state such as SET or USE, statements are not recorded;
+            time_out None waits for a free connection as long as it takes
+        '''
+        with self._connect.connection(time_out) as conn:
+            cursor = conn.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+    def execute_many(self, sql: str, rows, time_out: int = 5) -> int:
+        '''
+            execute a parameterized sql once per row of rows on one pooled connection,
+            return the affected row count
+        '''
+        with self._connect.connection(time_out) as conn:
+            cursor = conn.cursor()
+            start, begin = time.time(), time.perf_counter()
+            count, error = None, None
+            try:
+                cursor.executemany(sql, rows)
+                count = cursor.rowcount
+                return count
+            except Exception as e:
+                error = _error_text(e)
+                raise
+            finally:
+                self.records(sql, start, time.perf_counter() - begin, count, "many", error)
+                cursor.close()
+
+    def bulk_insert(self,
+        table: str,
+        columns: Sequence[str],
+        rows: Iterable[Sequence],
+        batch_size: int = 1000,
+        method: str = "values",
+    ) -> BulkLoadStats:
+        '''
+            insert rows into table batch by batch on one pooled connection,
+            rows may be a generator, only one batch is held in memory;
+            method:
+                values: one multi-row INSERT ... VALUES per batch
+                executemany: cursor.executemany per batch
+                native: LOAD DATA / COPY, if the client supports it
+            return BulkLoadStats
+        '''
+        if method not in self.bulk_methods:
+            raise ValueError(f"bulk method of {self.name} must be in {self.bulk_methods}, got {method}")
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be positive, got {batch_size}")
+
+        column_list = ", ".join(columns)
+        row_marks = "(" + ", ".join([self.placeholder] * len(columns)) + ")"
+        stats = BulkLoadStats()
+        start = time.perf_counter()
+        rows = iter(rows)
+        with self._connect.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                while True:
+                    batch = list(itertools.islice(rows, batch_size))
+                    if not batch:
+                        break
+                    batch_start, batch_begin = time.time(), time.perf_counter()
+                    error = None
+                    try:
+                        if method == "values":
+                            sql = f"INSERT INTO {table} ({column_list}) VALUES " + ", ".join([row_marks] * len(batch))
+                            cursor.execute(sql, [value for row in batch for value in row])
+                        elif method == "executemany":
+                            cursor.executemany(f"INSERT INTO {table} ({column_list}) VALUES {row_marks}", batch)
+                        else:
+                            self._load_native(cursor, table, columns, batch)
+                    except Exception as e:
+                        error = _error_text(e)
+                        raise
+                    finally:
+                        self.records(
+                            f"-- bulk_insert {method} into {table} ({column_list})",
+                            batch_start, time.perf_counter() - batch_begin, None if error else len(batch), "bulk", error,
+                        )
+                    stats.rows += len(batch)
+                    stats.batches += 1
+            finally:
+                cursor.close()
+        stats.elapse = time.perf_counter() - start
+        return stats
+
+    def _load_native(self, cursor, table: str, columns: Sequence[str], batch: List[Sequence]) -> None:
+        '''
+            load one batch by the bulk load command of the db
+        '''
+        raise NotImplementedError(f"{self.name} has no native bulk load")
@@ -0,0 +1,71 @@
+import os
+import tempfile
+
+from .client import Client, copy_text
+
+
+class MysqlClient(Client):
+    '''
+    description: mysql client on pymysql, connections are pooled
+        example:
+            client = MysqlClient()
+            client.connect(host, 3306, "root", password, max_size=4)
+            client.query("select 1")
+            client.close()
+    '''
+    default_port = 3306
+    bulk_methods = Client.bulk_methods + ("native",)
+
+    def __init__(self, name: str = "mysql") -> None:
+        super().__init__(name)
+
+    def connect(self,
+        host: str = None,
+        port: int = None,
+        user: str = None,
+        password: str = None,
+        config: str = None,
+        **pool_options,
+    ):
+        import pymysql
+
+        self._configu = config
+
+        def _new_connection():
+            kwargs = dict(
+                host=host or "localhost",
+                port=port or self.default_port,
+                user=user or "root",
+                password=password or "",
+                autocommit=True,
+                # LOAD DATA LOCAL INFILE of bulk_insert
+                local_infile=True,
+            )
+            if config:
+                kwargs["read_default_file"] = config
+            return pymysql.connect(**kwargs)
+
+        return self._open_pool(_new_connection, lambda conn: conn.ping(reconnect=False), **pool_options)
+
+    def _load_native(self, cursor, table, columns, batch):
+        with tempfile.NamedTemporaryFile("w", encoding="utf8", suffix=".tsv") as f:
+            f.write(copy_text(batch))
+            f.flush()
+            cursor.execute(
+                f"LOAD DATA LOCAL INFILE %s INTO TABLE {table} "
+                f"CHARACTER SET utf8mb4 ({', '.join(columns)})",
+                (f.name,),
+            )
+
+    def install(self,
+        pkg: str = None,
+        host: str = None,
+        version: str = None
+    ) -> None:
+        if pkg:
+            os.system(f"yum localinstall -y {pkg} || apt-get install -y {pkg}")
+        else:
+            os.system("yum install -y mysql || apt-get install -y mysql-client")
+
+    def unstall(self):
+        os.system("yum remove -y mysql || apt-get remove -y mysql-client")
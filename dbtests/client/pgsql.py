@@ -0,0 +1,66 @@
+import io
+import os
+
+from .client import Client, copy_text
+
+
+def _ping(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT 1")
+
+
+class PgClient(Client):
+    '''
+    description: postgresql client on psycopg2, connections are pooled
+        example:
+            client = PgClient()
+            client.connect(host, 5432, "postgres", password, max_size=4)
+            client.query("select 1")
+            client.close()
+    '''
+    default_port = 5432
+    bulk_methods = Client.bulk_methods + ("native",)
+
+    def __init__(self, name: str = "pgsql") -> None:
+        super().__init__(name)
+
+    def connect(self,
+        host: str = None,
+        port: int = None,
+        user: str = None,
+        password: str = None,
+        config: str = None,  # libpq connection string
+        **pool_options,
+    ):
+        import psycopg2
+
+        self._configu = config
+
+        def _new_connection():
+            conn = psycopg2.connect(
+                config or "",
+                host=host or "localhost",
+                port=port or self.default_port,
+                user=user or "postgres",
+                password=password or "",
+            )
+            conn.autocommit = True
+            return conn
+
+        return self._open_pool(_new_connection, _ping, **pool_options)
+
+    def _load_native(self, cursor, table, columns, batch):
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", io.StringIO(copy_text(batch)))
+
+    def install(self,
+        pkg: str = None,
+        host: str = None,
+        version: str = None
+    ) -> None:
+        if pkg:
+            os.system(f"yum localinstall -y {pkg} || apt-get install -y {pkg}")
+        else:
+            os.system("yum install -y postgresql || apt-get install -y postgresql-client")
+
+    def unstall(self):
+        os.system("yum remove -y postgresql || apt-get remove -y postgresql-client")
@@ -0,0 +1,230 @@
+import asyncio
+import contextlib
+import threading
+import time
+
+from collections import deque
+from typing import Any, Callable, Deque
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PoolClosed(Exception):
+    pass
+
+
+class _Pooled:
+    def __init__(self, conn: Any) -> None:
+        self.conn = conn
+        self.created = time.monotonic()
+        self.last_used = self.created
+
+
+class ConnectionPool:
+    '''
+    description: pool of db connections shared by the threads and coroutines of one process
+        example:
+            pool = ConnectionPool(lambda: pymysql.connect(...), lambda conn: conn.ping(False))
+            with pool.connection() as conn:
+                conn.cursor().execute(sql)
+            async with pool.connection_async() as conn:
+                ...
+    param {factory} open a new connection
+    param {ping} raise if a connection is broken, only called for connections
+        idle longer than ping_interval seconds
+    param {min_size} connections opened up front and kept open
+    param {max_size} connections open at most, checkout waits when all are in use
+    param {idle_timeout} close idle connections above min_size after these seconds
+    param {max_lifetime} recycle connections older than these seconds
+    '''
+    def __init__(self,
+        factory: Callable[[], Any],
+        ping: Callable[[Any], Any] = None,
+        min_size: int = 1,
+        max_size: int = 8,
+        idle_timeout: float = 300.0,
+        max_lifetime: float = 3600.0,
+        ping_interval: float = 1.0,
+    ) -> None:
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"pool size must be 0 <= min_size <= max_size and max_size >= 1, got {min_size}, {max_size}")
+        self._factory = factory
+        self._ping = ping
+        self._min_size = min_size
+        self._max_size = max_size
+        self._idle_timeout = idle_timeout
+        self._max_lifetime = max_lifetime
+        self._ping_interval = ping_interval
+
+        self._cond = threading.Condition()
+        self._idle: Deque[_Pooled] = deque()
+        self._in_use = {}
+        # opened connections, including the ones being opened right now
+        self._size = 0
+        self._closed = False
+
+        for _ in range(min_size):
+            with self._cond:
+                self._size += 1
+            self._idle.append(self._open())
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def max_size(self) -> int:
+        return self._max_size
+
+    def _open(self) -> _Pooled:
+        # the caller reserved the slot by self._size += 1 under the lock
+        try:
+            return _Pooled(self._factory())
+        except BaseException:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def _discard(self, pooled: _Pooled) -> None:
+        with contextlib.suppress(Exception):
+            pooled.conn.close()
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def _reap_locked(self, now: float) -> Deque[_Pooled]:
+        '''
+            take the connections idle longer than idle_timeout above min_size
+            out of the pool, the least recently used are at the left end;
+            their slots are freed at once, the caller closes them unlocked
+        '''
+        expired: Deque[_Pooled] = deque()
+        while (self._idle and self._size > self._min_size
+               and now - self._idle[0].last_used > self._idle_timeout):
+            expired.append(self._idle.popleft())
+            self._size -= 1
+        if expired:
+            self._cond.notify(len(expired))
+        return expired
+
+    def _close_all(self, pooled_list) -> None:
+        for pooled in pooled_list:
+            with contextlib.suppress(Exception):
+                pooled.conn.close()
+
+    def _usable(self, pooled: _Pooled, now: float) -> bool:
+        if now - pooled.created > self._max_lifetime:
+            return False
+        if self._ping and now - pooled.last_used > self._ping_interval:
+            try:
+                self._ping(pooled.conn)
+            except Exception:
+                return False
+        return True
+
+    def acquire(self, timeout: float = None) -> Any:
+        '''
+        description: check out a connection, wait at most timeout seconds
+            when max_size connections are in use
+        return connection
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._cond:
+                expired = self._reap_locked(time.monotonic())
+                while True:
+                    if self._closed:
+                        raise PoolClosed("pool is closed")
+                    if self._idle:
+                        # most recently used first, so surplus ones can idle out
+                        pooled = self._idle.pop()
+                        break
+                    if self._size < self._max_size:
+                        # reserve the slot while still holding the lock
+                        self._size += 1
+                        pooled = None
+                        break
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self._close_all(expired)
+                        raise PoolTimeout(f"no connection available in {timeout}s")
+                    self._cond.wait(remaining)
+
+            self._close_all(expired)
+            if pooled is None:
+                pooled = self._open()
+            elif not self._usable(pooled, time.monotonic()):
+                self._discard(pooled)
+                continue
+
+            with self._cond:
+                self._in_use[id(pooled.conn)] = pooled
+            return pooled.conn
+
+    def release(self, conn: Any, broken: bool = False) -> None:
+        '''
+        description: give back a connection, broken ones are closed
+        '''
+        with self._cond:
+            pooled = self._in_use.pop(id(conn))
+            if not broken and not self._closed:
+                pooled.last_used = time.monotonic()
+                self._idle.append(pooled)
+                self._cond.notify()
+                expired = self._reap_locked(pooled.last_used)
+                pooled = None
+        if pooled is None:
+            self._close_all(expired)
+            return
+        self._discard(pooled)
+
+    @contextlib.contextmanager
+    def connection(self, timeout: float = None):
+        conn = self.acquire(timeout)
+        broken = False
+        try:
+            yield conn
+        except Exception:
+            broken = not self._alive(conn)
+            raise
+        finally:
+            self.release(conn, broken)
+
+    async def acquire_async(self, timeout: float = None) -> Any:
+        # waiting for a free connection must not block the event loop
+        return await asyncio.get_event_loop().run_in_executor(None, self.acquire, timeout)
+
+    @contextlib.asynccontextmanager
+    async def connection_async(self, timeout: float = None):
+        conn = await self.acquire_async(timeout)
+        broken = False
+        try:
+            yield conn
+        except Exception:
+            broken = not self._alive(conn)
+            raise
+        finally:
+            self.release(conn, broken)
+
+    def _alive(self, conn: Any) -> bool:
+        if not self._ping:
+            return True
+        try:
+            self._ping(conn)
+            return True
+        except Exception:
+            return False
+
+    def close(self) -> None:
+        '''
+        description: close idle connections, connections in use are closed on release
+        '''
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, deque()
+            self._cond.notify_all()
+        for pooled in idle:
+            self._discard(pooled)
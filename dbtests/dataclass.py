@@ -1,9 +1,10 @@
-from dataclasses import dataclass
-from typing import List, Any
+from dataclasses import dataclass, fields
+from typing import List, Any, Tuple
 from enum import Enum
 
 import datetime
 import json
+import sys
 
 
 class TService(Enum):
@@ -32,10 +33,26 @@ class CmdOption:
     env_init: bool = False
 
     log_level: str = None
+    worker_log: bool = False
+    sql_recording: bool = False
+    sql_compress: bool = False
+
+    replay: List[str] = None
+    replay_speed: str = "recorded"
+    replay_parallel: int = None
 
     cases: List[str] = None
+    select: str = None
     group_files: List[str] = None
     group_dirs: List[str] = None
+    concurrency: int = 1
+    early_stop: bool = False
+    shard: Tuple[int, int] = None
+    # {case path: elapse} json shared by every machine of a sharded run
+    shard_timings: str = None
+    # restore the environment snapshot between case groups or cases
+    reset_between: str = None
+    uniform_dist: bool = False
 
 
 class DBJsonEncoder(json.JSONEncoder):
@@ -44,9 +61,28 @@ class DBJsonEncoder(json.JSONEncoder):
         if isinstance(o, datetime.datetime):
             return o.strftime("%Y-%m-%d %H:%M:%S.%f")
         else:
-            super(DBJsonEncoder, self).default(o)
+            return super(DBJsonEncoder, self).default(o)
+
+
+# building an encoder is a large part of one dumps call, share a single one
+_result_encoder = DBJsonEncoder(ensure_ascii=False)
+
 
+def slotted(cls):
+    '''
+    description: dataclass(slots=True) of python 3.10+ for older pythons,
+        put it above @dataclass; instances have no __dict__ and take about
+        half the memory, for classes kept once per case
+    '''
+    names = tuple(field.name for field in fields(cls))
+    # the generated __init__ holds the defaults, class attributes of the
+    # same names would conflict with the slots
+    body = {key: value for key, value in cls.__dict__.items() if key not in names + ("__dict__", "__weakref__")}
+    body["__slots__"] = names
+    return type(cls)(cls.__name__, cls.__bases__, body)
 
+
+@slotted
 @dataclass
 class ResultLog:
     case_group: str = ""
@@ -62,10 +98,75 @@ class ResultLog:
     report: Any = None
 
     def to_json(self):
-        if self.start_time and self.stop_time:
-            delta = self.stop_time - self.start_time
-            self.elapse = delta.seconds + delta.microseconds / 1000000
-        return json.dumps(self.__dict__, cls=DBJsonEncoder, ensure_ascii=False)
+        if self.elapse is None and self.start_time and self.stop_time:
+            self.elapse = (self.stop_time - self.start_time).total_seconds()
+        return _result_encoder.encode({name: getattr(self, name) for name in self.__slots__})
+
+
+@dataclass
+class BulkLoadStats:
+    rows: int = 0
+    batches: int = 0
+    elapse: float = 0.0
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.elapse if self.elapse else 0.0
+
+
+@dataclass
+class RemoteResult:
+    host: str = None
+    output: str = ""
+    error: str = ""
+    exit_status: int = None
+    elapse: float = None
+
+    @property
+    def ok(self) -> bool:
+        return self.exit_status == 0
+
+
+@dataclass
+class TransferResult:
+    host: str = None
+    src: str = None
+    dst: str = None
+    # bytes sent, less than the file size when resumed
+    bytes: int = 0
+    skipped: bool = False
+    elapse: float = None
+
+
+@dataclass
+class StepResult:
+    step: str = None
+    host: str = None
+    # ok, failed, skipped (a dependency failed) or cached (nothing to do)
+    status: str = None
+    attempts: int = 0
+    # seconds from the start of the deployment
+    start: float = None
+    elapse: float = None
+    error: str = ""
+
+    @property
+    def ok(self) -> bool:
+        return self.status in ("ok", "cached")
+
+
+@slotted
+@dataclass
+class CaseInfo:
+    # what discovery knows of a Case subclass without importing its file
+    case_id: str = None
+    class_name: str = None
+    case_tags: Tuple[str, ...] = ()
+    desc: str = None
+
+    def __post_init__(self):
+        # tag paths repeat across the cases of a suite
+        self.case_tags = tuple(sys.intern(path) for path in self.case_tags)
 
 
 class Singleton(type):
@@ -0,0 +1,241 @@
+import ast
+import dataclasses
+import hashlib
+import json
+import os
+
+from typing import Dict, List
+
+from .case import Case
+from .dataclass import CaseInfo
+from .scheduler import load_cases
+
+
+class _NeedImport(Exception):
+    '''
+        the case file can only be understood by importing it
+    '''
+
+
+def _base_name(node: ast.expr) -> str:
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    return None
+
+
+def _is_abstract(func: ast.FunctionDef) -> bool:
+    return any(_base_name(decorator) == "abstractmethod" for decorator in func.decorator_list)
+
+
+def _literal_desc(func: ast.FunctionDef):
+    body = func.body
+    if len(body) > 1 and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant):
+        # docstring
+        body = body[1:]
+    if len(body) == 1 and isinstance(body[0], ast.Return) and isinstance(body[0].value, ast.Constant):
+        return body[0].value.value
+    return _NeedImport
+
+
+def _class_attrs(node: ast.ClassDef, bases: List[dict]) -> dict:
+    methods = {item.name: item for item in node.body if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef))}
+    abstract = set()
+    for base in reversed(bases):
+        abstract |= base["abstract"]
+    abstract -= {name for name, func in methods.items() if not _is_abstract(func)}
+    abstract |= {name for name, func in methods.items() if _is_abstract(func)}
+
+    # the first base wins like in the mro
+    case_tags = next((base["case_tags"] for base in bases), ())
+    desc = next((base["desc"] for base in bases), None)
+    for item in node.body:
+        targets = item.targets if isinstance(item, ast.Assign) else [item.target] if isinstance(item, ast.AnnAssign) else []
+        if any(isinstance(target, ast.Name) and target.id == "case_tags" for target in targets):
+            try:
+                case_tags = list(ast.literal_eval(item.value))
+            except (ValueError, TypeError):
+                case_tags = _NeedImport
+    if "desc" in methods:
+        desc = _literal_desc(methods["desc"])
+    return {"abstract": abstract, "case_tags": case_tags, "desc": desc}
+
+
+def parse_case_file(source: str, case_id: str) -> List[CaseInfo]:
+    '''
+    description: find the cases of a case file from its syntax tree, the same
+        ones load_cases would instantiate: top level Case subclasses which are
+        not abstract; raise _NeedImport when a base class comes from another
+        module or case_tags/desc() are not literals
+    return [CaseInfo]
+    '''
+    tree = ast.parse(source)
+    cases: Dict[str, dict] = {"Case": {"abstract": {"run", "desc"}, "case_tags": (), "desc": None}}
+    others = set()
+    found = {}
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        names = [_base_name(base) for base in node.bases]
+        bases = [cases[name] for name in names if name in cases]
+        if not bases:
+            if any(name not in others and name not in ("object", "ABC") for name in names):
+                raise _NeedImport(f"base of {node.name} at line {node.lineno}")
+            others.add(node.name)
+            continue
+        cases[node.name] = _class_attrs(node, bases)
+        if not cases[node.name]["abstract"]:
+            found[node.name] = cases[node.name]
+
+    infos = []
+    # inspect.getmembers orders by name
+    for name in sorted(found):
+        attrs = found[name]
+        if attrs["case_tags"] is _NeedImport or attrs["desc"] is _NeedImport:
+            raise _NeedImport(f"case_tags or desc of {name}")
+        infos.append(CaseInfo(
+            case_id=case_id if len(found) == 1 else f"{case_id}::{name}",
+            class_name=name,
+            case_tags=attrs["case_tags"],
+            desc=attrs["desc"] if isinstance(attrs["desc"], str) else None,
+        ))
+    return infos
+
+
+def import_case_file(case_path: str, case_root: str) -> List[CaseInfo]:
+    infos = []
+    for case in load_cases(case_path, case_root):
+        try:
+            desc = case.desc()
+        except Exception:
+            desc = None
+        infos.append(CaseInfo(case.case_id, type(case).__name__, case.case_tags, desc))
+    return infos
+
+
+class DiscoveredCase(Case):
+    '''
+        stand-in of a case known from discovery, enough for CaseManage and
+        --select; the case file is imported by the worker which runs it
+    '''
+    __slots__ = ("case_tags", "_desc")
+
+    def __init__(self, info: CaseInfo) -> None:
+        super().__init__(info.case_id)
+        self.case_tags = info.case_tags
+        self._desc = info.desc
+
+    def run(self) -> bool:
+        raise RuntimeError(f"{self.case_id} is discovered only, run it with load_cases")
+
+    def desc(self) -> str:
+        return self._desc
+
+
+class CaseDiscovery:
+    '''
+    description: cases of the case files without importing them
+        every file is parsed once and its cases (id, class name, case_tags
+        and desc) are kept in a manifest under root; an unchanged mtime and
+        size reuse the entry, a changed one is checked by sha256 so touched
+        files are not parsed again; files the parser can't follow (Case base
+        classes from other modules, computed case_tags or desc) are imported
+        once instead; only changed files are parsed on the next run
+        example:
+            discovery = CaseDiscovery(case_root)
+            infos = discovery.discover(case_paths)
+            cases = discovery.stand_ins(case_paths)
+    '''
+    root = "~/.dbtest/cases"
+    version = 1
+
+    def __init__(self, case_root: str, root: str = None) -> None:
+        self.case_root = os.path.abspath(case_root)
+        key = hashlib.sha256(self.case_root.encode()).hexdigest()[:12]
+        self.path = os.path.join(os.path.expanduser(root or self.root), f"cases-{key}.json")
+        self._files: Dict[str, dict] = None
+        self._dirty = False
+        # files parsed and imported by this discovery
+        self.parsed = 0
+        self.imported = 0
+
+    def _load(self) -> Dict[str, dict]:
+        if self._files is None:
+            try:
+                with open(self.path, "r", encoding="utf8") as f:
+                    data = json.load(f)
+                self._files = data["files"] if data.get("version") == self.version else {}
+            except (OSError, ValueError, KeyError):
+                self._files = {}
+        return self._files
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+        files = {
+            rel: entry for rel, entry in self._files.items()
+            if os.path.exists(os.path.join(self.case_root, rel))
+        }
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".tmp", "w", encoding="utf8") as f:
+            json.dump({"version": self.version, "case_root": self.case_root, "files": files}, f, ensure_ascii=False)
+        os.replace(self.path + ".tmp", self.path)
+        self._dirty = False
+
+    def cases(self, case_path: str) -> List[CaseInfo]:
+        '''
+        description: cases of one file, of the named case for "file.py::Class"
+        return [CaseInfo], raise when the file can't be parsed nor imported
+        '''
+        case_path, _, class_name = case_path.partition("::")
+        rel = os.path.relpath(case_path, self.case_root)
+        files = self._load()
+        stat = os.stat(case_path)
+        entry = files.get(rel)
+        if not (entry and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size):
+            with open(case_path, "rb") as f:
+                source = f.read()
+            sha = hashlib.sha256(source).hexdigest()
+            if not (entry and entry["sha256"] == sha):
+                entry = {"sha256": sha, "cases": [dataclasses.asdict(info) for info in self._scan(case_path, rel, source)]}
+            entry.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+            files[rel] = entry
+            self._dirty = True
+        infos = [CaseInfo(**case) for case in entry["cases"]]
+        return [info for info in infos if not class_name or info.class_name == class_name]
+
+    def _scan(self, case_path: str, rel: str, source: bytes) -> List[CaseInfo]:
+        try:
+            infos = parse_case_file(source.decode("utf8"), rel)
+            self.parsed += 1
+        except _NeedImport:
+            infos = import_case_file(case_path, self.case_root)
+            self.imported += 1
+        return infos
+
+    def discover(self, case_paths: List[str]) -> Dict[str, List[CaseInfo]]:
+        '''
+        description: cases of many files, the manifest is saved once
+        return {case_path: [CaseInfo]}, None for a file with syntax or import
+            errors, its worker reports them
+        '''
+        result = {}
+        try:
+            for case_path in case_paths:
+                try:
+                    result[case_path] = self.cases(case_path)
+                except Exception:
+                    result[case_path] = None
+        finally:
+            self.save()
+        return result
+
+    def stand_ins(self, case_paths: List[str]) -> Dict[str, List[Case]]:
+        '''
+        return {case_path: [DiscoveredCase]}, None like discover()
+        '''
+        return {
+            case_path: None if infos is None else [DiscoveredCase(info) for info in infos]
+            for case_path, infos in self.discover(case_paths).items()
+        }
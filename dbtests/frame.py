@@ -1,3 +1,5 @@
+import asyncio
+import glob
 import multiprocessing
 import os
 import random
@@ -9,27 +11,50 @@ import traceback
 from typing import Tuple
 
 from .dataclass import CmdOption, ResultLog
-from .logger import Logger, ThreadLogger
-from .service import Service
+from .logger import Logger, ThreadLogger, merge_log_files
+from .service import Service, new_service
+from .service.container import ContainerBackend
+from .service.manifest import EnvManifest
+from .service.orchestrator import DeployOrchestrator, load_nodes, primary_node
+from .service.snapshot import Snapshotter
 from .case import CaseManage
+from .replay import ReplayEngine, write_report
+from .result import ResultSink
+from .scheduler import (
+    CaseScheduler, load_case_timings, load_shard_timings, lpt_partition, order_by_duration, path_partition,
+    reset_batches, resolve_cases, select_cases, write_shard_timings,
+)
+from .discovery import CaseDiscovery
+from .select import compile_select
+from .util.file2data import read_yaml
+from .util.remote import Remote
 
 
 class DBTestFrame:
+    # max log batches waiting for ThreadLogger
+    log_queue_size = 1024
+
     def __init__(self, opts: CmdOption) -> None:
         self._opts: CmdOption = opts
         self._cmds: str = opts.cmds
-        self._T: Service = opts.T
+        self._T: Service = new_service(opts.T)
 
         self._test_root: str = os.environ["TEST_ROOT"]
 
-        self._run_test = self._opts.cases or self._opts.group_dirs or self._opts.group_files
+        self._run_test = self._opts.cases or self._opts.group_dirs or self._opts.group_files or self._opts.select
         self._set_up_only: bool = self._opts.setup and not self._run_test
 
         self._run_log_dir, self._log_dir_name = self._get_run_log_dir()
+        self._log_file = os.path.join(self._run_log_dir, self._T.dbtest_log_file_name)
         self._logger: Logger = None
+        self._thread_logger: ThreadLogger = None
         self._init_log()
+        self._T.logger = self._logger
 
         self._case_group: CaseManage = None
+        # snapshot of the freshly deployed environment restored by --reset
+        self._snapshot_id: str = None
+        self._containers: ContainerBackend = None
 
 
     def _get_run_log_dir(self) -> Tuple[str, str]:
@@ -42,6 +67,8 @@ class DBTestFrame:
             log_dir_name.append(self._opts.tag)
         elif self._opts.destroy:
             log_dir_name.append("destroy")
+        elif self._opts.replay:
+            log_dir_name.append("replay")
         elif self._set_up_only:
             log_dir_name.append("setup")
         elif self._opts.cases:
@@ -63,10 +90,15 @@ class DBTestFrame:
         create logger
         """
         os.makedirs(self._run_log_dir)
-        log_queue = multiprocessing.Queue()
-        thread_logger = ThreadLogger(os.path.join(self._run_log_dir, self._T.dbtest_log_file_name), log_queue, self._opts.log_level)
-        self._logger = Logger(log_queue)
-        thread_logger.start()
+        # bounded, so producers notice backpressure and drop debug records
+        log_queue = multiprocessing.Queue(maxsize=self.log_queue_size)
+        log_file = self._log_file
+        if self._opts.worker_log:
+            # merged with the worker log files into log_file when finished
+            log_file += ".main"
+        self._thread_logger = ThreadLogger(log_file, log_queue, self._opts.log_level, keyed=self._opts.worker_log)
+        self._logger = Logger(log_queue, self._opts.log_level)
+        self._thread_logger.start()
         # self._logger = Logger(os.path.join(self._run_log_dir, "test.log"))
         self._logger.info(f"run log dir is {self._run_log_dir}")
 
@@ -99,19 +131,221 @@ class DBTestFrame:
     Date: 2023-03-15 00:55:11
     param {*} self
     '''
-    def main_work(self):
+    def main_work(self) -> bool:
+        '''
+            return True if the run succeeded, False if cases failed or were cancelled
+        '''
         if self._opts.setup:
-            self._T.setup(self._opts.containers, self._opts.swarm)
+            self._setup()
         elif self._opts.destroy:
             self._T.destroy()
+            env = read_yaml(self._opts.destroy) or {}
+            if env.get("nodes"):
+                # the next --setup must install the package again
+                DeployOrchestrator(self._T, self._logger).forget(load_nodes(env))
+            EnvManifest(self._opts.destroy).remove()
         elif self._opts.use:
             self._use()
+            if self._opts.reset:
+                self._reset()
+
+        if self._run_test:
+            return self._run_cases()
+        elif self._opts.replay:
+            return self._replay()
+        return True
+
+    def _setup(self):
+        env = read_yaml(self._opts.setup)
+        if self._opts.containers:
+            self._setup_containers(env)
+        else:
+            self._deploy(env, self._opts.server_pkg)
+            self._attach(env)
+        if self._opts.keep or self._opts.reset or self._opts.reset_between:
+            self._snapshot_id = self._snapshotter().snapshot(self._T.nodes, self._container_args())
+        if self._opts.keep:
+            EnvManifest(self._opts.setup).write(self._T, self._T.nodes, self._opts.server_pkg, self._snapshot_id)
+
+    def _setup_containers(self, env):
+        # one server per case worker, cases never share server state
+        databases = (env or {}).get("databases") or []
+        # a container snapshot is a docker commit, which skips tmpfs
+        commit_snapshot = self._opts.reset_between and not databases
+        self._containers = ContainerBackend(
+            self._T, self._logger,
+            workers=self._opts.concurrency,
+            network=self._opts.docker_network or "dbtest",
+            image=(env or {}).get("image"),
+            tmpfs_size=None if commit_snapshot else "2g",
+        )
+        self._T.endpoints = self._containers.start()
+        self._T.host, self._T.port = self._T.endpoints[0]
+        self._T.databases = databases
+
+    def _snapshotter(self) -> Snapshotter:
+        return Snapshotter(self._T, self._logger)
+
+    def _container_args(self):
+        return self._containers.snapshot_args() if self._containers else None
+
+    def _stop_containers(self):
+        # --keep and --use are rejected with --containers, nothing can
+        # reattach the containers, so they and their snapshot go with the run
+        if self._snapshot_id:
+            try:
+                self._snapshotter().drop(self._snapshot_id, self._T.nodes, self._container_args())
+            except Exception as e:
+                self._logger.error(f"failed to drop snapshot {self._snapshot_id}: {e}")
+        self._containers.stop()
+
+    def _deploy(self, env, pkg_path=None, only=None):
+        results = DeployOrchestrator(self._T, self._logger).deploy(env, pkg_path, self._run_log_dir, only)
+        if not all(result.ok for result in results):
+            raise RuntimeError(f"failed to deploy {self._opts.setup or self._opts.use}, see {DeployOrchestrator.report_file_name}")
+
+    def _attach(self, env):
+        # cases connect to the primary node
+        nodes = load_nodes(env)
+        primary = primary_node(nodes)
+        self._T.host, self._T.port = primary["host"], primary.get("port", self._T.port)
+        self._T.nodes = nodes
+        self._T.databases = env.get("databases") or []
+
+    def _reset(self):
+        if self._snapshot_id is None:
+            self._logger.error("no snapshot of the environment to reset to, run --setup with --keep first")
+            return
+        self._snapshotter().restore(self._snapshot_id, self._T.nodes, self._container_args())
 
     def _use(self):
-        self._T.use()
+        manifest = EnvManifest(self._opts.use)
+        if manifest.load() is None:
+            self._T.use()
+            return
+        # kept by --setup --keep, reattach and redeploy only drifted nodes
+        env = read_yaml(self._opts.use)
+        self._attach(env)
+        self._snapshot_id = manifest.data.get("snapshot")
+        start = time.monotonic()
+        with Remote(self._logger) as remote:
+            drifted = asyncio.run(manifest.validate(self._T, remote, self._T.nodes, self._opts.server_pkg))
+        self._logger.info(f"validated {len(self._T.nodes)} nodes of {manifest.path} in {time.monotonic() - start:.3f}s")
+        if drifted:
+            for host, reason in drifted.items():
+                self._logger.info(f"node {host} drifted: {reason}")
+            pkg_path = self._opts.server_pkg or (manifest.data.get("package") or {}).get("path")
+            if pkg_path and not os.path.exists(pkg_path):
+                pkg_path = None
+            self._deploy(env, pkg_path, list(drifted))
+            manifest.write(self._T, self._T.nodes, pkg_path, self._snapshot_id)
+
+    def _replay(self) -> bool:
+        client = self._T.new_client()
+        if client is None:
+            self._logger.error(f"service {self._T.name} has no client to replay sql")
+            return False
+        try:
+            engine = ReplayEngine(client, self._logger, self._opts.replay_speed, self._opts.replay_parallel)
+            report = engine.run(self._opts.replay)
+        finally:
+            client.close()
+        write_report(report, os.path.join(self._run_log_dir, "replay.json"))
+        latency = report["latency"]
+        self._logger.info(
+            f"replayed {latency['count']} statements in {report['wall']:.3f}s, errors: {report['errors']}, "
+            f"latency p50/p95/p99: {latency['p50']}/{latency['p95']}/{latency['p99']}"
+        )
+        return True
+
+    def _run_cases(self) -> bool:
+        case_root = os.path.join(self._test_root, "cases")
+        group_dirs = self._opts.group_dirs
+        if self._opts.select and not (self._opts.cases or self._opts.group_files or group_dirs):
+            # --select alone picks from every case under cases/
+            group_dirs = ["."]
+        tasks = resolve_cases(self._test_root, self._opts.cases, self._opts.group_files, group_dirs)
+        if self._opts.select:
+            discovery = CaseDiscovery(case_root)
+            tasks = select_cases(tasks, discovery.stand_ins([case_path for _, case_path in tasks]), compile_select(self._opts.select))
+            self._logger.info(
+                f"--select {self._opts.select} matches {len(tasks)} case tasks, "
+                f"discovery parsed {discovery.parsed} and imported {discovery.imported} changed case files"
+            )
+        timings = {}
+        if not self._opts.uniform_dist:
+            timings = load_case_timings(os.path.dirname(self._run_log_dir), case_root, self._T.dbtest_result_file_name)
+            if timings:
+                # commit or publish it for --shard-timings of sharded runs
+                write_shard_timings(os.path.join(self._run_log_dir, "case_timings.json"), timings, case_root)
+        if self._opts.shard:
+            # every machine must cut the same shards, the local history differs
+            # between machines and only orders the cases inside a shard
+            index, total = self._opts.shard
+            if self._opts.shard_timings:
+                shards = lpt_partition(tasks, load_shard_timings(self._opts.shard_timings, case_root), total)
+            else:
+                shards = path_partition(tasks, total, case_root)
+            tasks = shards[index - 1]
+            self._logger.info(f"shard {index}/{total} has {len(tasks)} case files")
+        # workers pull from one queue, so handing out the longest cases first
+        # is LPT scheduling across the workers
+        tasks = order_by_duration(tasks, timings)
+        scheduler = CaseScheduler(
+            self._logger,
+            concurrency=self._opts.concurrency,
+            early_stop=self._opts.early_stop,
+            case_root=case_root,
+            client_factory=self._T.worker_client,
+            worker_log_file=self._log_file if self._opts.worker_log else None,
+            log_level=self._opts.log_level,
+            sql_record_dir=self._run_log_dir if self._opts.sql_recording else None,
+            sql_record_compress=self._opts.sql_compress,
+        )
+        batches = [tasks]
+        if self._opts.reset_between:
+            if self._snapshot_id is None:
+                raise RuntimeError("--reset-between needs a snapshot, run --setup with it or --use an env kept by --setup --keep")
+            batches = reset_batches(tasks, self._opts.reset_between)
+        with ResultSink(self._run_log_dir, self._T.dbtest_result_file_name) as sink:
+            sink.summary.ready.update(self._T.ready_times)
+            def on_result(result: ResultLog):
+                sink.write(result)
+                self._logger.info(f"case {result.case_path} {'passed' if result.success else 'failed'}, elapse {result.elapse:.3f}s")
+                if not result.success and result.error_msg:
+                    self._logger.error(result.error_msg)
+
+            passed = failed = cancelled = 0
+            for index, batch in enumerate(batches):
+                if self._opts.early_stop and (failed or cancelled):
+                    cancelled += len(batch)
+                    continue
+                if index:
+                    self._reset()
+                batch_passed, batch_failed, batch_cancelled = scheduler.run(batch, on_result)
+                passed, failed, cancelled = passed + batch_passed, failed + batch_failed, cancelled + batch_cancelled
+        elapse = sink.summary.elapse
+        self._logger.info(
+            f"passed: {passed}, failed: {failed}, cancelled: {cancelled}, "
+            f"elapse p50/p95/p99: {elapse.percentile(50)}/{elapse.percentile(95)}/{elapse.percentile(99)}"
+        )
+        return failed == 0 and cancelled == 0
 
-    def start(self):
+    def start(self) -> int:
+        '''
+            return exit code of dbtest, 0 if the run succeeded, 1 if cases
+            failed or were cancelled or the run raised
+        '''
+        ok = False
         try:
-            self.main_work()
+            ok = self.main_work()
         except Exception as e:
             traceback.print_exc()
+        finally:
+            if self._containers:
+                self._stop_containers()
+            self._logger.terminate("dbtest finished")
+            if self._opts.worker_log:
+                self._thread_logger.t.join()
+                merge_log_files(sorted(glob.glob(self._log_file + ".*")), self._log_file)
+        return 0 if ok else 1
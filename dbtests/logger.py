@@ -1,6 +1,11 @@
 import contextlib
+import heapq
 import logging
+import os
+import queue as queue_mod
 import sys
+import threading
+import time
 from logging import handlers
 import multiprocessing
 
@@ -8,41 +13,67 @@ import multiprocessing
 
 class ThreadLogger():
     LEVELS = {
-        "all": logging.ALL,
+        "all": logging.NOTSET,
         "debug": logging.DEBUG,
         "error": logging.ERROR,
         "fatal": logging.FATAL,
         "info": logging.INFO,
-        "off": logging.OFF,
+        "off": logging.CRITICAL + 1,
         "warn": logging.WARN,
-        "terminate": logging.TERM,
+        "warning": logging.WARNING,
+        "terminate": logging.CRITICAL,
         "critical": logging.CRITICAL,
         "exception": logging.ERROR,
 
     }
-    def __init__(self, filePath: str, queue, logLevel="debug", name="test"):
+    def __init__(self, filePath: str, queue, logLevel="debug", name="test", keyed: bool = False):
+        '''
+            keyed: write the file in the format of FileLogger, so it can be
+                merged with worker log files by merge_log_files
+        '''
         super().__init__()
         self._filePath = filePath
         self._queue = queue
         self.t = None
-        self.level = self.LEVELS.get(logLevel.lower(), logging.DEBUG)
+        self.level = self.LEVELS.get((logLevel or "debug").lower(), logging.DEBUG)
         self.logger = get_basic_logger(name)
+        self._keyed = keyed
 
     def work_thread(self):
-        logging.basicConfig(
-            format="%(asctime)s %(levelname)s: %(message)s",
-            datefmt='%Y-%m-%d %H:%M:%S',
-            level=self.level,
-            handlers=[logging.StreamHandler(sys.stdout)]
-        )
-
-        while True:
-            with contextlib.suppress(Exception):
-                level, msg, args = self._queue.get(block=True)
-                log_level = self.LEVELS.get(level.lower(), logging.INFO)
-                self.logger.log(log_level, msg, *args)
-                if level == "terminate":
-                    break
+        '''
+            write every batch of records to stdout and the run log file,
+            both are flushed once per batch instead of once per record
+        '''
+        with open(self._filePath, "a", encoding="utf8", buffering=1 << 16) as log_file:
+            terminate = False
+            while not terminate:
+                try:
+                    batch = self._queue.get(block=True)
+                except Exception:
+                    continue
+                for record in batch:
+                    # a record which fails to format is reported and skipped,
+                    # the records after it and terminate are still honoured
+                    terminate = terminate or record[1:2] == ("terminate",)
+                    self._write(log_file, record)
+                with contextlib.suppress(Exception):
+                    sys.stdout.flush()
+                    log_file.flush()
+
+    def _write(self, log_file, record) -> None:
+        created = time.time()
+        try:
+            created, level, msg, args = record
+            log_level = self.LEVELS.get(level.lower(), logging.INFO)
+            if log_level < self.level:
+                return
+            line = format_record(self.logger.name, created, log_level, msg, args)
+        except Exception as e:
+            log_level = logging.ERROR
+            line = format_record(self.logger.name, created, log_level, "failed to format log record %r: %s", (record, e))
+        with contextlib.suppress(Exception):
+            sys.stdout.write(line)
+            log_file.write(_keyed_line(created, line) if self._keyed else line)
 
     def start(self):
         # start log threadThreadLogger
@@ -54,27 +85,248 @@ def get_basic_logger(name="test"):
     return logging.getLogger(name)
 
 
+_formatter = logging.Formatter("%(asctime)s %(levelname)s: %(message)s", datefmt='%Y-%m-%d %H:%M:%S')
+
+
+def format_record(name: str, created: float, level: int, msg, args) -> str:
+    record = logging.LogRecord(name, level, "", 0, msg, args, None)
+    record.created = created
+    record.msecs = (created - int(created)) * 1000
+    return _formatter.format(record) + "\n"
+
+
+def _keyed_line(created: float, line: str) -> str:
+    # "<timestamp> <line>", continuation lines of a record start with a tab
+    return f"{created:.6f} " + line[:-1].replace("\n", "\n\t") + "\n"
+
+
+def _read_keyed_records(path: str):
+    created, lines = None, []
+    with open(path, "r", encoding="utf8") as f:
+        for line in f:
+            if line.startswith("\t") and created is not None:
+                lines.append(line[1:])
+                continue
+            if created is not None:
+                yield created, "".join(lines)
+            key, _, text = line.partition(" ")
+            try:
+                created, lines = float(key), [text]
+            except ValueError:
+                # torn line of a killed worker
+                created, lines = None, []
+    if created is not None:
+        yield created, "".join(lines)
+
+
+def merge_log_files(paths, target: str, remove: bool = True) -> int:
+    '''
+    description: k-way merge log files written by FileLogger/keyed ThreadLogger
+        into target by record timestamp, every file is read sequentially
+    return number of merged records
+    '''
+    merged = 0
+    with open(target, "a", encoding="utf8", buffering=1 << 16) as f:
+        for _, text in heapq.merge(*(_read_keyed_records(path) for path in paths), key=lambda record: record[0]):
+            f.write(text)
+            merged += 1
+    if remove:
+        for path in paths:
+            os.remove(path)
+    return merged
+
+
+class FileLogger():
+    '''
+    description: Logger of one worker process writing its own buffered file
+        no queue and no lock is shared with other processes; files of all
+        workers are merged into one log by merge_log_files
+    '''
+    def __init__(self, filePath: str, logLevel="debug", name="test"):
+        self._filePath = filePath
+        self._level = ThreadLogger.LEVELS.get((logLevel or "debug").lower(), logging.DEBUG)
+        self._name = name
+        self._file = None
+
+    def _log(self, level: str, msg, args):
+        log_level = ThreadLogger.LEVELS.get(level, logging.INFO)
+        if log_level < self._level:
+            return
+        if self._file is None:
+            self._file = open(self._filePath, "a", encoding="utf8", buffering=1 << 16)
+        created = time.time()
+        try:
+            line = format_record(self._name, created, log_level, msg, args)
+        except Exception as e:
+            line = format_record(self._name, created, logging.ERROR, "failed to format log record %r: %s", ((msg, args), e))
+        self._file.write(_keyed_line(created, line))
+
+    def flush(self):
+        if self._file:
+            self._file.flush()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def debug(self, msg, *args):
+        self._log("debug", msg, args)
+
+    def info(self, msg, *args):
+        self._log("info", msg, args)
+
+    def warning(self, msg, *args):
+        self._log("warning", msg, args)
+
+    def error(self, msg, *args):
+        self._log("error", msg, args)
+
+    def critical(self, msg, *args):
+        self._log("critical", msg, args)
+
+    def terminate(self, msg, *args):
+        self._log("terminate", msg, args)
+        self.close()
+
+    def exception(self, msg, *args):
+        self._log("exception", msg, args)
+
+
 class Logger():
-    def __init__(self, queue):
+    '''
+    description: producer side of ThreadLogger
+        records are buffered and sent as one batch when batch_size records
+        are pending or flush_interval seconds passed; when the queue is full,
+        only one of every debug_sample debug records is kept and the others
+        are dropped, records of other levels are never dropped
+    '''
+    def __init__(self, queue, logLevel="debug", batch_size: int = 256, flush_interval: float = 0.2, debug_sample: int = 10):
         self._queue = queue
+        self._level = ThreadLogger.LEVELS.get((logLevel or "debug").lower(), logging.DEBUG)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._debug_sample = debug_sample
+        self._reset()
+
+    def _reset(self):
+        # buffer, lock and flusher belong to one process, forked or unpickled
+        # loggers start with their own
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._buffer = []
+        self._dropped = 0
+        self._flusher = None
+
+    def __getstate__(self):
+        return {
+            "_queue": self._queue,
+            "_level": self._level,
+            "_batch_size": self._batch_size,
+            "_flush_interval": self._flush_interval,
+            "_debug_sample": self._debug_sample,
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    def _log(self, level: str, msg, args):
+        if ThreadLogger.LEVELS.get(level, logging.INFO) < self._level:
+            return
+        if self._pid != os.getpid():
+            self._reset()
+        with self._lock:
+            self._buffer.append((time.time(), level, msg, args))
+            full = len(self._buffer) >= self._batch_size
+            if not full and self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+                self._flusher.start()
+        if full:
+            self._flush()
+
+    def _flush_periodically(self):
+        pid = self._pid
+        while pid == os.getpid():
+            time.sleep(self._flush_interval)
+            with self._lock:
+                pending = bool(self._buffer)
+            if pending:
+                self._flush()
+
+    def _flush(self, block: bool = False):
+        # the buffer is swapped under _lock and put outside of it, so other
+        # threads keep logging while the queue is full; _send_lock keeps the
+        # batches in order
+        with self._send_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+                dropped, self._dropped = self._dropped, 0
+            if batch or dropped:
+                dropped = self._send(batch, dropped, block)
+            if dropped:
+                with self._lock:
+                    self._dropped += dropped
+
+    def _send(self, batch: list, dropped: int, block: bool) -> int:
+        '''
+        return number of debug records dropped and not reported yet
+        '''
+        notice = []
+        if dropped:
+            notice.append((time.time(), "warning", "%d debug records dropped by log backpressure", (dropped,)))
+        try:
+            self._queue.put(batch + notice, block=block)
+            return 0
+        except queue_mod.Full:
+            pass
+
+        kept = []
+        debug_seen = 0
+        for record in batch:
+            if record[1] == "debug":
+                debug_seen += 1
+                if debug_seen % self._debug_sample:
+                    dropped += 1
+                    continue
+            kept.append(record)
+        if len(kept) > debug_seen // self._debug_sample:
+            # only records above debug are worth waiting for
+            self._queue.put(kept)
+            return dropped
+        try:
+            self._queue.put(kept, block=False)
+        except queue_mod.Full:
+            dropped += len(kept)
+        return dropped
+
+    def flush(self):
+        if self._pid != os.getpid():
+            self._reset()
+        self._flush(block=True)
 
     def debug(self, msg, *args):
-        self._queue.put(("debug", msg, args))
+        self._log("debug", msg, args)
 
     def info(self, msg, *args):
-        self._queue.put(("info", msg, args))
+        self._log("info", msg, args)
 
     def warning(self, msg, *args):
-        self._queue.put(("warning", msg, args))
+        self._log("warning", msg, args)
 
     def error(self, msg, *args):
-        self._queue.put(("error", msg, args))
+        self._log("error", msg, args)
 
     def critical(self, msg, *args):
-        self._queue.put(("critical", msg, args))
+        self._log("critical", msg, args)
 
     def terminate(self, msg, *args):
-        self._queue.put(("terminate", msg, args))
+        if self._pid != os.getpid():
+            self._reset()
+        with self._lock:
+            self._buffer.append((time.time(), "terminate", msg, args))
+        self.flush()
 
     def exception(self, msg, *args):
-        self._queue.put(("exception", msg, args))
+        self._log("exception", msg, args)
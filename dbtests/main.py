@@ -1,15 +1,15 @@
 import os
 import signal
 
-from .frame import DBTestFrame
+# only light modules are imported here, dbtest is started by wrapper
+# scripts many times a day and -v, --init or a wrong option must not pay
+# for the frame (multiprocessing, paramiko, db drivers), dotenv or colorama;
+# they are imported by the functions needing them, see benchmarks/startup.py
 from .dataclass import CmdOption
 
 import json
 import argparse
 import sys
-from dotenv import load_dotenv
-import pathlib
-from colorama import init
 
 _VERSION = "0.1.0"
 
@@ -23,7 +23,7 @@ def get_env_file(path: str="~") -> str:
 
     if not os.path.exists(frame_env_file):
         os.mkdir(frame_setting_path)
-        pathlib.Path(frame_env_file).touch()
+        open(frame_env_file, "a").close()
         return None
 
     return frame_env_file
@@ -34,6 +34,7 @@ def check_env():
     env_file_path = get_env_file()
     if env_file_path is None:
         return False
+    from dotenv import load_dotenv
     load_dotenv(env_file_path)
     return "TEST_ROOT" in os.environ
 
@@ -87,9 +88,31 @@ def parse_command_line():
     req_opt.add_argument("--case", metavar="",
                          action="extend", nargs="+",
                          help="execute cases", )
+    req_opt.add_argument("--select", metavar="",
+                         help="only execute cases whose case_tags match an expression like "
+                              "'tag:storage and not tag:slow or level1:replication', "
+                              "from all cases unless --case or --group-* is given", )
     req_opt.add_argument("--concurrency", metavar="",
                          type=int,
                          help="number of concurrently execute cases", )
+    req_opt.add_argument("--shard", metavar="i/N",
+                         help="only execute the i-th of N shards of the cases, shards are cut by "
+                              "case path, or balanced by elapse with --shard-timings", )
+    req_opt.add_argument("--shard-timings", metavar="shard_timings",
+                         help="json file {case path: elapse} every machine of a sharded run shares, "
+                              "like case_timings.json of a run log dir, relative to TEST_ROOT", )
+    req_opt.add_argument("--reset-between", metavar="reset_between",
+                         choices=["group", "case"],
+                         help="restore the snapshot of the environment between case groups (group) "
+                              "or case files (case), cases of one batch still run concurrently", )
+    req_opt.add_argument("--replay", metavar="",
+                         action="extend", nargs="+",
+                         help="replay sql recorded by --sql_recording on the --use environment", )
+    req_opt.add_argument("--replay-speed", metavar="replay_speed",
+                         help="recorded(default), max or Nx like 2x", )
+    req_opt.add_argument("--replay-parallel", metavar="replay_parallel",
+                         type=int,
+                         help="number of recorded sessions replayed concurrently, default all", )
     req_opt.add_argument("--tag", metavar="",
                          help="add some run tag", )
     req_opt.add_argument("--prepare", metavar="",
@@ -115,6 +138,9 @@ def parse_command_line():
     unreq_opt.add_argument('--early_stop',
                            action="store_true", default=False,
                            help="stop execute left cases on any case failed")
+    unreq_opt.add_argument('--uniform_dist',
+                           action="store_true", default=False,
+                           help="distribute cases by path instead of by elapse of former runs")
     unreq_opt.add_argument('--env_init',
                            action="store_true", default=False,
                            help="stop execute left cases on any case failed")
@@ -126,22 +152,32 @@ def parse_command_line():
     unreq_opt.add_argument(
         "--swarm",
         action="store_true", default=False,
-        help="swarm mode"
+        help="swarm mode, not supported yet"
     )
     unreq_opt.add_argument(
         "--disable_collection",
         action="store_true", default=False,
         help="disable data collection in case of test failure"
     )
+    unreq_opt.add_argument(
+        "--worker_log",
+        action="store_true", default=False,
+        help="every case worker writes its own log file, merged into the run log when finished"
+    )
     unreq_opt.add_argument(
         "--sql_recording",
         action="store_true", default=False,
         help="record sql"
     )
+    unreq_opt.add_argument(
+        "--sql_compress",
+        action="store_true", default=False,
+        help="write sql recording with gzip"
+    )
     unreq_opt.add_argument(
         "--rm_containers",
         action="store_true", default=False,
-        help="remove containers"
+        help="remove containers, they are always removed at the end of a run"
     )
     req_opt.add_argument(
         "--log-level", metavar="log_level",
@@ -191,6 +227,8 @@ def parse_command_line():
     opts.stop = bool(pars.stop)
     opts.disable_collection = bool(pars.disable_collection)
     opts.sql_recording = bool(pars.sql_recording)
+    opts.sql_compress = bool(pars.sql_compress)
+    opts.worker_log = bool(pars.worker_log)
     # if opts.sql_recording:
     #     os.environ[DBSql.dbtest_enable_sql_recording_variable] = "TRUE"
 
@@ -208,6 +246,14 @@ def parse_command_line():
     opts.group_files = pars.group_file or None
     opts.group_dirs = pars.group_dir or None
     opts.cases = pars.case or None
+    opts.select = pars.select or None
+    if opts.select:
+        from .select import compile_select
+        try:
+            compile_select(opts.select)
+        except ValueError as e:
+            print(f"--select {e}")
+            sys.exit(1)
     opts.log_level = pars.log_level or None
     opts.source_dir = pars.source_dir or None
     opts.dbtest_pkg = pars.dbtest_pkg or None
@@ -223,7 +269,26 @@ def parse_command_line():
             sys.exit(1)
         else:
             opts.concurrency = pars.concurrency
-    opts.uniform_dist = pars.uniform_dist or None
+    opts.uniform_dist = bool(pars.uniform_dist)
+    if pars.shard:
+        from .scheduler import parse_shard
+        try:
+            opts.shard = parse_shard(pars.shard)
+        except ValueError as e:
+            print(f"--shard {e}")
+            sys.exit(1)
+    opts.shard_timings = pars.shard_timings or None
+    opts.reset_between = pars.reset_between or None
+    opts.replay = pars.replay or None
+    opts.replay_speed = pars.replay_speed or "recorded"
+    if opts.replay_speed != "recorded":
+        from .replay import parse_speed
+        try:
+            parse_speed(opts.replay_speed)
+        except ValueError as e:
+            print(f"--replay-speed {e}")
+            sys.exit(1)
+    opts.replay_parallel = pars.replay_parallel or None
     opts.tag = pars.tag or None
     opts.prepare = pars.prepare or None
     opts.servcfg = pars.servcfg or None
@@ -254,17 +319,39 @@ def check_opts(opts):
     if (opts.group_dirs or opts.group_files) and opts.cases:
         print("--group-dir or --group-file can't be used together with --case")
         return False
+    if opts.replay and not opts.use:
+        print("--replay must be used together with --use")
+        return False
+    if opts.replay and (opts.cases or opts.group_dirs or opts.group_files or opts.select):
+        print("--replay can't be used together with cases")
+        return False
     # rm_containers  option must use with --containters
     if opts.containers:
         print(" It will exec in containters ")
     if opts.rm_containers and not opts.containers:
         print("--rm_containers must be used together with --containers")
         return False
+    # containers and their snapshots live only as long as this run
+    if opts.containers and (opts.keep or opts.reset):
+        print("--keep and --reset can't be used together with --containers, use --reset-between")
+        return False
+    if opts.swarm:
+        print("--swarm is not supported, use --containers")
+        return False
     # --env_init must appear with --init
     if opts.env_init and not opts.init:
         print("--env_init must be used when using --init")
         return False
 
+    if opts.shard_timings is not None:
+        if not opts.shard:
+            print("--shard-timings must be used together with --shard")
+            return False
+        if not opts.shard_timings.startswith("/"):
+            opts.shard_timings = os.environ["TEST_ROOT"] + "/" + opts.shard_timings
+        if not os.path.exists(opts.shard_timings):
+            print(f"--shard-timings {opts.shard_timings} not exist")
+            return False
     if opts.cfg_file is not None:
         if not opts.cfg_file.startswith("/"):
             opts.cfg_file = os.environ["TEST_ROOT"] + "/" + opts.cfg_file
@@ -343,18 +430,19 @@ def __create_test_root_sub_dirs(test_root, arg1, arg2):
 
 def main():
     """
-    1. check TEST_ROOT environment variable.
-    2. parse command line arguments.
+    1. parse command line arguments.
+    2. check TEST_ROOT environment variable.
     3. construct dbtestFrame object.
     4. start test dbtestFrame.
     """
-    env_ok = check_env()
     opts = parse_command_line()
 
+    # before check_env, -v must not load ~/.dbtest/.env with dotenv
     if opts.version:
         print(_VERSION)
         return
 
+    env_ok = check_env()
     if opts.init:
         init_test_root(env_ok)
         if opts.env_init:
@@ -371,6 +459,8 @@ def main():
     if not check_opts(opts):
         return 1
 
+    init_colorama()
+    from .frame import DBTestFrame
     db_test = DBTestFrame(opts)
     return db_test.start()
 
@@ -390,6 +480,7 @@ def handle_signal():
 
 def init_colorama():
     try:
+        from colorama import init
         init()
     except BaseException as e:
         print("Init colorama error", e)
@@ -400,5 +491,4 @@ def run_program():
 
 if __name__ == '__main__':
     handle_signal()
-    init_colorama()
     run_program()
@@ -0,0 +1,150 @@
+import json
+import re
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from .client.client import Client
+from .client.recorder import read_records
+from .logger import Logger
+from .result import ElapseHistogram
+
+
+_literal = re.compile(r"'(?:[^'\\]|\\.|'')*'|\b\d+(?:\.\d+)?\b")
+_space = re.compile(r"\s+")
+
+
+def fingerprint(sql: str) -> str:
+    '''
+    description: sql with literals replaced by ?, statements differing only
+        in values share one latency histogram
+    '''
+    return _space.sub(" ", _literal.sub("?", sql)).strip()
+
+
+def parse_speed(speed: str) -> Optional[float]:
+    '''
+    description: "recorded" is 1x, "max" does not wait at all, "Nx" is N times faster
+    return time factor, None for max
+    '''
+    speed = (speed or "recorded").lower()
+    if speed == "recorded":
+        return 1.0
+    if speed == "max":
+        return None
+    try:
+        factor = float(speed[:-1]) if speed.endswith("x") else float(speed)
+    except ValueError:
+        raise ValueError(f"speed must be recorded, max or Nx, got {speed}")
+    if factor <= 0:
+        raise ValueError(f"speed must be positive, got {speed}")
+    return factor
+
+
+class ReplayEngine:
+    '''
+    description: re-execute sql recorded by --sql_recording
+        statements of one recorded session run in order on one thread and
+        one connection of their own, so USE, SET and transactions behave as
+        recorded; at most `parallel` sessions run at the same time, no more
+        than the client has connections; with a time factor,
+        every statement waits until its recorded offset from the first
+        statement divided by the factor
+        example:
+            engine = ReplayEngine(client, logger, speed="2x", parallel=8)
+            report = engine.run(["run/xxx/sql.worker0.jsonl"])
+    '''
+    def __init__(self, client: Client, logger: Logger, speed: str = "recorded", parallel: int = None) -> None:
+        self._client = client
+        self._logger = logger
+        self._factor = parse_speed(speed)
+        self._parallel = parallel
+        self._lock = threading.Lock()
+        self._total = ElapseHistogram()
+        self._statements: Dict[str, ElapseHistogram] = {}
+        self._errors = 0
+
+    def load(self, paths: List[str]) -> Dict[str, List[Tuple[float, str]]]:
+        '''
+        description: recorded queries of every session ordered by start time,
+            bulk and executemany records carry no values and are skipped
+        return {session: [(ts, sql)]}
+        '''
+        sessions: Dict[str, List[Tuple[float, str]]] = {}
+        for path in paths:
+            for record in read_records(path):
+                if record.get("kind", "query") != "query":
+                    continue
+                session = f"{path}:{record.get('session')}"
+                sessions.setdefault(session, []).append((record["ts"], record["sql"]))
+        for statements in sessions.values():
+            statements.sort(key=lambda statement: statement[0])
+        return sessions
+
+    def run(self, paths: List[str]) -> Dict[str, Any]:
+        sessions = self.load(paths)
+        if not sessions:
+            self._logger.error(f"no sql to replay in {paths}")
+            return self.report(0.0)
+
+        first_ts = min(statements[0][0] for statements in sessions.values())
+        parallel = min(self._parallel or len(sessions), self._client.max_connections)
+        if parallel < (self._parallel or len(sessions)):
+            self._logger.info(f"replay parallel limited to the {parallel} connections of the client")
+        self._logger.info(f"replay {sum(map(len, sessions.values()))} statements of {len(sessions)} sessions, parallel {parallel}")
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=parallel, thread_name_prefix="dbtest-replay") as executor:
+            for future in [executor.submit(self._replay_session, statements, start, first_ts)
+                           for statements in sessions.values()]:
+                future.result()
+        return self.report(time.monotonic() - start)
+
+    def _replay_session(self, statements: List[Tuple[float, str]], start: float, first_ts: float) -> None:
+        with self._client.session(time_out=None) as cursor:
+            for ts, sql in statements:
+                if self._factor:
+                    delay = start + (ts - first_ts) / self._factor - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                begin = time.perf_counter()
+                try:
+                    cursor.execute(sql)
+                    failed = False
+                except Exception as e:
+                    failed = True
+                    self._logger.debug(f"replay failed: {sql}: {e}")
+                # only the execution is measured, not reading the rows
+                elapse = time.perf_counter() - begin
+                if not failed and cursor.description:
+                    cursor.fetchall()
+                self._add(sql, elapse, failed)
+
+    def _add(self, sql: str, elapse: float, failed: bool) -> None:
+        key = fingerprint(sql)
+        with self._lock:
+            self._total.add(elapse)
+            histogram = self._statements.get(key)
+            if histogram is None:
+                histogram = self._statements[key] = ElapseHistogram()
+            histogram.add(elapse)
+            self._errors += failed
+
+    def report(self, wall: float, top: int = 20) -> Dict[str, Any]:
+        '''
+        description: latency of all statements and of the top statements by total elapse
+        '''
+        slowest = sorted(self._statements.items(), key=lambda item: item[1].total, reverse=True)[:top]
+        return {
+            "wall": wall,
+            "errors": self._errors,
+            "qps": self._total.count / wall if wall else None,
+            "latency": self._total.to_dict(),
+            "statements": [dict(sql=sql, total=histogram.total, **histogram.to_dict()) for sql, histogram in slowest],
+        }
+
+
+def write_report(report: Dict[str, Any], path: str) -> None:
+    with open(path, "w", encoding="utf8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,186 @@
+import json
+import math
+import os
+import time
+
+from typing import Any, Dict, List
+
+from .dataclass import ResultLog
+
+
+class ElapseHistogram:
+    '''
+    description: constant memory histogram of elapse in seconds
+        buckets grow by `growth` from `lowest`, so percentiles are within
+        (growth - 1) relative error whatever the number of samples
+    '''
+    def __init__(self, lowest: float = 0.0001, highest: float = 100000.0, growth: float = 1.05) -> None:
+        self._lowest = lowest
+        self._log_growth = math.log(growth)
+        self._buckets: List[int] = [0] * (self._bucket_index(highest) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def _bucket_index(self, value: float) -> int:
+        if value <= self._lowest:
+            return 0
+        return int(math.log(value / self._lowest) / self._log_growth) + 1
+
+    def add(self, value: float) -> None:
+        index = min(self._bucket_index(value), len(self._buckets) - 1)
+        self._buckets[index] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other: 'ElapseHistogram') -> None:
+        for index, count in enumerate(other._buckets):
+            self._buckets[index] += count
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, p: float) -> float:
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(self.count * p / 100))
+        seen = 0
+        for index, count in enumerate(self._buckets):
+            seen += count
+            if seen >= rank:
+                # upper bound of the bucket, clamped by what was really seen
+                value = self._lowest * math.exp(self._log_growth * index)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+
+class ResultSummary:
+    '''
+    description: running summary of case results, memory is bounded by the
+        number of tags, not by the number of cases
+    '''
+    def __init__(self) -> None:
+        self.passed = 0
+        self.failed = 0
+        self.elapse = ElapseHistogram()
+        # tag -> [passed, failed, elapse]
+        self.tags: Dict[str, List] = {}
+        # "host:port" -> seconds the service node took to become ready
+        self.ready: Dict[str, float] = {}
+
+    def add(self, success: bool, elapse: float = None, tags: List[str] = None) -> None:
+        if success:
+            self.passed += 1
+        else:
+            self.failed += 1
+        if elapse is not None:
+            self.elapse.add(elapse)
+        for tag in tags or []:
+            total = self.tags.setdefault(tag, [0, 0, 0.0])
+            total[0 if success else 1] += 1
+            total[2] += elapse or 0.0
+
+    def add_result(self, result: ResultLog) -> None:
+        self.add(result.success, result.elapse, result.tags)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "total": self.passed + self.failed,
+            "passed": self.passed,
+            "failed": self.failed,
+            "elapse": self.elapse.to_dict(),
+            "tags": {
+                tag: {"passed": passed, "failed": failed, "elapse": elapse}
+                for tag, (passed, failed, elapse) in sorted(self.tags.items())
+            },
+            "ready": self.ready,
+        }
+
+    @classmethod
+    def from_file(cls, result_file: str) -> 'ResultSummary':
+        '''
+        description: rebuild the summary from a (maybe partial) result file
+        '''
+        summary = cls()
+        with open(result_file, "r", encoding="utf8") as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue
+                summary.add(result.get("success"), result.get("elapse"), result.get("tags"))
+        return summary
+
+
+class ResultSink:
+    '''
+    description: append case results to a jsonl file of the run log dir
+        lines are buffered and flushed every flush_size results or
+        flush_interval seconds, so a crashed run keeps all but the last
+        few results; summary file is written on close
+        example:
+            with ResultSink(run_log_dir, "result.jsonl") as sink:
+                sink.write(result)
+            print(sink.summary.to_dict())
+    '''
+    summary_file_name = "summary.json"
+
+    def __init__(self,
+        run_log_dir: str,
+        file_name: str,
+        flush_size: int = 64,
+        flush_interval: float = 1.0,
+    ) -> None:
+        self._run_log_dir = run_log_dir
+        self._flush_size = flush_size
+        self._flush_interval = flush_interval
+        self._file = open(os.path.join(run_log_dir, file_name), "a", encoding="utf8", buffering=1 << 16)
+        self._pending = 0
+        self._last_flush = time.monotonic()
+        self.summary = ResultSummary()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, result: ResultLog) -> None:
+        self._file.write(result.to_json())
+        self._file.write("\n")
+        self.summary.add_result(result)
+        self._pending += 1
+        if self._pending >= self._flush_size or time.monotonic() - self._last_flush >= self._flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        self._file.flush()
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+        summary_file = os.path.join(self._run_log_dir, self.summary_file_name)
+        with open(summary_file + ".tmp", "w", encoding="utf8") as f:
+            json.dump(self.summary.to_dict(), f, ensure_ascii=False, indent=2)
+        os.replace(summary_file + ".tmp", summary_file)
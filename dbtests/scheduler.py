@@ -0,0 +1,470 @@
+import datetime
+import heapq
+import importlib.util
+import inspect
+import json
+import multiprocessing
+import os
+import queue
+import statistics
+import traceback
+
+from typing import Callable, Dict, Generator, List, Optional, Tuple
+
+from .case import Case, CaseManage
+from .client.client import Client
+from .dataclass import ResultLog
+from .logger import FileLogger, Logger
+
+
+# (case_group, case_path): one unit of work handed to a worker
+CaseTask = Tuple[str, str]
+
+
+def resolve_cases(test_root: str,
+    cases: List[str] = None,
+    group_files: List[str] = None,
+    group_dirs: List[str] = None,
+) -> List[CaseTask]:
+    '''
+    description: expand --case/--group-file/--group-dir into case tasks
+        case paths are relative to $TEST_ROOT/cases unless absolute,
+        group files are relative to $TEST_ROOT/groups and list one case per line,
+        group dirs are relative to $TEST_ROOT/cases and contain case files
+    return [(case_group, case_path)]
+    '''
+    case_root = os.path.join(test_root, "cases")
+    group_root = os.path.join(test_root, "groups")
+    tasks: List[CaseTask] = []
+
+    for case in cases or []:
+        tasks.append(("", _case_path(case_root, case)))
+
+    for group_file in group_files or []:
+        group_path = group_file if os.path.isabs(group_file) else os.path.join(group_root, group_file)
+        with open(group_path, "r") as f:
+            for line in f:
+                line = line.split("#", 1)[0].strip()
+                if line:
+                    tasks.append((group_file, _case_path(case_root, line)))
+
+    for group_dir in group_dirs or []:
+        dir_path = group_dir if os.path.isabs(group_dir) else os.path.join(case_root, group_dir)
+        for root, dirs, files in os.walk(dir_path):
+            dirs.sort()
+            for file in sorted(files):
+                if file.endswith(".py") and not file.startswith("_"):
+                    tasks.append((group_dir, os.path.normpath(os.path.join(root, file))))
+
+    # a case listed twice is only run once
+    seen = set()
+    return [task for task in tasks if not (task[1] in seen or seen.add(task[1]))]
+
+
+def _case_path(case_root: str, case: str) -> str:
+    if os.path.isabs(case):
+        return case
+    return os.path.join(case_root, case)
+
+
+def load_case_timings(run_root: str, case_root: str, result_file_name: str, max_runs: int = 20) -> Dict[str, float]:
+    '''
+    description: read case elapse of the newest max_runs run dirs under run_root
+        elapse of cases from one case file are summed up per run,
+        then averaged over the runs the case file appears in
+    return {case file path: elapse}
+    '''
+    if not os.path.isdir(run_root):
+        return {}
+
+    result_files = []
+    for entry in os.scandir(run_root):
+        result_file = os.path.join(entry.path, result_file_name)
+        if entry.is_dir() and os.path.isfile(result_file):
+            result_files.append((os.path.getmtime(result_file), result_file))
+    result_files = [file for _, file in sorted(result_files, reverse=True)[:max_runs]]
+
+    history: Dict[str, List[float]] = {}
+    for result_file in result_files:
+        run_elapse: Dict[str, float] = {}
+        with open(result_file, "r", encoding="utf8") as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    # last line of a crashed run
+                    continue
+                if not result.get("case_path") or result.get("elapse") is None:
+                    continue
+                case_file = result["case_path"].split("::", 1)[0]
+                run_elapse[case_file] = run_elapse.get(case_file, 0.0) + result["elapse"]
+        for case_file, elapse in run_elapse.items():
+            history.setdefault(_case_path(case_root, case_file), []).append(elapse)
+
+    return {case_file: statistics.mean(elapses) for case_file, elapses in history.items()}
+
+
+def load_shard_timings(path: str, case_root: str) -> Dict[str, float]:
+    '''
+    description: read a timings file shared by all machines of a sharded run,
+        a json object {case file path relative to the case root: elapse},
+        like the case_timings.json of a run log dir
+    return {case file path: elapse}
+    '''
+    with open(path, "r", encoding="utf8") as f:
+        timings = json.load(f)
+    return {_case_path(case_root, case_file): float(elapse) for case_file, elapse in timings.items()}
+
+
+def write_shard_timings(path: str, timings: Dict[str, float], case_root: str) -> None:
+    '''
+    description: write timings for load_shard_timings, paths relative to case_root
+    '''
+    with open(path, "w", encoding="utf8") as f:
+        json.dump(
+            {os.path.relpath(case_file, case_root): round(elapse, 3) for case_file, elapse in sorted(timings.items())},
+            f, ensure_ascii=False, indent=1,
+        )
+
+
+def path_partition(tasks: List[CaseTask], bins: int, case_root: str) -> List[List[CaseTask]]:
+    '''
+    description: deal tasks sorted by case path relative to case_root to the
+        bins in turn; it depends on nothing but the tasks, so every machine
+        of a sharded run cuts the same shards
+    return [[CaseTask]] of length bins
+    '''
+    ordered = sorted(tasks, key=lambda task: (os.path.relpath(task[1], case_root), task[0]))
+    return [ordered[index::bins] for index in range(bins)]
+
+
+def order_by_duration(tasks: List[CaseTask], timings: Dict[str, float]) -> List[CaseTask]:
+    '''
+    description: sort tasks longest first, tasks without history are
+        estimated by the median of known ones; ties are broken by path so
+        the order is the same on every machine
+    return [CaseTask]
+    '''
+    default = _default_elapse(tasks, timings)
+    return sorted(tasks, key=lambda task: (-timings.get(task[1], default), task[1], task[0]))
+
+
+def reset_batches(tasks: List[CaseTask], between: str) -> List[List[CaseTask]]:
+    '''
+    description: split tasks into batches run one after another with the
+        environment restored from its snapshot in between, one batch per
+        case group ("group") or per case task ("case"); the order of tasks
+        is kept, groups in the order of their first task
+    return [[CaseTask]]
+    '''
+    if between == "case":
+        return [[task] for task in tasks]
+    batches: Dict[str, List[CaseTask]] = {}
+    for task in tasks:
+        batches.setdefault(task[0], []).append(task)
+    return list(batches.values())
+
+
+def lpt_partition(tasks: List[CaseTask], timings: Dict[str, float], bins: int) -> List[List[CaseTask]]:
+    '''
+    description: longest-processing-time-first bin packing, every task goes
+        to the bin with the smallest estimated total so far
+    return [[CaseTask]] of length bins
+    '''
+    default = _default_elapse(tasks, timings)
+    partitions: List[List[CaseTask]] = [[] for _ in range(bins)]
+    loads = [(0.0, index) for index in range(bins)]
+    for task in order_by_duration(tasks, timings):
+        load, index = heapq.heappop(loads)
+        partitions[index].append(task)
+        heapq.heappush(loads, (load + timings.get(task[1], default), index))
+    return partitions
+
+
+def _default_elapse(tasks: List[CaseTask], timings: Dict[str, float]) -> float:
+    known = [timings[path] for _, path in tasks if path in timings]
+    return statistics.median(known) if known else 1.0
+
+
+def parse_shard(shard: str) -> Tuple[int, int]:
+    '''
+    description: parse --shard i/N, i starts from 1
+    return (i, N)
+    '''
+    try:
+        index, total = (int(part) for part in shard.split("/"))
+    except ValueError:
+        raise ValueError(f"shard must be like i/N, got {shard}")
+    if total < 1 or not 1 <= index <= total:
+        raise ValueError(f"shard index must be in [1, {total}], got {shard}")
+    return index, total
+
+
+def load_cases(case_path: str, case_root: str = None) -> List[Case]:
+    '''
+    description: import a case file and instantiate every Case subclass defined
+        in it, only the named one for a case_path like "file.py::ClassName"
+    return [Case]
+    '''
+    case_path, _, class_name = case_path.partition("::")
+    case_id = os.path.relpath(case_path, case_root) if case_root else case_path
+    module_name = "dbtest_case_" + case_id.replace(os.sep, "_").replace(".", "_")
+    spec = importlib.util.spec_from_file_location(module_name, case_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    classes = [
+        obj for _, obj in inspect.getmembers(module, inspect.isclass)
+        if issubclass(obj, Case) and obj.__module__ == module_name and not inspect.isabstract(obj)
+    ]
+    if len(classes) == 1:
+        return [classes[0](case_id)]
+    return [cls(f"{case_id}::{cls.__name__}") for cls in classes if not class_name or cls.__name__ == class_name]
+
+
+def select_cases(tasks: List[CaseTask], discovered: Dict[str, List[Case]], selector, manage: CaseManage = None) -> List[CaseTask]:
+    '''
+    description: keep the cases of tasks matching a compiled --select expression
+        (see select.py) by the case_tags of every case; discovered maps case
+        paths to their cases, stand-ins from CaseDiscovery.stand_ins so no case
+        file is imported, None for a file discovery failed on which is kept so
+        its worker reports the error; a case file with only some cases
+        selected is split into one task per selected case
+    return [CaseTask]
+    '''
+    loaded = [(task, discovered[task[1]] or []) for task in tasks]
+    depth = max((len(path.strip("/").split("/")) for _, cases in loaded for case in cases for path in case.case_tags), default=1)
+    manage = manage or CaseManage(depth)
+    manage.ensure_levels(depth)
+    for _, cases in loaded:
+        for case in cases:
+            manage.add_case(case)
+            for path in case.case_tags:
+                manage.set_case_tag(case, manage.tag_path(path))
+
+    selected = set(map(id, manage.cases_of(selector.evaluate(manage))))
+    result: List[CaseTask] = []
+    for (case_group, case_path), cases in loaded:
+        chosen = [case for case in cases if id(case) in selected]
+        if discovered[case_path] is None or (chosen and len(chosen) == len(cases)):
+            result.append((case_group, case_path))
+        else:
+            # only files with several cases are split, their ids end with ::ClassName
+            result.extend((case_group, f"{case_path}::{case.case_id.rsplit('::', 1)[-1]}") for case in chosen)
+    return result
+
+
+class CaseScheduler:
+    '''
+    description: run case tasks on a pool of worker processes
+        each worker creates one Client by client_factory(worker_id) and keeps it
+        for every case it runs; on early_stop the first failed case cancels
+        all cases not yet picked up by a worker, the cases left in the case
+        file being run included; with worker_log_file, worker
+        i logs to its own file "<worker_log_file>.worker<i>" instead of logger;
+        with sql_record_dir, worker i records the sql of its client to
+        "<sql_record_dir>/sql.worker<i>.jsonl", gzip with sql_record_compress
+        example:
+            scheduler = CaseScheduler(logger, concurrency=4)
+            scheduler.run(tasks, on_result=print)
+    '''
+    # a worker takes this long at most to notice the stop event
+    poll_interval = 0.5
+
+    def __init__(self,
+        logger: Logger,
+        concurrency: int = 1,
+        early_stop: bool = False,
+        case_root: str = None,
+        client_factory: Callable[[int], Optional[Client]] = None,
+        worker_log_file: str = None,
+        log_level: str = None,
+        sql_record_dir: str = None,
+        sql_record_compress: bool = False,
+    ) -> None:
+        self._logger = logger
+        self._worker_log_file = worker_log_file
+        self._log_level = log_level
+        self._sql_record_dir = sql_record_dir
+        self._sql_record_compress = sql_record_compress
+        self._concurrency = max(1, concurrency or 1)
+        self._early_stop = early_stop
+        self._case_root = case_root
+        self._client_factory = client_factory
+
+    def run(self, tasks: List[CaseTask], on_result: Callable[[ResultLog], None] = None) -> Tuple[int, int, int]:
+        '''
+        description: run tasks and call on_result for every finished case
+        return (passed, failed, cancelled), cancelled counts the case files
+            never started and the cases skipped in the started ones
+        '''
+        if not tasks:
+            return 0, 0, 0
+
+        workers_num = min(self._concurrency, len(tasks))
+        task_queue = multiprocessing.Queue()
+        result_queue = multiprocessing.Queue()
+        stop_event = multiprocessing.Event()
+
+        for task in tasks:
+            task_queue.put(task)
+        for _ in range(workers_num):
+            task_queue.put(None)
+
+        self._logger.info(f"run {len(tasks)} case files with {workers_num} workers")
+        # workers send their own batches, records logged before they start
+        # must not reach the log after theirs
+        self._logger.flush()
+        workers = []
+        for worker_id in range(workers_num):
+            logger = self._logger
+            if self._worker_log_file:
+                logger = FileLogger(f"{self._worker_log_file}.worker{worker_id}", self._log_level)
+            worker = multiprocessing.Process(
+                target=_worker_main,
+                args=(worker_id, task_queue, result_queue, stop_event, self._early_stop, logger,
+                      self._case_root, self._client_factory,
+                      self._sql_record_dir, self._sql_record_compress),
+                name=f"dbtest-worker-{worker_id}",
+            )
+            worker.start()
+            workers.append(worker)
+
+        passed = failed = cancelled = 0
+        exited = 0
+        while exited < workers_num:
+            try:
+                kind, payload = result_queue.get(timeout=self.poll_interval)
+            except queue.Empty:
+                if any(worker.is_alive() for worker in workers):
+                    continue
+                # every worker is gone, only messages already in the pipe are left
+                try:
+                    kind, payload = result_queue.get(timeout=self.poll_interval)
+                except queue.Empty:
+                    self._logger.error("case workers exited unexpectedly")
+                    break
+
+            if kind == "exit":
+                exited += 1
+                continue
+            if kind == "cancelled":
+                cancelled += payload
+                continue
+
+            result: ResultLog = payload
+            if result.success:
+                passed += 1
+            else:
+                failed += 1
+                if self._early_stop and not stop_event.is_set():
+                    self._logger.info(f"case {result.case_path} failed, stop executing left cases")
+                    stop_event.set()
+            if on_result:
+                on_result(result)
+
+        for worker in workers:
+            worker.join()
+
+        cancelled_files = 0
+        while True:
+            try:
+                task = task_queue.get(timeout=0.1)
+            except queue.Empty:
+                break
+            if task is not None:
+                cancelled_files += 1
+        if cancelled_files:
+            self._logger.info(f"{cancelled_files} case files cancelled")
+        return passed, failed, cancelled + cancelled_files
+
+
+def _worker_main(worker_id, task_queue, result_queue, stop_event, early_stop, logger, case_root, client_factory,
+                 sql_record_dir, sql_record_compress):
+    client = None
+    try:
+        if client_factory:
+            client = client_factory(worker_id)
+        if client and sql_record_dir:
+            client.start_recording(os.path.join(sql_record_dir, f"sql.worker{worker_id}.jsonl"),
+                                   f"worker{worker_id}", sql_record_compress)
+        while not stop_event.is_set():
+            try:
+                task = task_queue.get(timeout=CaseScheduler.poll_interval)
+            except queue.Empty:
+                continue
+            if task is None:
+                break
+            results = _run_case_file(task, case_root, client, logger, stop_event, early_stop)
+            while True:
+                try:
+                    result_queue.put(("result", next(results)))
+                except StopIteration as stop:
+                    # the number of cases skipped by stop_event or early_stop
+                    if stop.value:
+                        result_queue.put(("cancelled", stop.value))
+                    break
+    except Exception:
+        logger.error(f"worker {worker_id} failed: {traceback.format_exc()}")
+    finally:
+        if client:
+            client.close()
+        logger.flush()
+        result_queue.put(("exit", worker_id))
+
+
+def _run_case_file(task: CaseTask, case_root: str, client: Optional[Client], logger: Logger,
+                   stop_event=None, early_stop: bool = False) -> Generator[ResultLog, None, int]:
+    '''
+    description: run the cases of one case file, stop before the next case
+        once stop_event is set, or right after a failed case on early_stop
+    return generator of ResultLog, one per case run, which returns
+        the number of cases it skipped
+    '''
+    case_group, case_path = task
+    start_time = datetime.datetime.now()
+    try:
+        cases = load_cases(case_path, case_root)
+    except Exception:
+        yield ResultLog(
+            case_group=case_group, case_path=case_path,
+            start_time=start_time, stop_time=datetime.datetime.now(),
+            success=False, error_msg=traceback.format_exc(),
+        )
+        return
+
+    for index, case in enumerate(cases):
+        if stop_event is not None and stop_event.is_set():
+            logger.info(f"{len(cases) - index} cases of {case_path} cancelled")
+            return len(cases) - index
+        case.logger = logger
+        case.client = client
+        result = ResultLog(
+            case_group=case_group,
+            case_path=case.case_id,
+            author=getattr(case, "author", None),
+            tags=[str(tag) for tag in case.tags] or list(case.case_tags),
+            start_time=datetime.datetime.now(),
+        )
+        try:
+            result.desc = case.desc()
+            result.success = bool(case.run())
+        except Exception:
+            result.success = False
+            result.error_msg = traceback.format_exc()
+        finally:
+            try:
+                case.close()
+            except Exception:
+                logger.error(f"close case {case.case_id} failed: {traceback.format_exc()}")
+        result.stop_time = datetime.datetime.now()
+        delta = result.stop_time - result.start_time
+        result.elapse = delta.total_seconds()
+        yield result
+        if early_stop and not result.success:
+            # the controller sets stop_event on this result, the next case
+            # must not start before it does
+            if index + 1 < len(cases):
+                logger.info(f"{len(cases) - index - 1} cases of {case_path} cancelled")
+            return len(cases) - index - 1
+    return 0
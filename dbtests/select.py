@@ -0,0 +1,138 @@
+import functools
+import re
+
+from typing import List, Tuple
+
+from .case import CaseManage
+
+
+_token = re.compile(r"\s*(?:(\()|(\))|(and|or|not)\b|(tag|level\d+):([^\s()]+))", re.IGNORECASE)
+
+
+def tokenize(expr: str) -> List[Tuple[str, str]]:
+    '''
+    description: split a select expression into tokens
+    return [(kind, value)], kind is "(", ")", "and", "or", "not" or "tag"
+    '''
+    tokens = []
+    pos = 0
+    expr = expr.rstrip()
+    while pos < len(expr):
+        match = _token.match(expr, pos)
+        if not match:
+            raise ValueError(f"unexpected {expr[pos:].strip()[:20]!r} at {pos} of {expr!r}")
+        lparen, rparen, op, kind, name = match.groups()
+        if lparen:
+            tokens.append(("(", lparen))
+        elif rparen:
+            tokens.append((")", rparen))
+        elif op:
+            tokens.append((op.lower(), op))
+        else:
+            tokens.append(("tag", f"{kind.lower()}:{name}"))
+        pos = match.end()
+    return tokens
+
+
+class _Parser:
+    '''
+        expr := and ("or" and)*
+        and  := not ("and" not)*
+        not  := "not" not | "(" expr ")" | term
+        term := "tag:" name | "level<N>:" name
+    '''
+    def __init__(self, expr: str) -> None:
+        self._expr = expr
+        self._tokens = tokenize(expr)
+        self._pos = 0
+
+    def _peek(self) -> str:
+        return self._tokens[self._pos][0] if self._pos < len(self._tokens) else None
+
+    def _take(self, kind: str) -> str:
+        if self._peek() != kind:
+            found = self._tokens[self._pos][1] if self._pos < len(self._tokens) else "end"
+            raise ValueError(f"expect {kind} but got {found} in {self._expr!r}")
+        self._pos += 1
+        return self._tokens[self._pos - 1][1]
+
+    def parse(self) -> tuple:
+        node = self._or()
+        if self._peek() is not None:
+            raise ValueError(f"unexpected {self._tokens[self._pos][1]} in {self._expr!r}")
+        return node
+
+    def _or(self) -> tuple:
+        node = self._and()
+        while self._peek() == "or":
+            self._take("or")
+            node = ("or", node, self._and())
+        return node
+
+    def _and(self) -> tuple:
+        node = self._not()
+        while self._peek() == "and":
+            self._take("and")
+            node = ("and", node, self._not())
+        return node
+
+    def _not(self) -> tuple:
+        if self._peek() == "not":
+            self._take("not")
+            return ("not", self._not())
+        if self._peek() == "(":
+            self._take("(")
+            node = self._or()
+            self._take(")")
+            return node
+        kind, name = self._take("tag").split(":", 1)
+        return ("tag", None if kind == "tag" else int(kind[len("level"):]), name)
+
+
+class Selector:
+    '''
+    description: compiled --select expression
+        tag:name matches tags of any level, levelN:name only tags of level N
+        (0 is the top level), name may use shell wildcards; a term selects
+        the cases under a matching tag or any of its descendants, and/or/not
+        are bitset &, | and complement over the cases of CaseManage;
+        the result is cached per CaseManage version
+        example:
+            selector = compile_select("tag:storage and not tag:slow or level1:replication")
+            cases = manage.cases_of(selector.evaluate(manage))
+    '''
+    def __init__(self, expr: str) -> None:
+        self.expr = expr
+        self._tree = _Parser(expr).parse()
+        self._cache: Tuple[int, int, int] = None
+
+    def evaluate(self, manage: CaseManage) -> int:
+        '''
+        return bitset of the selected case ids of manage
+        '''
+        if self._cache and self._cache[:2] == (id(manage), manage.version):
+            return self._cache[2]
+        bits = self._eval(self._tree, manage, manage.all_cases_bits())
+        self._cache = (id(manage), manage.version, bits)
+        return bits
+
+    def _eval(self, node: tuple, manage: CaseManage, universe: int) -> int:
+        op = node[0]
+        if op == "or":
+            return self._eval(node[1], manage, universe) | self._eval(node[2], manage, universe)
+        if op == "and":
+            return self._eval(node[1], manage, universe) & self._eval(node[2], manage, universe)
+        if op == "not":
+            return universe & ~self._eval(node[1], manage, universe)
+        bits = 0
+        for tag in manage.find_tags(node[2], node[1]):
+            bits |= manage.tag_cases_bits(tag)
+        return bits
+
+
+@functools.lru_cache(maxsize=64)
+def compile_select(expr: str) -> Selector:
+    '''
+    description: parse expr once, raise ValueError on a syntax error
+    '''
+    return Selector(expr)
@@ -1 +1,24 @@
-from .server import Service
\ No newline at end of file
+from ..dataclass import TService
+from .server import Service
+from .mysql import MysqlCom
+from .pgsql import PgCom
+
+
+# service class of every TService
+SERVICES = {
+    TService.MYSQL: MysqlCom,
+    TService.PGSQL: PgCom,
+}
+
+
+def new_service(t) -> Service:
+    '''
+    description: the Service to test for TService t of the command line,
+        a Service is used as it is
+    return Service
+    '''
+    if isinstance(t, Service):
+        return t
+    if t not in SERVICES:
+        raise ValueError(f"no service for {t}, expect one of {[s.name for s in SERVICES]}")
+    return SERVICES[t](t)
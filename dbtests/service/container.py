@@ -0,0 +1,115 @@
+import asyncio
+import time
+
+from typing import Dict, List, Tuple
+
+from ..logger import Logger
+from .server import Service
+
+
+class ContainerBackend:
+    '''
+    description: one isolated server container per case worker
+        containers run on a local docker network with the data dir on tmpfs
+        (unless tmpfs_size is None, a docker commit snapshot skips tmpfs; the
+        data dir is outside the VOLUMEs of the image, which a commit skips as
+        well, and anonymous volumes are removed with their containers),
+        so cases changing global server state can run in parallel; the image
+        is pulled once if it is not present, then all containers start at the
+        same time and are probed for readiness together; every container
+        publishes the service port on 127.0.0.1 and worker i connects to
+        endpoints[i]
+        example:
+            backend = ContainerBackend(service, logger, workers=4)
+            service.endpoints = backend.start()
+            ...
+            backend.stop()
+    '''
+    def __init__(self,
+        service: Service,
+        logger: Logger,
+        workers: int = 1,
+        network: str = "dbtest",
+        image: str = None,
+        tmpfs_size: str = "2g",
+        name_prefix: str = None,
+    ) -> None:
+        self._service = service
+        self._logger = logger
+        self._workers = max(1, workers)
+        self._network = network
+        self._image = image or service.container_image
+        self._tmpfs_size = tmpfs_size
+        self._name_prefix = name_prefix or f"dbtest-{time.strftime('%Y%m%d%H%M%S')}"
+        self.containers: List[str] = []
+
+    async def _docker(self, *args: str, check: bool = True) -> str:
+        proc = await asyncio.create_subprocess_exec(
+            "docker", *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        output, error = await proc.communicate()
+        if check and proc.returncode != 0:
+            raise RuntimeError(f"docker {' '.join(args)} failed: {error.decode().strip()}")
+        return output.decode().strip() if proc.returncode == 0 else None
+
+    def run_args(self) -> List[str]:
+        '''
+        description: docker run options of every container
+        '''
+        args = ["--network", self._network, "-p", f"127.0.0.1::{self._service.container_port}"]
+        if self._tmpfs_size:
+            args += ["--tmpfs", f"{self._service.container_data_dir}:rw,size={self._tmpfs_size}"]
+        for key, value in self._service.container_env().items():
+            args += ["-e", f"{key}={value}"]
+        return args
+
+    async def _prepare(self) -> None:
+        if await self._docker("network", "inspect", self._network, check=False) is None:
+            await self._docker("network", "create", self._network)
+        if await self._docker("image", "inspect", self._image, check=False) is None:
+            self._logger.info(f"pull image {self._image}")
+            await self._docker("pull", self._image)
+
+    async def _start_one(self, name: str) -> Tuple[str, int]:
+        await self._docker("run", "-d", "--name", name, *self.run_args(), self._image, *self._service.container_cmd())
+        # "127.0.0.1:49153"
+        mapping = await self._docker("port", name, str(self._service.container_port))
+        host, port = mapping.splitlines()[0].rsplit(":", 1)
+        return host, int(port)
+
+    async def _start(self) -> List[Tuple[str, int]]:
+        await self._prepare()
+        self.containers = [f"{self._name_prefix}-{i}" for i in range(self._workers)]
+        try:
+            endpoints = await asyncio.gather(*(self._start_one(name) for name in self.containers))
+            ready = await self._service.readiness_probe().wait_all(endpoints)
+        except Exception:
+            await asyncio.gather(*(self._docker("rm", "-f", "-v", name, check=False) for name in self.containers))
+            self.containers = []
+            raise
+        self._service.ready_times.update(ready)
+        return list(endpoints)
+
+    def start(self) -> List[Tuple[str, int]]:
+        '''
+        return [(host, port)] of the containers, one per worker
+        '''
+        start = time.monotonic()
+        endpoints = asyncio.run(self._start())
+        self._logger.info(f"started {len(endpoints)} {self._image} containers in {time.monotonic() - start:.3f}s")
+        return endpoints
+
+    def snapshot_args(self) -> Dict[str, List[str]]:
+        '''
+        return {container: docker run options}, the containers of Snapshotter
+        '''
+        return {name: self.run_args() for name in self.containers}
+
+    def stop(self) -> None:
+        async def _remove():
+            await asyncio.gather(*(self._docker("rm", "-f", "-v", name, check=False) for name in self.containers))
+
+        if self.containers:
+            asyncio.run(_remove())
+            self._logger.info(f"removed containers {self.containers}")
+            self.containers = []
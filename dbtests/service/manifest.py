@@ -0,0 +1,136 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+from typing import Any, Dict, List
+
+from ..util.remote import Remote
+from ..util.transfer import file_sha256
+from .orchestrator import node_config
+from .server import Service
+
+
+class EnvManifest:
+    '''
+    description: what --setup --keep deployed for an env yaml, so a later
+        --use reattaches without a reinstall
+        the manifest lives in root, named after the absolute path of the env
+        yaml, and records:
+            service, package path and sha256, snapshot id, databases and per
+            node host, port, server version and sha256 of the config file
+        validate() checks every node at the same time: the config file on
+        the node, readiness and the server version; nodes that differ are
+        drifted and only they are deployed again
+        example:
+            manifest = EnvManifest("env.yaml")
+            manifest.write(service, nodes, "server.rpm", snap_id)
+            drifted = asyncio.run(manifest.validate(service, remote, nodes))
+    '''
+    root = "~/.dbtest/manifests"
+
+    def __init__(self, env_file: str, root: str = None) -> None:
+        self.env_file = os.path.abspath(env_file)
+        key = hashlib.sha256(self.env_file.encode()).hexdigest()[:12]
+        name = os.path.splitext(os.path.basename(self.env_file))[0]
+        self.path = os.path.join(os.path.expanduser(root or self.root), f"{name}-{key}.json")
+        self.data: Dict[str, Any] = None
+
+    def load(self) -> Dict[str, Any]:
+        '''
+        return the manifest, None if the env was never kept
+        '''
+        try:
+            with open(self.path, "r", encoding="utf8") as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = None
+        return self.data
+
+    def write(self, service: Service, nodes: List[Dict[str, Any]], pkg_path: str = None, snapshot_id: str = None) -> None:
+        self.data = {
+            "env": self.env_file,
+            "service": getattr(service.name, "name", None) or str(service.name),
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "package": {"path": os.path.abspath(pkg_path), "sha256": file_sha256(pkg_path)} if pkg_path else None,
+            "snapshot": snapshot_id,
+            "databases": service.databases,
+            "nodes": {
+                node["host"]: {
+                    "port": node.get("port"),
+                    "version": _server_version(service, node),
+                    "config_sha256": _config_sha256(service, node),
+                }
+                for node in nodes
+            },
+        }
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".tmp", "w", encoding="utf8") as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        os.replace(self.path + ".tmp", self.path)
+
+    def remove(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    async def validate(self, service: Service, remote: Remote, nodes: List[Dict[str, Any]], pkg_path: str = None) -> Dict[str, str]:
+        '''
+        description: compare the nodes of the env yaml with the manifest
+        return {host: reason} of the drifted nodes, empty if all match
+        '''
+        recorded = self.data["nodes"]
+        package = self.data.get("package") or {}
+        new_package = pkg_path and file_sha256(pkg_path) != package.get("sha256")
+        probe = service.readiness_probe(deadline=10)
+
+        async def _check(node) -> str:
+            host = node["host"]
+            if host not in recorded:
+                return "not in manifest"
+            if new_package:
+                return "package changed"
+            if node.get("port") != recorded[host]["port"]:
+                return f"port changed to {node.get('port')}"
+            expected = _config_sha256(service, node)
+            if expected:
+                path = f"{node['config_dir']}/{service.config_file_name}"
+                result = await remote.execute(host, ["sha256sum", path], node["user"], node["private_key"])
+                if not result.ok or result.output.split()[:1] != [expected]:
+                    return f"config {path} changed"
+            if node.get("port"):
+                try:
+                    await probe.wait(host, node["port"])
+                except TimeoutError as e:
+                    return f"not ready: {e}"
+                version = await asyncio.get_event_loop().run_in_executor(None, _server_version, service, node)
+                if version != recorded[host]["version"]:
+                    return f"version {version} instead of {recorded[host]['version']}"
+            return None
+
+        async def _safe_check(node) -> str:
+            try:
+                return await _check(node)
+            except Exception as e:
+                return f"check failed: {e}"
+
+        reasons = await asyncio.gather(*(_safe_check(node) for node in nodes))
+        return {node["host"]: reason for node, reason in zip(nodes, reasons) if reason}
+
+
+def _config_sha256(service: Service, node: Dict[str, Any]) -> str:
+    if node.get("config") is None and not node.get("port"):
+        return None
+    return hashlib.sha256(node_config(service, node).encode("utf8")).hexdigest()
+
+
+def _server_version(service: Service, node: Dict[str, Any]) -> str:
+    if not node.get("port"):
+        return None
+    client = service.new_client(node["host"], node["port"])
+    if client is None:
+        return None
+    try:
+        return str(client.query("select version()")[0][0])
+    finally:
+        client.close()
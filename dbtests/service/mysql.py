@@ -4,11 +4,23 @@ Author: ccp
 return {*}
 Date: 2023-03-14 20:18:01
 '''
+import re
+
+from .readiness import mysql_handshake
 from .server import Service
+from ..client.mysql import MysqlClient
 
 class MysqlCom(Service):
-    def __init__(self, name: str = None, version: str = None) -> None:
-        super().__init__(name, version)
+    config_file_name = "my.cnf"
+    handshake = staticmethod(mysql_handshake)
+    container_image = "mysql:8.0"
+    container_port = 3306
+    # /var/lib/mysql is a VOLUME of the image
+    container_data_dir = "/var/lib/dbtest-mysql"
+    data_dir = "/var/lib/mysql"
+
+    def __init__(self, name: str = None, version: str = None, **kwargs) -> None:
+        super().__init__(name, version, **kwargs)
 
     def install(self, *args, **kwargs):
         return super().install()
@@ -21,6 +33,7 @@ class MysqlCom(Service):
 
     def start(self,
         config=None,
+        nodes=None,
     ):
         '''
             start by:
@@ -28,5 +41,68 @@ class MysqlCom(Service):
                 2. mysql_safe
                 3. mysql_multi
                 4. mysql.server
+            and wait until it is ready
+        '''
+        return super().start(config, nodes)
+
+    def down(self, nodes=None):
+        return super().down(nodes)
+
+    def restart(self, nodes=None):
+        return super().restart(nodes)
+
+    def container_env(self):
+        if self.password:
+            return {"MYSQL_ROOT_PASSWORD": self.password}
+        return {"MYSQL_ALLOW_EMPTY_PASSWORD": "yes"}
+
+    def container_cmd(self):
+        # the entrypoint runs mysqld with arguments starting with -
+        return [f"--datadir={self.container_data_dir}"]
+
+    def render_config(self, config):
+        return "[mysqld]\n" + super().render_config(config)
+
+    def start_cmd(self, node):
+        return node.get("start_cmd") or (
+            f"nohup mysqld --defaults-file={node['config_dir']}/{self.config_file_name} --user=mysql "
+            f">/dev/null 2>&1 &"
+        )
+
+    def stop_cmd(self, node):
+        return node.get("stop_cmd") or (
+            f"mysqladmin -h127.0.0.1 -P{node.get('port', 3306)} -u{node.get('db_user', 'root')} shutdown"
+        )
+
+    def clone_database(self, client, src, dst):
         '''
-        return super().start()
\ No newline at end of file
+            mysql has no template database, tables are created from SHOW CREATE
+            TABLE and copied with INSERT ... SELECT; views and routines are not cloned
+        '''
+        with client.session() as cursor:
+            cursor.execute("SET FOREIGN_KEY_CHECKS = 0")
+            try:
+                cursor.execute(f"DROP DATABASE IF EXISTS `{dst}`")
+                cursor.execute(f"CREATE DATABASE `{dst}`")
+                cursor.execute(
+                    "SELECT table_name FROM information_schema.tables WHERE table_schema = %s AND table_type = 'BASE TABLE'",
+                    (src,),
+                )
+                for (table,) in cursor.fetchall():
+                    cursor.execute(f"SHOW CREATE TABLE `{src}`.`{table}`")
+                    ddl = cursor.fetchone()[1]
+                    # same database references are unqualified, point them to dst
+                    ddl = ddl.replace(f"CREATE TABLE `{table}`", f"CREATE TABLE `{dst}`.`{table}`", 1)
+                    ddl = re.sub(r"REFERENCES `([^`]+)` \(", f"REFERENCES `{dst}`.`\\1` (", ddl)
+                    cursor.execute(ddl)
+                    cursor.execute(f"INSERT INTO `{dst}`.`{table}` SELECT * FROM `{src}`.`{table}`")
+            finally:
+                cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
+
+    def drop_database(self, client, database):
+        client.query(f"DROP DATABASE IF EXISTS `{database}`")
+
+    def new_client(self, host=None, port=None):
+        client = MysqlClient()
+        client.connect(host or self.host, port or self.port, self.user, self.password)
+        return client
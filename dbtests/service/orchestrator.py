@@ -0,0 +1,314 @@
+import asyncio
+import functools
+import json
+import os
+import time
+
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from ..dataclass import StepResult
+from ..logger import Logger
+from ..util.cache import PackageCache
+from ..util.distribute import TreeDistributor
+from ..util.remote import Remote
+from ..util.transfer import file_sha256
+from .server import Service
+
+
+class Step:
+    '''
+    description: one deployment step, runs once every step in deps succeeded
+        action returns True on success, False or an exception on failure
+    '''
+    def __init__(self, name: str, host: Optional[str], action: Callable[[], Awaitable[bool]], deps: List[str] = None) -> None:
+        self.name = name
+        self.host = host
+        self.action = action
+        self.deps = deps or []
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}@{self.host}" if self.host else self.name
+
+
+def _step_key(result: StepResult) -> str:
+    return f"{result.step}@{result.host}" if result.host else result.step
+
+
+def load_nodes(env: Dict[str, Any]) -> List[Dict[str, Any]]:
+    '''
+    description: nodes of an env yaml, top level keys are defaults of every node
+        example:
+            user: root
+            config_dir: /etc/dbtest
+            nodes:
+              - host: node1
+                port: 3306
+                primary: true
+                config: {server_id: 1}
+              - host: node2
+                port: 3306
+                config: {server_id: 2}
+                join_cmd: mysql -e "change master to master_host='{host}', master_port={port}; start slave"
+    '''
+    defaults = {k: v for k, v in env.items() if k != "nodes"}
+    defaults.setdefault("user", "root")
+    defaults.setdefault("private_key", "")
+    defaults.setdefault("config_dir", "/etc/dbtest")
+    defaults.setdefault("pkg_dir", "/tmp/dbtest-pkgs")
+    nodes = [dict(defaults, **node) for node in env.get("nodes") or []]
+    if not nodes:
+        raise ValueError("env yaml has no nodes")
+    return nodes
+
+
+def primary_node(nodes: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return next((node for node in nodes if node.get("primary")), nodes[0])
+
+
+def node_config(service: Service, node: Dict[str, Any]) -> str:
+    '''
+    description: content of the config file of node, the port of the node
+        is part of the config unless the config sets it
+    '''
+    config = dict(node.get("config") or {})
+    if node.get("port"):
+        config.setdefault("port", node["port"])
+    return service.render_config(config)
+
+
+class DeployOrchestrator:
+    '''
+    description: deploy a service on the nodes of an env yaml
+        the deployment is a dag of steps:
+            distribute -> install@node -> config@node -> start@node -> ready@node -> join@node
+        where join of a node also waits for ready of the primary node; steps
+        whose dependencies are done run in parallel across nodes, a failed
+        step is retried alone and the steps depending on it are skipped;
+        ready probes port, handshake and select 1 of the node (readiness.py);
+        hosts the package cache ledger lists with the same package skip
+        distribution and install
+        example:
+            orchestrator = DeployOrchestrator(service, logger)
+            results = orchestrator.deploy(read_yaml("env.yaml"), "server.rpm", run_log_dir)
+    '''
+    # file in the run log dir with the per step timing report
+    report_file_name = "deploy.json"
+
+    def __init__(self,
+        service: Service,
+        logger: Logger,
+        remote: Remote = None,
+        cache: PackageCache = None,
+        retries: int = 2,
+        max_parallel: int = 32,
+        ready_timeout: float = 120.0,
+    ) -> None:
+        self._service = service
+        self._logger = logger
+        self._remote = remote or Remote(logger)
+        self._cache = cache
+        self._retries = retries
+        self._max_parallel = max_parallel
+        self._ready_timeout = ready_timeout
+        self._distributed: Dict[str, bool] = {}
+
+    @property
+    def cache(self) -> PackageCache:
+        if self._cache is None:
+            self._cache = PackageCache()
+        return self._cache
+
+    def plan(self, nodes: List[Dict[str, Any]], pkg_path: str = None, config_root: str = ".", only: List[str] = None) -> List[Step]:
+        '''
+        description: steps deploying nodes, or only the nodes of hosts in only,
+            the others are taken as deployed
+        '''
+        primary = primary_node(nodes)
+        if only is not None:
+            nodes = [node for node in nodes if node["host"] in only]
+        steps = []
+        install_deps = []
+        checksum = file_sha256(pkg_path) if pkg_path else None
+        pkg_name = os.path.basename(pkg_path) if pkg_path else None
+        if pkg_path and nodes:
+            to_install = [node for node in nodes if not self.cache.is_installed(node["host"], self._service_name, checksum)]
+            if to_install:
+                steps.append(Step("distribute", None, functools.partial(self._distribute, pkg_path, to_install)))
+                install_deps = ["distribute"]
+
+        for node in nodes:
+            host = node["host"]
+            deps = []
+            if pkg_path:
+                steps.append(Step("install", host, functools.partial(self._install, node, pkg_path, pkg_name, checksum), install_deps))
+                deps = [f"install@{host}"]
+            if node.get("config") is not None or node.get("port"):
+                steps.append(Step("config", host, functools.partial(self._write_config, node, config_root), deps))
+                deps = [f"config@{host}"]
+            if self._service.start_cmd(node):
+                steps.append(Step("start", host, functools.partial(self._start, node), deps))
+                deps = [f"start@{host}"]
+            if node.get("port"):
+                steps.append(Step("ready", host, functools.partial(self._wait_ready, node), deps))
+                deps = [f"ready@{host}"]
+            if node is not primary and self._service.join_cmd(node, primary):
+                primary_ready = f"ready@{primary['host']}" if primary.get("port") and primary in nodes else None
+                join_deps = deps + ([primary_ready] if primary_ready else [])
+                steps.append(Step("join", host, functools.partial(self._join, node, primary), join_deps))
+        return steps
+
+    def forget(self, nodes: List[Dict[str, Any]]) -> None:
+        '''
+        description: forget the service installed on nodes in the cache
+            ledger, the next deploy installs the package again
+        '''
+        for node in nodes:
+            self.cache.forget_installed(node["host"], self._service_name)
+
+    @property
+    def _service_name(self) -> str:
+        name = self._service.name
+        return getattr(name, "name", None) or str(name)
+
+    async def run(self, steps: List[Step]) -> List[StepResult]:
+        '''
+        description: run steps in dependency order
+        return [StepResult] in the order the steps finished
+        '''
+        pending = {step.key: step for step in steps}
+        unknown = {dep for step in steps for dep in step.deps} - set(pending)
+        if unknown:
+            raise ValueError(f"steps depend on unknown steps {sorted(unknown)}")
+
+        done: Dict[str, bool] = {}
+        results: List[StepResult] = []
+        running: Dict[asyncio.Future, Step] = {}
+        semaphore = asyncio.Semaphore(self._max_parallel)
+        start = time.monotonic()
+
+        while pending or running:
+            progress = False
+            for key, step in list(pending.items()):
+                if any(dep in done and not done[dep] for dep in step.deps):
+                    del pending[key]
+                    done[key] = False
+                    results.append(StepResult(step.name, step.host, "skipped", 0, time.monotonic() - start, 0.0,
+                                              "a dependency failed"))
+                    progress = True
+                elif all(done.get(dep) for dep in step.deps):
+                    del pending[key]
+                    running[asyncio.ensure_future(self._run_step(step, semaphore, start))] = step
+            if not running:
+                if not progress:
+                    raise ValueError(f"dependency cycle in steps {sorted(pending)}")
+                # everything left waits for a skipped step, loop once more to skip it
+                continue
+            finished, _ = await asyncio.wait(list(running), return_when=asyncio.FIRST_COMPLETED)
+            for future in finished:
+                step = running.pop(future)
+                result = future.result()
+                done[step.key] = result.ok
+                results.append(result)
+        return results
+
+    async def _run_step(self, step: Step, semaphore: asyncio.Semaphore, start: float) -> StepResult:
+        async with semaphore:
+            step_start = time.monotonic()
+            error = ""
+            for attempt in range(1, self._retries + 2):
+                try:
+                    ok = await step.action()
+                    error = "" if ok else "step returned failure"
+                except Exception as e:
+                    ok, error = False, str(e)
+                if ok:
+                    self._logger.info(f"step {step.key} done in {time.monotonic() - step_start:.3f}s")
+                    break
+                self._logger.error(f"step {step.key} attempt {attempt} failed: {error}")
+                if attempt <= self._retries:
+                    await asyncio.sleep(min(2 ** (attempt - 1), 10))
+            status = ok if isinstance(ok, str) else ("ok" if ok else "failed")
+            return StepResult(step.name, step.host, status, attempt, step_start - start, time.monotonic() - step_start, error)
+
+    async def _distribute(self, pkg_path: str, nodes: List[Dict[str, Any]]) -> bool:
+        # one relay tree for all nodes, install@node puts the package
+        # directly to a node the tree could not reach
+        node = nodes[0]
+        distributor = TreeDistributor(self._remote, self._logger, user=node["user"], private_key=node["private_key"])
+        results = await distributor.distribute(pkg_path, node["pkg_dir"], [node["host"] for node in nodes])
+        self._distributed = {host: result.ok for host, result in results.items()}
+        return True
+
+    async def _install(self, node: Dict[str, Any], pkg_path: str, pkg_name: str, checksum: str):
+        host = node["host"]
+        if self.cache.is_installed(host, self._service_name, checksum):
+            return "cached"
+        if not self._distributed.get(host):
+            await self._remote.execute(host, ["mkdir", "-p", node["pkg_dir"]], node["user"], node["private_key"])
+            if not await self._put(node, pkg_path, node["pkg_dir"]):
+                return False
+            self._distributed[host] = True
+        result = await self._remote.execute(host, [self._service.install_cmd(f"{node['pkg_dir']}/{pkg_name}")],
+                                            node["user"], node["private_key"])
+        if result.ok:
+            self.cache.mark_installed(host, self._service_name, checksum)
+        else:
+            self._logger.error(f"install on {host} failed: {result.error}")
+        return result.ok
+
+    async def _write_config(self, node: Dict[str, Any], config_root: str) -> bool:
+        host = node["host"]
+        local_dir = os.path.join(config_root, host)
+        os.makedirs(local_dir, exist_ok=True)
+        with open(os.path.join(local_dir, self._service.config_file_name), "w", encoding="utf8") as f:
+            f.write(node_config(self._service, node))
+
+        await self._remote.execute(host, ["mkdir", "-p", node["config_dir"]], node["user"], node["private_key"])
+        return await self._put(node, os.path.join(local_dir, self._service.config_file_name), node["config_dir"])
+
+    async def _put(self, node: Dict[str, Any], file: str, path: str) -> bool:
+        # steps of many nodes share the remote, the credentials go with
+        # every put instead of through connect()
+        return await asyncio.get_event_loop().run_in_executor(
+            None, self._remote.put, node["host"], file, path, node["user"], node["private_key"] or None
+        )
+
+    async def _start(self, node: Dict[str, Any]) -> bool:
+        result = await self._remote.execute(node["host"], [self._service.start_cmd(node)], node["user"], node["private_key"])
+        if not result.ok:
+            self._logger.error(f"start on {node['host']} failed: {result.error}")
+        return result.ok
+
+    async def _wait_ready(self, node: Dict[str, Any]) -> bool:
+        elapse = await self._service.readiness_probe(self._ready_timeout).wait(node["host"], node["port"])
+        self._service.ready_times[f"{node['host']}:{node['port']}"] = elapse
+        return True
+
+    async def _join(self, node: Dict[str, Any], primary: Dict[str, Any]) -> bool:
+        result = await self._remote.execute(node["host"], [self._service.join_cmd(node, primary)], node["user"], node["private_key"])
+        if not result.ok:
+            self._logger.error(f"{node['host']} failed to join {primary['host']}: {result.error}")
+        return result.ok
+
+    def deploy(self, env: Dict[str, Any], pkg_path: str = None, run_log_dir: str = ".", only: List[str] = None) -> List[StepResult]:
+        '''
+        description: deploy the nodes of env (only the hosts in only if given),
+            write the step timing report into run_log_dir and log the slowest steps
+        return [StepResult]
+        '''
+        nodes = load_nodes(env)
+        start = time.monotonic()
+        steps = self.plan(nodes, pkg_path, os.path.join(run_log_dir, "config"), only)
+        results = asyncio.run(self.run(steps))
+        wall = time.monotonic() - start
+        with open(os.path.join(run_log_dir, self.report_file_name), "w", encoding="utf8") as f:
+            json.dump({"wall": wall, "steps": [result.__dict__ for result in results]}, f, ensure_ascii=False, indent=2)
+
+        failed = [result for result in results if not result.ok]
+        self._logger.info(f"deployed {len(nodes) if only is None else len(only)} nodes in {wall:.3f}s, {len(results) - len(failed)}/{len(results)} steps ok")
+        for result in sorted(results, key=lambda result: result.elapse, reverse=True)[:5]:
+            self._logger.info(f"step {_step_key(result)}: {result.status}, {result.elapse:.3f}s, attempts {result.attempts}")
+        for result in failed:
+            self._logger.error(f"step {_step_key(result)} {result.status}: {result.error}")
+        return results
@@ -1,4 +1,78 @@
+from .readiness import pg_handshake
 from .server import  Service
+from ..client.pgsql import PgClient
 
 class PgCom(Service):
-    pass
+    config_file_name = "postgresql.conf"
+    handshake = staticmethod(pg_handshake)
+    container_image = "postgres:15"
+    container_port = 5432
+    # /var/lib/postgresql/data is a VOLUME of the image
+    container_data_dir = "/var/lib/postgresql/dbtest"
+    data_dir = "/var/lib/pgsql/data"
+
+    def __init__(self, name: str = None, version: str = None, **kwargs) -> None:
+        super().__init__(name, version, **kwargs)
+
+    def install(self, *args, **kwargs):
+        return super().install()
+
+    def destroy(self):
+        return super().destroy()
+
+    def use(self):
+        return super().use()
+
+    def start(self,
+        config=None,
+        nodes=None,
+    ):
+        '''
+            start by pg_ctl and wait until it is ready
+        '''
+        return super().start(config, nodes)
+
+    def down(self, nodes=None):
+        return super().down(nodes)
+
+    def restart(self, nodes=None):
+        return super().restart(nodes)
+
+    def container_env(self):
+        env = {"PGDATA": self.container_data_dir}
+        if self.password:
+            env["POSTGRES_PASSWORD"] = self.password
+        else:
+            env["POSTGRES_HOST_AUTH_METHOD"] = "trust"
+        return env
+
+    def start_cmd(self, node):
+        data_dir = node.get("data_dir") or self.data_dir
+        return node.get("start_cmd") or (
+            f"pg_ctl -D {data_dir} -l {data_dir}/dbtest.log "
+            f"-o '-c config_file={node['config_dir']}/{self.config_file_name}' start"
+        )
+
+    def stop_cmd(self, node):
+        return node.get("stop_cmd") or f"pg_ctl -D {node.get('data_dir') or self.data_dir} stop -m fast"
+
+    def clone_database(self, client, src, dst):
+        '''
+            CREATE DATABASE ... TEMPLATE copies the files of src, other
+            sessions on src are terminated since a template must be idle
+        '''
+        with client.session() as cursor:
+            cursor.execute(
+                "SELECT pg_terminate_backend(pid) FROM pg_stat_activity WHERE datname IN (%s, %s) AND pid <> pg_backend_pid()",
+                (src, dst),
+            )
+            cursor.execute(f'DROP DATABASE IF EXISTS "{dst}"')
+            cursor.execute(f'CREATE DATABASE "{dst}" TEMPLATE "{src}"')
+
+    def drop_database(self, client, database):
+        client.query(f'DROP DATABASE IF EXISTS "{database}"')
+
+    def new_client(self, host=None, port=None):
+        client = PgClient()
+        client.connect(host or self.host, port or self.port, self.user, self.password)
+        return client
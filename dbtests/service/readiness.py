@@ -0,0 +1,108 @@
+import asyncio
+import struct
+import time
+
+from typing import Awaitable, Callable, Dict, Iterable, Tuple
+
+
+# first bytes a server sends or answers on a new connection
+async def mysql_handshake(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+    '''
+    description: a ready mysqld greets with a packet of protocol version 10,
+        a starting or overloaded one sends an error packet (0xff)
+    '''
+    header = await reader.readexactly(4)
+    length = int.from_bytes(header[:3], "little")
+    payload = await reader.readexactly(min(length, 1))
+    return payload == b"\x0a"
+
+
+async def pg_handshake(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+    '''
+    description: postgres answers an SSLRequest with S or N once it accepts
+        connections, the postmaster still starting closes the connection
+    '''
+    writer.write(struct.pack("!ii", 8, 80877103))
+    await writer.drain()
+    return await reader.readexactly(1) in (b"S", b"N")
+
+
+class ReadinessProbe:
+    '''
+    description: wait until a service node accepts work
+        the node goes through three probes, each one only after the one
+        before succeeds:
+            1. the port accepts tcp connections
+            2. the protocol handshake answers, if handshake is given
+            3. query() succeeds, e.g. SELECT 1 on a new client, if given
+        failed probes are retried with exponential backoff from
+        initial_delay to max_delay until the deadline
+        example:
+            probe = ReadinessProbe(mysql_handshake, lambda host, port: service.new_client(host, port).query("select 1"))
+            ready_times = await probe.wait_all([(host, 3306) for host in hosts])
+    '''
+    def __init__(self,
+        handshake: Callable[[asyncio.StreamReader, asyncio.StreamWriter], Awaitable[bool]] = None,
+        query: Callable[[str, int], object] = None,
+        deadline: float = 120.0,
+        initial_delay: float = 0.05,
+        max_delay: float = 2.0,
+        connect_timeout: float = 2.0,
+    ) -> None:
+        self._handshake = handshake
+        self._query = query
+        self._deadline = deadline
+        self._initial_delay = initial_delay
+        self._max_delay = max_delay
+        self._connect_timeout = connect_timeout
+
+    async def _probe_socket(self, host: str, port: int) -> bool:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), self._connect_timeout)
+        try:
+            if self._handshake is None:
+                return True
+            return await asyncio.wait_for(self._handshake(reader, writer), self._connect_timeout)
+        finally:
+            writer.close()
+
+    async def _probe_query(self, host: str, port: int) -> bool:
+        if self._query is None:
+            return True
+        await asyncio.get_event_loop().run_in_executor(None, self._query, host, port)
+        return True
+
+    async def wait(self, host: str, port: int) -> float:
+        '''
+        description: wait until host:port passes every probe
+        return seconds until ready, raise TimeoutError after the deadline
+        '''
+        start = time.monotonic()
+        delay = self._initial_delay
+        probes = [self._probe_socket, self._probe_query]
+        error = None
+        while probes:
+            try:
+                if await probes[0](host, port):
+                    # the next probe starts polling fast again
+                    probes.pop(0)
+                    delay = self._initial_delay
+                    continue
+                error = "not ready"
+            except Exception as e:
+                # refused, reset, timed out, or a client error of the query
+                # probe such as a server still in recovery
+                error = e
+            if time.monotonic() - start + delay > self._deadline:
+                raise TimeoutError(f"{host}:{port} not ready in {self._deadline}s: {error}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self._max_delay)
+        return time.monotonic() - start
+
+    async def wait_all(self, nodes: Iterable[Tuple[str, int]]) -> Dict[str, float]:
+        '''
+        description: wait for all nodes at the same time
+        return {"host:port": seconds until ready}, raise TimeoutError if any node is not ready
+        '''
+        nodes = list(dict.fromkeys(nodes))
+        times = await asyncio.gather(*(self.wait(host, port) for host, port in nodes))
+        return {f"{host}:{port}": elapse for (host, port), elapse in zip(nodes, times)}
@@ -1,26 +1,78 @@
+import asyncio
 import platform
 import os
 
 from abc import ABCMeta, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
 
 from ..dataclass import TService as T
+from ..logger import get_basic_logger
 from ..util.remote import Remote
+from .readiness import ReadinessProbe
+
+
+def _run_sync(coroutine):
+    '''
+    description: asyncio.run the coroutine, in a thread of its own when the
+        caller already runs an event loop, which asyncio.run refuses
+    return result of the coroutine
+    '''
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
 
 
 class Service(metaclass=ABCMeta):
     # log file name
     dbtest_log_file_name = "test.log"
+    # case result file name, one json ResultLog per line
+    dbtest_result_file_name = "result.jsonl"
     # taostest log dir variable
     dbtest_log_dir_variable = "DBTEST_LOG_DIR"
+    # config file written into config_dir of every node by --setup
+    config_file_name = "dbtest.cnf"
+    # async (reader, writer) -> bool probing the protocol greeting, see readiness.py
+    handshake = None
+    # seconds a node may take to become ready after start
+    ready_deadline = 120.0
+    # image, service port and data dir of --containers mode, see container.py;
+    # the data dir is kept out of the VOLUMEs the image declares, data in a
+    # volume is not part of a docker commit snapshot
+    container_image = None
+    container_port = None
+    container_data_dir = None
+    # data dir of a node without data_dir in the env yaml, copied by data
+    # dir snapshots, see snapshot.py
+    data_dir = None
     def __init__(self,
             name: T = None,
             version: str = None,
-            host: str = None
+            host: str = None,
+            port: int = None,
+            user: str = None,
+            password: str = None,
         ) -> None:
         self.name = name
         self.version = version
         self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
         self.pkg_path = None
+        # "host:port" -> seconds from start until the node was ready
+        self.ready_times: Dict[str, float] = {}
+        # nodes of the env yaml, see orchestrator.load_nodes
+        self.nodes: List[Dict[str, Any]] = []
+        # databases snapshot by cloning inside the server, see snapshot.py
+        self.databases: List[str] = []
+        # (host, port) of every case worker's own server in --containers mode
+        self.endpoints: List[Tuple[str, int]] = []
+        # logger of the commands start and down run on the nodes
+        self.logger = get_basic_logger()
 
 
     @abstractmethod
@@ -47,6 +99,7 @@ class Service(metaclass=ABCMeta):
     @abstractmethod
     def start(self,
         config : str = None,
+        nodes: List[Dict[str, Any]] = None,
     ):
         '''
             include start type:
@@ -56,17 +109,162 @@ class Service(metaclass=ABCMeta):
                 1. start a db instance
                 2. start part of points
                 3. start all cluster/points instance
+            runs start_cmd on nodes (all nodes by default) and waits until
+            they are ready, subclasses call it through super()
+            return {"host:port": seconds until ready}
         '''
+        return _run_sync(self.start_async(nodes))
 
 
     @abstractmethod
-    def down(self):
+    def down(self, nodes: List[Dict[str, Any]] = None):
         '''
-            service down
+            service down, runs stop_cmd on nodes (all nodes by default)
         '''
+        return _run_sync(self.down_async(nodes))
 
     @abstractmethod
-    def restart(self):
+    def restart(self, nodes: List[Dict[str, Any]] = None):
+        '''
+            restart service, down and start again
+        '''
+        self.down(nodes)
+        return self.start(nodes=nodes)
+
+    async def start_async(self, nodes: List[Dict[str, Any]] = None) -> Dict[str, float]:
+        '''
+            start of callers already running an event loop
+        '''
+        nodes = self.nodes if nodes is None else nodes
+        await self._run_on_nodes(self.start_cmd, nodes)
+        ready_nodes = [(node["host"], node["port"]) for node in nodes if node.get("port")]
+        if not ready_nodes and self.host:
+            ready_nodes = [(self.host, self.port)]
+        return await self.wait_ready_async(ready_nodes) if ready_nodes else {}
+
+    async def down_async(self, nodes: List[Dict[str, Any]] = None) -> None:
+        '''
+            down of callers already running an event loop
+        '''
+        await self._run_on_nodes(self.stop_cmd, self.nodes if nodes is None else nodes)
+
+    async def _run_on_nodes(self, cmd_of, nodes: List[Dict[str, Any]]) -> None:
+        '''
+            run cmd_of(node) on every node having one, in parallel; raise
+            RuntimeError naming the first node it failed on
+        '''
+        remote = Remote(self.logger)
+
+        async def _run(node):
+            cmd = cmd_of(node)
+            if not cmd:
+                return
+            result = await remote.execute(node["host"], [cmd], node.get("user", "root"), node.get("private_key") or "")
+            if not result.ok:
+                raise RuntimeError(f"{cmd} failed on {node['host']}: {result.error}")
+
+        try:
+            await asyncio.gather(*(_run(node) for node in nodes))
+        finally:
+            remote.close()
+
+    def new_client(self, host: str = None, port: int = None):
+        '''
+            return a connected Client of the service (of host:port if given),
+            every case worker calls it once and keeps the client for all
+            cases it runs; None if the service has no client
+        '''
+        return None
+
+    def worker_client(self, worker_id: int = 0):
+        '''
+            client of case worker worker_id, connected to the worker's own
+            server when there are endpoints, else to the shared one
+        '''
+        if self.endpoints:
+            host, port = self.endpoints[worker_id % len(self.endpoints)]
+            return self.new_client(host, port)
+        return self.new_client()
+
+    def container_env(self) -> Dict[str, str]:
+        '''
+            environment variables of a --containers mode container
+        '''
+        return {}
+
+    def container_cmd(self) -> List[str]:
+        '''
+            arguments after the image of a --containers mode container
+        '''
+        return []
+
+    def _ready_query(self, host: str, port: int) -> None:
+        client = self.new_client(host, port)
+        if client is None:
+            return
+        try:
+            client.query("select 1")
+        finally:
+            client.close()
+
+    def readiness_probe(self, deadline: float = None) -> ReadinessProbe:
+        '''
+            probe of port, handshake and select 1 for nodes of this service
+        '''
+        return ReadinessProbe(self.handshake, self._ready_query, deadline or self.ready_deadline)
+
+    async def wait_ready_async(self, nodes: List[Tuple[str, int]] = None) -> Dict[str, float]:
+        '''
+            wait_ready of callers already running an event loop
+        '''
+        times = await self.readiness_probe().wait_all(nodes or [(self.host, self.port)])
+        self.ready_times.update(times)
+        return times
+
+    def wait_ready(self, nodes: List[Tuple[str, int]] = None) -> Dict[str, float]:
+        '''
+            wait until all nodes (host and port of the service by default)
+            are ready instead of sleeping after start or restart, the time
+            each node took is kept in ready_times; inside an event loop
+            await wait_ready_async instead
+            return {"host:port": seconds until ready}
+        '''
+        return _run_sync(self.wait_ready_async(nodes))
+
+    def install_cmd(self, pkg_path: str) -> str:
+        '''
+            shell command installing pkg_path on a node
+        '''
+        return f"yum localinstall -y {pkg_path} || apt-get install -y {pkg_path}"
+
+    def render_config(self, config: Dict[str, Any]) -> str:
+        '''
+            content of config_file_name from the config of a node in the env yaml
+        '''
+        return "".join(f"{k} = {v}\n" for k, v in (config or {}).items())
+
+    def start_cmd(self, node: Dict[str, Any]) -> str:
+        '''
+            shell command starting the service on a node, start_cmd of the
+            node in the env yaml if given
+        '''
+        return node.get("start_cmd")
+
+    def stop_cmd(self, node: Dict[str, Any]) -> str:
+        '''
+            shell command stopping the service on a node, stop_cmd of the
+            node in the env yaml if given
+        '''
+        return node.get("stop_cmd")
+
+    def drop_database(self, client, database: str) -> None:
+        client.query(f"DROP DATABASE IF EXISTS {database}")
+
+    def join_cmd(self, node: Dict[str, Any], primary: Dict[str, Any]) -> str:
         '''
-            restart service
+            shell command joining node to the cluster of primary, None if the
+            node needs no join; join_cmd of the node in the env yaml may use
+            {host} and {port} of the primary
         '''
+        cmd = node.get("join_cmd")
+        return cmd.format(**primary) if cmd else None
@@ -0,0 +1,217 @@
+import asyncio
+import time
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+
+from typing import Any, Dict, List, Tuple
+
+from ..logger import Logger
+from ..util.remote import Remote
+from .server import Service
+
+
+def new_snapshot_id(kind: str) -> str:
+    '''
+    description: snapshot ids start with the kind of snapshot,
+        db (in-database clone), fs (data dir copy) or ct (container commit)
+    '''
+    return f"{kind}-{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+
+def snapshot_database_name(database: str, snap_id: str) -> str:
+    # identifiers are at most 63 (pgsql) or 64 (mysql) characters
+    return f"{database}__{snap_id.replace('-', '_')}"[:63]
+
+
+class ContainerSnapshot:
+    '''
+    description: snapshot of a container by docker commit, restored by
+        recreating the container from the committed image, which keeps the
+        command and environment of the container; tmpfs and volume mounts are
+        not part of a commit, keep data dirs to snapshot in the container file
+        system (Service.container_data_dir)
+    '''
+    def __init__(self, logger: Logger) -> None:
+        self._logger = logger
+
+    async def _docker(self, *args: str) -> str:
+        proc = await asyncio.create_subprocess_exec(
+            "docker", *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        output, error = await proc.communicate()
+        if proc.returncode != 0:
+            raise RuntimeError(f"docker {' '.join(args)} failed: {error.decode().strip()}")
+        return output.decode().strip()
+
+    async def take(self, container: str, snap_id: str) -> str:
+        image = f"dbtest-snapshot:{container}-{snap_id}"
+        await self._docker("commit", container, image)
+        return image
+
+    async def drop(self, container: str, snap_id: str) -> None:
+        await self._docker("image", "rm", "-f", f"dbtest-snapshot:{container}-{snap_id}")
+
+    async def restore(self, container: str, snap_id: str, run_args: List[str], port: int) -> Tuple[str, int]:
+        '''
+        description: replace container by a new one from the snapshot image,
+            run_args are the docker run options the container was created with
+        return (host, port) the new container publishes port on
+        '''
+        # -v, the anonymous volumes of the image go with the container
+        await self._docker("rm", "-f", "-v", container)
+        await self._docker("run", "-d", "--name", container, *run_args, f"dbtest-snapshot:{container}-{snap_id}")
+        # "127.0.0.1:49153", a randomly published port changes with the container
+        host, published = (await self._docker("port", container, str(port))).splitlines()[0].rsplit(":", 1)
+        return host, int(published)
+
+
+class Snapshotter:
+    '''
+    description: snapshot a freshly initialized environment and restore it
+        between runs instead of a destroy and setup; the fastest available
+        way is used:
+            1. databases listed in service.databases are cloned inside the
+               server when the service has clone_database, template database
+               on pgsql, table copies on mysql; inside every server of
+               service.endpoints in --containers mode
+            2. containers (name -> docker run options) are committed, their
+               endpoints change on restore and are updated in the service
+            3. otherwise data_dir of every node (service.data_dir by
+               default) is copied with
+               cp --reflink=auto while the service is stopped, copy on write
+               on btrfs/xfs, a plain copy elsewhere
+        hard links are not used, db servers write data files in place and
+        would change the snapshot as well
+        example:
+            snapshotter = Snapshotter(service, logger)
+            snap_id = snapshotter.snapshot(nodes)
+            ...
+            snapshotter.restore(snap_id, nodes)
+    '''
+    def __init__(self, service: Service, logger: Logger, remote: Remote = None) -> None:
+        self._service = service
+        self._logger = logger
+        self._remote = remote or Remote(logger)
+        self._containers = ContainerSnapshot(logger)
+
+    def snapshot(self, nodes: List[Dict[str, Any]] = None, containers: Dict[str, List[str]] = None) -> str:
+        '''
+        return snapshot id
+        '''
+        start = time.monotonic()
+        if self._service.databases and hasattr(self._service, "clone_database"):
+            snap_id = new_snapshot_id("db")
+            self._clone_databases(snap_id, to_snapshot=True)
+        elif containers:
+            snap_id = new_snapshot_id("ct")
+            asyncio.run(self._each(self._containers.take(name, snap_id) for name in containers))
+        else:
+            snap_id = new_snapshot_id("fs")
+            asyncio.run(self._copy_data_dirs(nodes or self._service.nodes, snap_id, to_snapshot=True))
+        self._logger.info(f"snapshot {snap_id} taken in {time.monotonic() - start:.3f}s")
+        return snap_id
+
+    def restore(self, snap_id: str, nodes: List[Dict[str, Any]] = None, containers: Dict[str, List[str]] = None) -> None:
+        start = time.monotonic()
+        kind = snap_id.split("-", 1)[0]
+        if kind == "db":
+            self._clone_databases(snap_id, to_snapshot=False)
+        elif kind == "ct":
+            port = self._service.container_port
+            endpoints = asyncio.run(self._each(
+                self._containers.restore(name, snap_id, args, port) for name, args in (containers or {}).items()
+            ))
+            self._service.endpoints = list(endpoints)
+            self._service.host, self._service.port = endpoints[0]
+            self._service.wait_ready(self._service.endpoints)
+        elif kind == "fs":
+            asyncio.run(self._copy_data_dirs(nodes or self._service.nodes, snap_id, to_snapshot=False))
+        else:
+            raise ValueError(f"unknown snapshot {snap_id}")
+        self._logger.info(f"snapshot {snap_id} restored in {time.monotonic() - start:.3f}s")
+
+    def drop(self, snap_id: str, nodes: List[Dict[str, Any]] = None, containers: Dict[str, List[str]] = None) -> None:
+        '''
+        description: remove the snapshot when the environment is destroyed
+        '''
+        kind = snap_id.split("-", 1)[0]
+        if kind == "db":
+            def _drop(client):
+                for database in self._service.databases:
+                    self._service.drop_database(client, snapshot_database_name(database, snap_id))
+            self._on_servers(_drop)
+        elif kind == "ct":
+            asyncio.run(self._each(self._containers.drop(name, snap_id) for name in containers or {}))
+        elif kind == "fs":
+            asyncio.run(self._each(
+                self._run(node, f"rm -rf {self._snapshot_dir(node)}/{snap_id}") for node in nodes or self._service.nodes
+            ))
+
+    async def _each(self, coroutines) -> list:
+        return await asyncio.gather(*coroutines)
+
+    def _clone_databases(self, snap_id: str, to_snapshot: bool) -> None:
+        def _clone(client):
+            for database in self._service.databases:
+                snapshot = snapshot_database_name(database, snap_id)
+                src, dst = (database, snapshot) if to_snapshot else (snapshot, database)
+                self._service.clone_database(client, src, dst)
+        self._on_servers(_clone)
+
+    def _on_servers(self, func) -> None:
+        '''
+        description: call func(client) on every server in parallel, the own
+            server of every case worker in --containers mode, else the one of
+            host and port
+        '''
+        endpoints = self._service.endpoints or [(None, None)]
+
+        def _call(endpoint):
+            client = self._service.new_client(*endpoint)
+            try:
+                func(client)
+            finally:
+                client.close()
+
+        with ThreadPoolExecutor(max_workers=len(endpoints)) as executor:
+            list(executor.map(_call, endpoints))
+
+    def _snapshot_dir(self, node: Dict[str, Any]) -> str:
+        return node.get("snapshot_dir", "/var/lib/dbtest/snapshots")
+
+    async def _run(self, node: Dict[str, Any], cmd: str) -> None:
+        result = await self._remote.execute(node["host"], [cmd], node.get("user", "root"), node.get("private_key", ""))
+        if not result.ok:
+            raise RuntimeError(f"{cmd} failed on {node['host']}: {result.error}")
+
+    async def _copy_data_dirs(self, nodes: List[Dict[str, Any]], snap_id: str, to_snapshot: bool) -> None:
+        # check every node before any of them is stopped
+        for node in nodes:
+            if not (node.get("data_dir") or self._service.data_dir):
+                raise ValueError(f"no data_dir for {node['host']}, set data_dir in the env yaml to snapshot it")
+            if not self._service.stop_cmd(node):
+                raise ValueError(f"no stop_cmd for {node['host']}, data dir snapshot needs the service stopped")
+
+        async def _copy(node):
+            data_dir = (node.get("data_dir") or self._service.data_dir).rstrip("/")
+            snapshot = f"{self._snapshot_dir(node)}/{snap_id}"
+            if to_snapshot:
+                src, dst = data_dir, snapshot
+            else:
+                src, dst = snapshot, data_dir
+            await self._run(node, self._service.stop_cmd(node))
+            try:
+                # copy next to the target and swap, an interrupted copy
+                # leaves the target as it was
+                await self._run(node, (
+                    f"mkdir -p {self._snapshot_dir(node)} && rm -rf {dst}.tmp && "
+                    f"cp -a --reflink=auto {src} {dst}.tmp && rm -rf {dst} && mv {dst}.tmp {dst}"
+                ))
+            finally:
+                await self._run(node, self._service.start_cmd(node))
+
+        await self._each(_copy(node) for node in nodes)
+        ready_nodes = [(node["host"], node["port"]) for node in nodes if node.get("port")]
+        if ready_nodes:
+            self._service.ready_times.update(await self._service.readiness_probe().wait_all(ready_nodes))
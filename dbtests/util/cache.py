@@ -0,0 +1,155 @@
+import contextlib
+import fcntl
+import json
+import os
+import shutil
+import time
+
+from typing import Dict, Optional
+
+from .transfer import file_sha256
+
+
+class PackageCache:
+    '''
+    description: content addressed cache of package files
+        files are stored as <root>/objects/<sha256[:2]>/<sha256>, the least
+        recently used ones are evicted when the cache grows over max_bytes;
+        the cache also remembers which package checksum is installed on
+        which host, so a repeated setup skips both transfer and install;
+        index files are updated under a file lock, several dbtest processes
+        may share one cache
+        example:
+            cache = PackageCache()
+            sha = cache.add("server.rpm")
+            cache.lookup(sha)
+            if not cache.is_installed(host, "server", sha):
+                ...
+                cache.mark_installed(host, "server", sha)
+    '''
+    def __init__(self, root: str = "~/.dbtest/cache", max_bytes: int = 10 << 30) -> None:
+        self._root = os.path.expanduser(root)
+        self._max_bytes = max_bytes
+        self._objects = os.path.join(self._root, "objects")
+        self._index_file = os.path.join(self._root, "index.json")
+        self._installed_file = os.path.join(self._root, "installed.json")
+        os.makedirs(self._objects, exist_ok=True)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with open(os.path.join(self._root, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load(self, path: str) -> Dict:
+        try:
+            with open(path, "r", encoding="utf8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _dump(self, path: str, data: Dict) -> None:
+        with open(path + ".tmp", "w", encoding="utf8") as f:
+            json.dump(data, f)
+        os.replace(path + ".tmp", path)
+
+    def _object_path(self, sha256: str) -> str:
+        return os.path.join(self._objects, sha256[:2], sha256)
+
+    def lookup(self, sha256: str) -> Optional[str]:
+        '''
+        description: path of the cached file with this checksum, None on a miss
+        '''
+        path = self._object_path(sha256)
+        if not os.path.exists(path):
+            return None
+        with self._locked():
+            index = self._load(self._index_file)
+            if sha256 in index:
+                index[sha256]["atime"] = time.time()
+                self._dump(self._index_file, index)
+        return path
+
+    def add(self, path: str, sha256: str = None) -> str:
+        '''
+        description: put a copy of a file into the cache, evicting least
+            recently used files over max_bytes; objects are never hard linked,
+            writing to the original file later must not change them
+        return sha256 of the file
+        '''
+        sha256 = sha256 or file_sha256(path)
+        target = self._object_path(sha256)
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            _replace_with_copy(path, target)
+
+        with self._locked():
+            index = self._load(self._index_file)
+            index[sha256] = {"size": os.path.getsize(target), "atime": time.time(), "name": os.path.basename(path)}
+            self._evict(index, keep=sha256)
+            self._dump(self._index_file, index)
+        return sha256
+
+    def _evict(self, index: Dict, keep: str) -> None:
+        total = sum(entry["size"] for entry in index.values())
+        for sha256, entry in sorted(index.items(), key=lambda item: item[1]["atime"]):
+            if total <= self._max_bytes:
+                break
+            if sha256 == keep:
+                continue
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self._object_path(sha256))
+            total -= entry["size"]
+            del index[sha256]
+
+    def copy_to(self, sha256: str, dst: str) -> bool:
+        '''
+        description: copy the cached file to dst (a file or directory), the
+            copy is written next to dst and renamed over it, so a dst linked to
+            anything is replaced instead of written through
+        return False on a cache miss
+        '''
+        path = self.lookup(sha256)
+        if path is None:
+            return False
+        if os.path.isdir(dst):
+            dst = os.path.join(dst, self._load(self._index_file).get(sha256, {}).get("name", sha256))
+        if os.path.exists(dst) and os.path.samefile(path, dst):
+            return True
+        _replace_with_copy(path, dst)
+        return True
+
+    def is_installed(self, host: str, name: str, sha256: str) -> bool:
+        return self._load(self._installed_file).get(host, {}).get(name) == sha256
+
+    def mark_installed(self, host: str, name: str, sha256: str) -> None:
+        with self._locked():
+            installed = self._load(self._installed_file)
+            installed.setdefault(host, {})[name] = sha256
+            self._dump(self._installed_file, installed)
+
+    def forget_installed(self, host: str, name: str = None) -> None:
+        '''
+        description: forget one package (or all packages) installed on host
+        '''
+        with self._locked():
+            installed = self._load(self._installed_file)
+            if name is None:
+                installed.pop(host, None)
+            else:
+                installed.get(host, {}).pop(name, None)
+            self._dump(self._installed_file, installed)
+
+
+def _replace_with_copy(src: str, dst: str) -> None:
+    tmp = f"{dst}.{os.getpid()}.tmp"
+    try:
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp)
+        raise
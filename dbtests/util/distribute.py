@@ -0,0 +1,109 @@
+import asyncio
+import os
+import time
+
+from typing import Dict, List
+
+from ..dataclass import RemoteResult
+from ..logger import Logger
+from .remote import Remote
+from .transfer import file_sha256
+
+
+class TreeDistributor:
+    '''
+    description: copy one file to many hosts, hosts that already have it relay it
+        the controller seeds `seeds` hosts, then every host holding a verified
+        copy sends it on to the next waiting host by scp, so the number of
+        holders about doubles per copy time and N hosts take O(log N) rounds
+        instead of N uploads from the controller; every copy is checked by
+        sha256 on its host and retried from another holder on failure;
+        hosts must be able to scp to each other as `user` without a password
+        example:
+            distributor = TreeDistributor(remote, logger)
+            results = await distributor.distribute("server.rpm", "/tmp/pkgs", hosts)
+    '''
+    def __init__(self, remote: Remote, logger: Logger, seeds: int = 2, retries: int = 2,
+                 user: str = "root", private_key: str = "") -> None:
+        self._remote = remote
+        self._logger = logger
+        self._seeds = max(1, seeds)
+        self._retries = retries
+        self._user = user
+        self._private_key = private_key
+
+    async def distribute(self, src: str, dst_dir: str, hosts: List[str]) -> Dict[str, RemoteResult]:
+        '''
+        description: copy local file src into directory dst_dir of every host
+        return {host: RemoteResult}, output is the host it was copied from,
+            exit_status 0 for verified hosts
+        '''
+        dst = f"{dst_dir.rstrip('/')}/{os.path.basename(src)}"
+        checksum = await asyncio.get_event_loop().run_in_executor(None, file_sha256, src)
+        pending = list(dict.fromkeys(hosts))
+        attempts = {host: 0 for host in pending}
+        results: Dict[str, RemoteResult] = {}
+        start = time.monotonic()
+        servers = []
+
+        async def _copy(holder: str, target: str) -> bool:
+            copy_start = time.monotonic()
+            try:
+                if holder is None:
+                    ok = await self._seed(src, dst, target)
+                else:
+                    ok = await self._relay(holder, dst, target)
+                ok = ok and await self._verify(target, dst, checksum)
+            except Exception as e:
+                self._logger.error(f"copy {dst} from {holder or 'controller'} to {target} failed: {e}")
+                ok = False
+            results[target] = RemoteResult(target, holder or "controller", "", 0 if ok else 1, time.monotonic() - copy_start)
+            if not ok:
+                attempts[target] += 1
+                if attempts[target] <= self._retries:
+                    pending.append(target)
+            return ok
+
+        async def _serve(holder: str) -> None:
+            # a holder keeps sending while hosts are waiting,
+            # every new holder starts serving as well
+            while pending:
+                target = pending.pop(0)
+                if await _copy(holder, target):
+                    servers.append(asyncio.ensure_future(_serve(target)))
+                elif holder is not None and not await self._verify(holder, dst, checksum):
+                    # the holder lost its copy, leave the rest to others
+                    return
+
+        servers.extend(asyncio.ensure_future(_serve(None)) for _ in range(min(self._seeds, len(pending))))
+        # servers spawn servers, wait until no new one shows up
+        while servers:
+            current, servers[:] = list(servers), []
+            await asyncio.gather(*current)
+            if pending and not servers:
+                servers.append(asyncio.ensure_future(_serve(None)))
+
+        verified = sum(1 for result in results.values() if result.ok)
+        self._logger.info(f"distributed {src} to {verified}/{len(attempts)} hosts in {time.monotonic() - start:.3f}s")
+        return results
+
+    async def _seed(self, src: str, dst: str, target: str) -> bool:
+        # seeds run in parallel on one remote, so no connect() per target
+        await self._remote.execute(target, ["mkdir", "-p", os.path.dirname(dst)], self._user, self._private_key)
+        return await asyncio.get_event_loop().run_in_executor(
+            None, self._remote.put, target, src, os.path.dirname(dst), self._user, self._private_key or None
+        )
+
+    async def _relay(self, holder: str, dst: str, target: str) -> bool:
+        await self._remote.execute(target, ["mkdir", "-p", os.path.dirname(dst)], self._user, self._private_key)
+        result = await self._remote.execute(holder, [
+            "scp", "-q", "-o", "BatchMode=yes", "-o", "StrictHostKeyChecking=no",
+            dst, f"{self._user}@{target}:{dst}",
+        ], self._user, self._private_key)
+        if not result.ok:
+            self._logger.error(f"relay {dst} from {holder} to {target} failed: {result.error}")
+        return result.ok
+
+    async def _verify(self, host: str, dst: str, checksum: str) -> bool:
+        result = await self._remote.execute(host, ["sha256sum", dst], self._user, self._private_key)
+        return result.ok and result.output.split()[:1] == [checksum]
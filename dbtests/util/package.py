@@ -1,37 +1,104 @@
+import asyncio
 import platform
 import os
 
 from abc import abstractmethod, ABCMeta
+from typing import Dict, List
 
+from ..dataclass import RemoteResult
+from ..logger import Logger
+from .cache import PackageCache
+from .distribute import TreeDistributor
 from .remote import Remote
+from .transfer import file_sha256
 
-class Package(meta=ABCMeta):
+class Package(metaclass=ABCMeta):
     def __init__(self,
+        logger: Logger,
+        remote: Remote = None,
         pkg_name: str = None,
+        cache: PackageCache = None,
     ):
-        self._pkg_name = None
+        self._pkg_name = pkg_name
         self._version = None
-        self._remote: Remote = None
+        self._logger = logger
+        self._remote = remote or Remote(logger)
+        self._cache = cache
 
+    @property
+    def cache(self) -> PackageCache:
+        if self._cache is None:
+            self._cache = PackageCache()
+        return self._cache
 
-    def get_pkg(self,
+    async def get_pkg(self,
         pkg_path: str = None,
         host: str = None,
         local_path: str = None,
         user: str = None,
-    ) :
-        self._remote.connect(host, user)
-        self._remote.get(pkg_path, local_path)
+    ) -> str:
+        '''
+            copy pkg_path of host into directory local_path,
+            served from the local cache when a package with the same sha256 is there
+            return local file, None on failure
+        '''
+        if not await self._remote.connect(host, user):
+            return None
+        dst = os.path.join(local_path, os.path.basename(pkg_path))
+        result = await self._remote.execute(host, ["sha256sum", pkg_path], user)
+        checksum = result.output.split()[0] if result.ok and result.output else None
+        if checksum and self.cache.copy_to(checksum, dst):
+            self._logger.info(f"get {host}:{pkg_path} from cache {checksum[:12]}")
+            return dst
+
+        if not await asyncio.get_event_loop().run_in_executor(None, self._remote.get, pkg_path, local_path):
+            return None
+        self.cache.add(dst, checksum)
+        return dst
+
+    def install_once(self, package_manager, pkg_path) -> bool:
+        '''
+            install pkg_path on this host unless the cache ledger says the same
+            package is already installed here, a repeated setup with the same
+            package skips the install; remote nodes are installed by
+            DeployOrchestrator which keeps the ledger per node
+            return True if installed now
+        '''
+        host = platform.node()
+        name = self._pkg_name or os.path.basename(pkg_path)
+        checksum = file_sha256(pkg_path)
+        if self.cache.is_installed(host, name, checksum):
+            return False
+        self.install(package_manager, pkg_path)
+        self.cache.mark_installed(host, name, checksum)
+        return True
+
+    async def distribute(self,
+        pkg_path: str,
+        hosts: List[str],
+        dst_dir: str,
+        seeds: int = 2,
+        user: str = "root",
+        private_key: str = "",
+    ) -> Dict[str, RemoteResult]:
+        '''
+            copy local package pkg_path into dst_dir of every host,
+            hosts holding a verified copy relay it to the others
+        '''
+        distributor = TreeDistributor(self._remote, self._logger, seeds, user=user, private_key=private_key)
+        return await distributor.distribute(pkg_path, dst_dir, hosts)
 
     @abstractmethod
     def install(self, package_manager, pkg_path):
         # normal pkg install
         if package_manager == 'yum':
-            os.system(f'yum localinstall {pkg_path}')
+            rc = os.system(f'yum localinstall -y {pkg_path}')
         elif package_manager == 'apt':
-            os.system(f'apt-get install {pkg_path}')
+            rc = os.system(f'apt-get install -y {pkg_path}')
         else:
             raise ValueError(f'Unsupported package manager: {package_manager}')
+        if rc != 0:
+            raise RuntimeError(f'failed to install {pkg_path}, exit status {rc}')
 
     def get_package_manager(self):
         system = platform.system()
@@ -50,5 +117,6 @@ class Package(meta=ABCMeta):
     @abstractmethod
     def destroy(self):
         '''
-            remove the package
+            remove the package, implementations should also call
+            self.cache.forget_installed(host, name) so the next setup installs again
         '''
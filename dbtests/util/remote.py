@@ -1,13 +1,133 @@
 import os
 import platform
 import asyncio
+import atexit
 import shutil
+import time
 import paramiko
 import threading
 
-from typing import List
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Tuple
 
+from ..dataclass import RemoteResult, TransferResult
 from ..logger import Logger
+from .transfer import TransferEngine
+
+
+class TransportPool:
+    '''
+    description: ssh transports kept open per (host, user, private_key)
+        every command opens a new channel on the pooled transport instead of
+        doing a tcp connect, handshake and auth; transports idle for more
+        than idle_timeout seconds are closed, dead ones are reconnected;
+        get() leases the transport until release(), leased transports are
+        never evicted however long a transfer or a connected Remote holds them
+        example:
+            with transport_pool.lease(host, user, private_key) as transport:
+                channel = transport.open_session()
+    '''
+    def __init__(self, idle_timeout: float = 300.0, keepalive: int = 30) -> None:
+        self._idle_timeout = idle_timeout
+        self._keepalive = keepalive
+        self._lock = threading.Lock()
+        # key -> [transport, last used, lock of the key]
+        self._entries: Dict[Tuple, list] = {}
+        # transport -> leases not released yet
+        self._leases: Dict[paramiko.Transport, int] = {}
+
+    def get(self, host: str, user: str, private_key: str = None, password: str = "", port: int = 22) -> paramiko.Transport:
+        '''
+        description: lease the transport of the key, connect it if needed
+        return paramiko.Transport, give it back with release()
+        '''
+        key = (host, port, user, private_key or "")
+        self._evict_idle()
+        with self._lock:
+            entry = self._entries.setdefault(key, [None, 0.0, threading.Lock()])
+        # only one handshake per key, other keys connect in parallel
+        with entry[2]:
+            transport = entry[0]
+            if transport is None or not transport.is_active():
+                if transport is not None:
+                    transport.close()
+                transport = self._connect(host, port, user, private_key, password)
+                entry[0] = transport
+            with self._lock:
+                self._leases[transport] = self._leases.get(transport, 0) + 1
+                entry[1] = time.monotonic()
+            return transport
+
+    def release(self, transport: paramiko.Transport) -> None:
+        with self._lock:
+            leases = self._leases.get(transport, 0) - 1
+            if leases > 0:
+                self._leases[transport] = leases
+            else:
+                self._leases.pop(transport, None)
+            # idle from now on
+            now = time.monotonic()
+            for entry in self._entries.values():
+                if entry[0] is transport:
+                    entry[1] = now
+
+    @contextmanager
+    def lease(self, host: str, user: str, private_key: str = None, password: str = "", port: int = 22):
+        transport = self.get(host, user, private_key, password, port)
+        try:
+            yield transport
+        finally:
+            self.release(transport)
+
+    def _connect(self, host: str, port: int, user: str, private_key: str, password: str) -> paramiko.Transport:
+        if not private_key and not password:
+            default_key = os.path.expanduser("~/.ssh/id_rsa")
+            private_key = default_key if os.path.exists(default_key) else None
+        transport = paramiko.Transport((host, port))
+        try:
+            if private_key:
+                transport.connect(username=user, pkey=paramiko.RSAKey.from_private_key_file(private_key))
+            elif password:
+                transport.connect(username=user, password=password)
+            else:
+                transport.connect(username=user)
+        except Exception:
+            transport.close()
+            raise
+        transport.set_keepalive(self._keepalive)
+        return transport
+
+    def invalidate(self, host: str, user: str, private_key: str = None, port: int = 22) -> None:
+        with self._lock:
+            entry = self._entries.pop((host, port, user, private_key or ""), None)
+        if entry and entry[0]:
+            entry[0].close()
+
+    def _evict_idle(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            idle = [key for key, entry in self._entries.items()
+                    if entry[0] is not None and now - entry[1] > self._idle_timeout
+                    and not entry[2].locked() and entry[0] not in self._leases]
+            evicted = [self._entries.pop(key) for key in idle]
+        for entry in evicted:
+            entry[0].close()
+
+    def close_all(self) -> None:
+        with self._lock:
+            entries, self._entries = list(self._entries.values()), {}
+        for entry in entries:
+            if entry[0]:
+                entry[0].close()
+
+
+# shared by every Remote of the process
+transport_pool = TransportPool()
+atexit.register(transport_pool.close_all)
+
+# blocking paramiko calls of all Remotes run here, never on the event loop
+ssh_executor = ThreadPoolExecutor(max_workers=64, thread_name_prefix="dbtest-ssh")
 
 
 class Remote:
@@ -22,10 +142,24 @@ class Remote:
     param {*} self
     param {Logger} logger
     '''
-    def __init__(self, logger: Logger):
+    def __init__(self, logger: Logger, pool: TransportPool = None):
         self._logger = logger
         self._host = platform.node()
         self._transport = None
+        self._remote_host = None
+        self._user = None
+        self._private_key = None
+        self._password = ""
+        self._pool = pool or transport_pool
+        self._transfer_engine: TransferEngine = None
+
+    @property
+    def _transfer(self) -> TransferEngine:
+        if self._transfer_engine is None:
+            self._transfer_engine = TransferEngine(
+                self._logger, lambda host, user, private_key: self._pool.lease(host, user, private_key, self._password)
+            )
+        return self._transfer_engine
 
     def __enter__(self):
         return self
@@ -46,36 +180,78 @@ class Remote:
             return self._log_error(f"private_key_file {private_key} not found")
 
         try:
-            if private_key:
-                transport = await self._ssh_connect(host, user, private_key)
-            else:
-                transport = paramiko.Transport(host)
-                if password:
-                    transport.connect(username=user, password=password)
-                else:
-                    transport.connect(username=user)
-
+            transport = await self._run_blocking(self._pool.get, host, user, private_key, password)
+            self._release_transport()
             self._transport = transport
+            self._remote_host, self._user, self._private_key, self._password = host, user, private_key, password
             return True
         except Exception as e:
             return self._log_error(f"failed to connect to {host}: {e}")
 
-    async def _ssh_connect(self, host, user, private_key):
-        key = paramiko.RSAKey.from_private_key_file(private_key)
-        transport = paramiko.Transport((host, 22))
-        transport.connect(username=user, pkey=key)
-        return transport
+    async def _run_blocking(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(ssh_executor, func, *args)
 
-    async def _ssh_execute(self, transport: paramiko.Transport, cmd_line: str) -> str:
-        channel = transport.open_session()
-        await asyncio.get_event_loop().run_in_executor(None, channel.exec_command, cmd_line)
-        result = await asyncio.get_event_loop().run_in_executor(None, channel.makefile().read)
-        channel.close()
-        return result.strip()
+    def _release_transport(self) -> None:
+        if self._transport is not None:
+            self._pool.release(self._transport)
+            self._transport = None
 
-    async def remote_cmd(self, host: str, cmds: List[str], user: str="root", private_key: str="") -> str:
+    def _open_channel(self, host: str, user: str, private_key: str) -> Tuple[paramiko.Transport, paramiko.Channel]:
+        '''
+        return (leased transport, channel), release the transport once the channel is closed
+        '''
+        transport = self._pool.get(host, user, private_key)
+        try:
+            return transport, transport.open_session()
+        except (paramiko.SSHException, EOFError, OSError):
+            # the pooled transport died since its last use, reconnect once
+            self._pool.release(transport)
+            self._pool.invalidate(host, user, private_key)
+        transport = self._pool.get(host, user, private_key)
+        try:
+            return transport, transport.open_session()
+        except Exception:
+            self._pool.release(transport)
+            raise
+
+    def _ssh_execute(self, host: str, user: str, private_key: str, cmd_line: str) -> Tuple[str, str, int]:
+        transport, channel = self._open_channel(host, user, private_key)
+        try:
+            channel.exec_command(cmd_line)
+            output, error = self._read_streams(channel)
+            return output.decode(errors="replace").strip(), error.decode(errors="replace").strip(), channel.recv_exit_status()
+        finally:
+            channel.close()
+            self._pool.release(transport)
+
+    @staticmethod
+    def _read_streams(channel: paramiko.Channel) -> Tuple[bytes, bytes]:
+        '''
+        description: read stdout and stderr of channel together until the command exits,
+            reading one to eof first blocks once the other fills its window
+        return (stdout, stderr)
+        '''
+        output, error = [], []
+        while True:
+            if channel.recv_ready():
+                output.append(channel.recv(32768))
+            elif channel.recv_stderr_ready():
+                error.append(channel.recv_stderr(32768))
+            elif channel.exit_status_ready() or channel.closed:
+                # the exit status comes after the data, drain what is left
+                if not channel.recv_ready() and not channel.recv_stderr_ready():
+                    return b"".join(output), b"".join(error)
+            else:
+                time.sleep(0.005)
+
+    async def execute(self, host: str, cmds: List[str], user: str="root", private_key: str="") -> RemoteResult:
+        '''
+        description: run cmds on host, locally if host is this node
+        return RemoteResult with output, error and exit status
+        '''
         cmd_line = " ".join(cmds)
         self._logger.info(f"cmd:{cmds}, is executed on {host}")
+        start = time.monotonic()
         if host == self._host:
             proc = await asyncio.create_subprocess_shell(
                 cmd_line,
@@ -83,73 +259,118 @@ class Remote:
                 stderr=asyncio.subprocess.PIPE
             )
             output, error = await proc.communicate()
-            return output.strip().decode()
+            return RemoteResult(host, output.strip().decode(), error.strip().decode(), proc.returncode, time.monotonic() - start)
+
+        output, error, exit_status = await self._run_blocking(self._ssh_execute, host, user, private_key, cmd_line)
+        return RemoteResult(host, output, error, exit_status, time.monotonic() - start)
+
+    async def remote_cmd(self, host: str, cmds: List[str], user: str="root", private_key: str="") -> str:
+        return (await self.execute(host, cmds, user, private_key)).output
 
-        transport = await self._ssh_connect(host, user, private_key)
-        result = await self._ssh_execute(transport, cmd_line)
-        transport.close()
-        return result
+    async def run_on_hosts(self,
+        hosts: Iterable[str],
+        cmds: List[str],
+        max_parallel: int = 16,
+        user: str = "root",
+        private_key: str = "",
+    ) -> Dict[str, RemoteResult]:
+        '''
+        description: run cmds on every host, at most max_parallel hosts at a time,
+            a failed host does not stop the others
+        return {host: RemoteResult}, exit_status is None if the host could not be reached
+        '''
+        semaphore = asyncio.Semaphore(max_parallel)
 
-    def put(self, host: str, file: str, path: str) -> bool:
+        async def _run(host):
+            async with semaphore:
+                start = time.monotonic()
+                try:
+                    return await self.execute(host, cmds, user, private_key)
+                except Exception as e:
+                    self._logger.error(f"failed to execute {cmds} on {host}: {e}")
+                    return RemoteResult(host, "", str(e), None, time.monotonic() - start)
+
+        hosts = list(dict.fromkeys(hosts))
+        results = await asyncio.gather(*(_run(host) for host in hosts))
+        return dict(zip(hosts, results))
+
+    def submit_put(self, host: str, file: str, path: str, user: str = None, private_key: str = None) -> List[Future]:
+        '''
+        description: start putting file (or directory) into directory path of host
+            as user with private_key, or as the user of connect(host, ...) when
+            user is not given; callers sharing a Remote across hosts pass them
+            since connect() keeps only one host
+        return [Future] of TransferResult, one per file
+        '''
         if not os.path.exists(file):
-            self._logger.error(f"file {file} not found")
-            return False
-        if not os.path.isdir(path):
-            self._logger.error(f"path {path} is not a directory")
-            return False
+            raise FileNotFoundError(f"file {file} not found")
 
         self._logger.info("put %s to %s:%s", file, host, path)
         if host == platform.node():
             os.makedirs(path, exist_ok=True)
+            future = Future()
             if os.path.isdir(file):
                 shutil.copytree(file, os.path.join(path, os.path.basename(file)), dirs_exist_ok=True)
             else:
                 shutil.copy2(file, path)
-            return True
+            future.set_result(TransferResult(host, file, path, os.path.getsize(file) if os.path.isfile(file) else 0, False, 0.0))
+            return [future]
 
-        if not self._transport:
-            self._logger.error("transport is not initialized")
-            return False
+        if user is None:
+            if not self._transport:
+                raise ConnectionError("transport is not initialized")
+            user, private_key = self._user, self._private_key
+
+        dst = f"{path.rstrip('/')}/{os.path.basename(file.rstrip('/'))}"
+        if os.path.isdir(file):
+            return self._transfer.sync_dir(host, file, dst, user, private_key)
+        return [self._transfer.put(host, file, dst, user, private_key)]
 
-        def _put_file():
+    def put(self, host: str, file: str, path: str, user: str = None, private_key: str = None) -> bool:
+        '''
+        description: put file (or directory) into directory path of host and wait,
+            user and private_key as in submit_put
+        return True if every file is transferred or up to date
+        '''
+        try:
+            futures = self.submit_put(host, file, path, user, private_key)
+        except Exception as e:
+            return self._log_error(f"failed to put file {file} to {host}:{path}: {e}")
+        ok = True
+        for future in futures:
             try:
-                with paramiko.SFTPClient.from_transport(self._transport) as sftp:
-                    sftp.put(file, path)
-                self._logger.info(f"put file {file} to {path} successfully")
+                future.result()
             except Exception as e:
-                self._logger.error(f"failed to put file {file} to remote path {path}: {e}")
-
-        threading.Thread(target=_put_file).start()
-        return True
+                ok = self._log_error(f"failed to put file {file} to {host}:{path}: {e}")
+        return ok
 
-    def get(self, file: str, path: str) -> bool:
+    def submit_get(self, file: str, path: str) -> Future:
+        '''
+        description: start getting file of the connected host into directory path
+        return Future of TransferResult
+        '''
         if not os.path.isdir(path):
-            self._logger.error(f"path {path} is not a directory")
-            return False
+            raise NotADirectoryError(f"path {path} is not a directory")
         if not self._transport:
-            self._logger.error("transport is not initialized")
-            return False
+            raise ConnectionError("transport is not initialized")
+        return self._transfer.get(self._remote_host, file, path, self._user, self._private_key)
 
+    def get(self, file: str, path: str) -> bool:
         try:
-            with paramiko.SFTPClient.from_transport(self._transport) as sftp:
-                remote_files = sftp.listdir(os.path.dirname(file))
-                if os.path.basename(file) not in remote_files:
-                    self._logger.error(f"remote file {file} not found")
-                    return False
-                sftp.get(file, path)
-            self._logger.info(f"get file {file} successfully")
+            result = self.submit_get(file, path).result()
+            self._logger.info(f"get file {file} successfully, {result.bytes} bytes transferred")
             return True
         except Exception as e:
-            self._logger.error(f"failed to get file {file}: {e}")
-            return False
+            return self._log_error(f"failed to get file {file}: {e}")
 
-    def delete(self, host, file, password=""):
-        assert self._transport, "not connected"
+    async def delete(self, host, file, user: str = "root", private_key: str = ""):
         filename = os.path.basename(file)
         delete_cmd = f'rm -rf {filename}'
-        self.remote_cmd(host, [delete_cmd], password)
+        return await self.remote_cmd(host, [delete_cmd], user, private_key)
 
     def close(self):
-        if self._transport:
-            self._transport.close()
-            self._transport = None
+        # the transport stays in the pool for the next Remote
+        self._release_transport()
+        if self._transfer_engine:
+            self._transfer_engine.close()
+            self._transfer_engine = None
@@ -0,0 +1,181 @@
+import hashlib
+import os
+import stat
+import threading
+import time
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import paramiko
+
+from ..dataclass import TransferResult
+from ..logger import Logger
+
+
+_checksums: Dict[Tuple[str, float, int], str] = {}
+_checksums_lock = threading.Lock()
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    '''
+    description: sha256 of a local file, cached by path, mtime and size
+    '''
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_mtime, st.st_size)
+    with _checksums_lock:
+        if key in _checksums:
+            return _checksums[key]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    with _checksums_lock:
+        _checksums[key] = digest.hexdigest()
+    return _checksums[key]
+
+
+def remote_sha256(transport: paramiko.Transport, path: str) -> str:
+    '''
+    description: sha256 of a remote file by sha256sum, None if it does not exist
+    '''
+    channel = transport.open_session()
+    try:
+        channel.exec_command(f"sha256sum '{path}' 2>/dev/null")
+        output = channel.makefile("rb").read().decode()
+        if channel.recv_exit_status() != 0 or not output:
+            return None
+        return output.split()[0]
+    finally:
+        channel.close()
+
+
+class TransferEngine:
+    '''
+    description: sftp transfers on a bounded pool of threads
+        files are sent in chunks to "<dst>.part" and renamed when the
+        checksum matches, an interrupted transfer resumes from the size of
+        the part file; a destination with the same sha256 is skipped
+        example:
+            engine = TransferEngine(logger, transport_pool.lease)
+            future = engine.put(host, "server.rpm", "/tmp/server.rpm", user, key)
+            futures = engine.sync_dir(host, "cfg", "/etc/db", user, key)
+            [f.result() for f in [future] + futures]
+    param {lease_transport} (host, user, private_key) -> context manager of paramiko.Transport,
+        the transport is held for the whole transfer
+    '''
+    def __init__(self, logger: Logger, lease_transport, max_workers: int = 8, chunk_size: int = 1 << 20) -> None:
+        self._logger = logger
+        self._lease_transport = lease_transport
+        self._chunk_size = chunk_size
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dbtest-transfer")
+
+    def put(self, host: str, src: str, dst: str, user: str = "root", private_key: str = "") -> Future:
+        return self._executor.submit(self._put, host, src, dst, user, private_key)
+
+    def get(self, host: str, src: str, dst: str, user: str = "root", private_key: str = "") -> Future:
+        return self._executor.submit(self._get, host, src, dst, user, private_key)
+
+    def sync_dir(self, host: str, src_dir: str, dst_dir: str, user: str = "root", private_key: str = "") -> List[Future]:
+        '''
+        description: put every file under src_dir to the same place under dst_dir,
+            unchanged files are skipped by checksum
+        return [Future] of the files
+        '''
+        futures = []
+        with self._lease_transport(host, user, private_key) as transport, paramiko.SFTPClient.from_transport(transport) as sftp:
+            for root, dirs, files in os.walk(src_dir):
+                rel = os.path.relpath(root, src_dir)
+                remote_root = dst_dir if rel == "." else f"{dst_dir}/{rel}"
+                _makedirs(sftp, remote_root)
+                for file in files:
+                    futures.append(self.put(host, os.path.join(root, file), f"{remote_root}/{file}", user, private_key))
+        return futures
+
+    def _put(self, host: str, src: str, dst: str, user: str, private_key: str) -> TransferResult:
+        with self._lease_transport(host, user, private_key) as transport:
+            return self._put_leased(transport, host, src, dst)
+
+    def _put_leased(self, transport: paramiko.Transport, host: str, src: str, dst: str) -> TransferResult:
+        start = time.monotonic()
+        checksum = file_sha256(src)
+        if remote_sha256(transport, dst) == checksum:
+            self._logger.info(f"{host}:{dst} is up to date")
+            return TransferResult(host, src, dst, 0, True, time.monotonic() - start)
+
+        part = dst + ".part"
+        size = os.path.getsize(src)
+        with paramiko.SFTPClient.from_transport(transport) as sftp:
+            for attempt in range(2):
+                offset = _remote_size(sftp, part) if attempt == 0 else 0
+                if offset > size:
+                    offset = 0
+                with open(src, "rb") as f, sftp.open(part, "ab" if offset else "wb") as remote:
+                    remote.set_pipelined(True)
+                    f.seek(offset)
+                    for chunk in iter(lambda: f.read(self._chunk_size), b""):
+                        remote.write(chunk)
+                if remote_sha256(transport, part) == checksum:
+                    sftp.posix_rename(part, dst)
+                    self._logger.info(f"put {src} to {host}:{dst}, {size - offset} bytes")
+                    return TransferResult(host, src, dst, size - offset, False, time.monotonic() - start)
+                # a resumed part file did not belong to this source, start over
+                self._logger.info(f"checksum of {host}:{part} mismatch, transfer again")
+        raise IOError(f"checksum of {host}:{dst} mismatch after transfer")
+
+    def _get(self, host: str, src: str, dst: str, user: str, private_key: str) -> TransferResult:
+        with self._lease_transport(host, user, private_key) as transport:
+            return self._get_leased(transport, host, src, dst)
+
+    def _get_leased(self, transport: paramiko.Transport, host: str, src: str, dst: str) -> TransferResult:
+        start = time.monotonic()
+        if os.path.isdir(dst):
+            dst = os.path.join(dst, os.path.basename(src))
+        checksum = remote_sha256(transport, src)
+        if checksum is None:
+            raise FileNotFoundError(f"remote file {host}:{src} not found")
+        if os.path.exists(dst) and file_sha256(dst) == checksum:
+            self._logger.info(f"{dst} is up to date")
+            return TransferResult(host, src, dst, 0, True, time.monotonic() - start)
+
+        part = dst + ".part"
+        with paramiko.SFTPClient.from_transport(transport) as sftp:
+            size = sftp.stat(src).st_size
+            for attempt in range(2):
+                offset = os.path.getsize(part) if attempt == 0 and os.path.exists(part) else 0
+                if offset > size:
+                    offset = 0
+                with sftp.open(src, "rb") as remote, open(part, "ab" if offset else "wb") as f:
+                    remote.seek(offset)
+                    remote.prefetch(size - offset)
+                    for chunk in iter(lambda: remote.read(self._chunk_size), b""):
+                        f.write(chunk)
+                if file_sha256(part) == checksum:
+                    os.replace(part, dst)
+                    self._logger.info(f"get {host}:{src} to {dst}, {size - offset} bytes")
+                    return TransferResult(host, src, dst, size - offset, False, time.monotonic() - start)
+                self._logger.info(f"checksum of {part} mismatch, transfer again")
+        raise IOError(f"checksum of {dst} mismatch after transfer")
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+def _remote_size(sftp: paramiko.SFTPClient, path: str) -> int:
+    try:
+        return sftp.stat(path).st_size
+    except IOError:
+        return 0
+
+
+def _makedirs(sftp: paramiko.SFTPClient, path: str) -> None:
+    parts = []
+    while path not in ("", "/"):
+        try:
+            if stat.S_ISDIR(sftp.stat(path).st_mode):
+                break
+        except IOError:
+            parts.append(path)
+        path = os.path.dirname(path)
+    for part in reversed(parts):
+        sftp.mkdir(part)